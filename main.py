@@ -4,14 +4,9 @@ import os
 import random
 import sys
 
-import geojson
 import numpy as np
-import shapely
-from shapely import geometry
-from shapely.affinity import scale, translate
-from shapely.ops import transform
 
-from trajallocpy import Agent, CoverageProblem, Experiment, Task, Utility
+from trajallocpy import Agent, Experiment, ScenarioGenerator, Utility
 
 
 def saveResults(experiment_title, results, directory="experiments/"):
@@ -43,6 +38,10 @@ def main(
     capacity,
     show_plots=True,
     debug=False,
+    n_clusters=None,
+    local_search_time=None,
+    animation_file=None,
+    frame_directory=None,
 ):
     results = []
     run_experiment(
@@ -53,6 +52,10 @@ def main(
         debug,
         results,
         "environment.geojson",
+        n_clusters=n_clusters,
+        local_search_time=local_search_time,
+        animation_file=animation_file,
+        frame_directory=frame_directory,
     )
 
     # files = Utility.getAllCoverageFiles(dataset_name)
@@ -60,62 +63,75 @@ def main(
     #     run_experiment(experiment_title, n_agents, capacity, show_plots, debug, results, file_name)
 
 
-def run_experiment(experiment_title, n_agents, capacity, show_plots, debug, results, file_name, export=True):
-    with open(file_name) as json_file:
-        geojson_file = geojson.load(json_file)
-        try:
-            geojson_file["crs"]
-        except KeyError:
-            print("Warning! No CRS is given and can cause odd behaviours!")
-        features = geojson_file["features"]
-
-    geometries = {
-        "obstacles": shapely.MultiPolygon(),
-        "tasks": shapely.MultiLineString(),
-        "boundary": shapely.Polygon(),
-    }
-
-    for feature in features:
-        if feature["geometry"]:
-            geometries[feature["id"]] = geometry.shape(feature["geometry"])
-    number_of_tasks = len(list(geometries["tasks"].geoms))
-
-    # Normalize the geoms
-    min_x, min_y, _, _ = geometries["boundary"].bounds
-    for key in geometries:
-        geometries[key] = translate(geometries[key], -min_x, -min_y)
-
-    print(file_name, " Tasks: ", number_of_tasks)
-    # Initialize coverage problem and the agents
-
-    geometries["boundary"] = geometries["boundary"].buffer(1)
-
-    # Scale each polygon in the MultiPolygon
-    scaled_polygons = []
-    for polygon in geometries["obstacles"].geoms:
-        scaled_polygon = polygon.buffer(-1)  # scale(polygon, xfact=0.95, yfact=0.95, origin="centroid")
-        scaled_polygons.append(scaled_polygon)
-
-        # Create a new MultiPolygon with scaled polygons
-    scaled_multi_polygon = shapely.geometry.MultiPolygon(scaled_polygons)
-    task_list = []
-    for id, task in enumerate(geometries["tasks"].geoms):
-        task_list.append(Task.TrajectoryTask(id, task))
-
-    cp = CoverageProblem.CoverageProblem(
-        restricted_areas=scaled_multi_polygon,
-        search_area=geometries["boundary"],
-        tasks=task_list,
-    )
-
+def create_agents(cp, n_agents, capacity, seed=None):
+    """Places the agents randomly around a random point in the problem, the same seed gives the same agents"""
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
     initial = cp.generate_random_point_in_problem().coords.xy
-    agent_list = [
+    return [
         Agent.config(id, (initial[0][0] + random.uniform(-10, 10), initial[1][0] + random.uniform(-10, 10)), capacity, max_velocity=10)
         for id in range(n_agents)
     ]
-    exp = Experiment.Runner(coverage_problem=cp, enable_plotting=show_plots, agents=agent_list)
 
-    exp.solve(profiling_enabled=False, debug=debug)
+
+def compare_hierarchical(scenarios, n_agents, capacity, n_clusters, seed=123):
+    """Solves each scenario, given as (name, coverage problem) pairs, with flat CBBA and hierarchically over n_clusters task
+    clusters and prints the ratios of the total route cost and the compute time (hierarchical / flat), both modes start from
+    the same agents"""
+    rows = []
+    for name, cp in scenarios:
+        row = [name, cp.getNumberOfTasks()]
+        for clusters in (None, n_clusters):
+            exp = Experiment.Runner(coverage_problem=cp, agents=create_agents(cp, n_agents, capacity, seed))
+            exp.solve(n_clusters=clusters, verbose=False, cluster_seed=seed)
+            _, _, totalRouteCosts, _, computeTime, _, _ = exp.evaluateSolution()
+            row.extend([sum(len(robot.path) for robot in exp.robot_list.values()), totalRouteCosts, computeTime])
+            # Both modes solve the same problem, start the second one without the cached distances of the first
+            Agent.clear_caches(cp.environment)
+        rows.append(row)
+
+    print(f"{'scenario':<40} {'tasks':>7} {'assigned (flat/hier.)':>22} {'cost ratio':>11} {'runtime ratio':>14}")
+    for name, n_tasks, flat_assigned, flat_cost, flat_time, assigned, cost, compute_time in rows:
+        cost_ratio = cost / flat_cost if flat_cost > 0 else float("nan")
+        print(f"{name:<40} {n_tasks:>7} {f'{flat_assigned}/{assigned}':>22} {cost_ratio:>11.3f} {compute_time / flat_time:>14.3f}")
+    return rows
+
+
+def run_experiment(
+    experiment_title,
+    n_agents,
+    capacity,
+    show_plots,
+    debug,
+    results,
+    file_name,
+    export=True,
+    n_clusters=None,
+    local_search_time=None,
+    animation_file=None,
+    frame_directory=None,
+):
+    # Initialize coverage problem and the agents
+    cp = Utility.loadCoverageProblem(file_name, use_sidecar=True)
+    print(file_name, " Tasks: ", cp.getNumberOfTasks())
+
+    agent_list = create_agents(cp, n_agents, capacity)
+    exp = Experiment.Runner(coverage_problem=cp, agents=agent_list)
+
+    # Plot the routes in a separate process, such that the plotting does not slow down the solver
+    plotter = None
+    if show_plots or animation_file is not None or frame_directory is not None:
+        plotter = Utility.LivePlotter(cp, exp.robot_list.values(), animation_file=animation_file, frame_directory=frame_directory, show=show_plots)
+    exp.solve(
+        profiling_enabled=False,
+        debug=debug,
+        n_clusters=n_clusters,
+        local_search_time=local_search_time,
+        callback=None if plotter is None else plotter.update,
+    )
+    if plotter is not None:
+        plotter.close()
 
     # Save the results in a csv file
     (
@@ -127,6 +143,8 @@ def run_experiment(experiment_title, n_agents, capacity, show_plots, debug, resu
         route_list,
         maxRouteCost,
     ) = exp.evaluateSolution()
+    # The experiment is done, release the cached distances of its scenario
+    Agent.clear_caches(cp.environment)
     results.append(
         [
             file_name,
@@ -156,14 +174,36 @@ if __name__ == "__main__":
     parser.add_argument("--capacity", type=int, help="The capacity of the robots given in minutes")
     parser.add_argument("--point_estimation", default=False, type=bool, help="Bool for wether to use point estimation")
     parser.add_argument("--show_plots", default=False, type=bool, help="whether to show plots")
+    parser.add_argument("--n_clusters", default=None, type=int, help="Solve hierarchically by auctioning this number of task clusters")
+    parser.add_argument("--local_search_time", default=None, type=float, help="Time budget in seconds for improving the routes by local search")
+    parser.add_argument("--animation_file", default=None, type=str, help="Write an animation of the solve to this file (e.g. an MP4) with ffmpeg")
+    parser.add_argument("--frame_directory", default=None, type=str, help="Write the frames of the solve to this directory as PNG files")
+    parser.add_argument(
+        "--compare_hierarchical",
+        action="store_true",
+        help="Solve the scenarios of the dataset (or generated ones) flat and over --n_clusters clusters and print the cost and runtime ratios",
+    )
     args = parser.parse_args()
-    if len(sys.argv) > 1:
+    if args.compare_hierarchical:
+        if args.n_clusters is None:
+            parser.error("--compare_hierarchical requires --n_clusters")
+        if args.dataset is not None:
+            file_names = Utility.getAllCoverageFiles(args.dataset)
+            scenarios = ((file_name, Utility.loadCoverageProblem(file_name, use_sidecar=True)) for file_name in file_names)
+        else:
+            scenarios = ((f"generated_{n_tasks}_tasks", ScenarioGenerator.generate_coverage_problem(n_tasks, seed=seed)) for n_tasks in (50, 100))
+        compare_hierarchical(scenarios, args.n_robots, args.capacity, args.n_clusters, seed)
+    elif len(sys.argv) > 1:
         main(
             dataset_name=args.dataset,
             experiment_title=args.experiment_name,
             n_agents=args.n_robots,
             capacity=args.capacity,
             show_plots=args.show_plots,
+            n_clusters=args.n_clusters,
+            local_search_time=args.local_search_time,
+            animation_file=args.animation_file,
+            frame_directory=args.frame_directory,
         )
     else:
         ds = "AC300"
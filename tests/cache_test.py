@@ -0,0 +1,94 @@
+import copy
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import shapely
+
+from trajallocpy import Agent, CoverageProblem
+
+
+def test_bounded_eviction():
+    cache = Agent.EndpointCache(lambda start, end, environment: start[0] + end[0], maxsize=2)
+    cache((0,), (1,))
+    cache((1,), (1,))
+    cache((0,), (1,))
+    cache((2,), (1,))
+    # The least recently used entry is evicted
+    assert ((0,), (1,), None) in cache and ((1,), (1,), None) not in cache
+    assert cache.cache_info() == Agent.CacheInfo(hits=1, misses=3, evictions=1, maxsize=2, currsize=2)
+
+    cache.configure(maxsize=2, policy="fifo")
+    cache((0,), (1,))
+    cache((3,), (1,))
+    assert ((0,), (1,), None) not in cache and ((2,), (1,), None) in cache
+    with pytest.raises(ValueError):
+        cache.configure(policy="random")
+
+
+def test_scope_is_shared_by_environment_copies():
+    problem = CoverageProblem.CoverageProblem([], shapely.box(0, 0, 10, 10), shapely.MultiPolygon())
+    other = CoverageProblem.CoverageProblem([], shapely.box(0, 0, 10, 10), shapely.MultiPolygon())
+    Agent.clear_caches()
+    environment_copy = copy.deepcopy(problem.environment)
+    Agent.getTravelCost((1.0, 1.0), (5.0, 5.0), problem.environment)
+    Agent.getTravelCost((1.0, 1.0), (5.0, 5.0), environment_copy)
+    Agent.getTravelCost((1.0, 1.0), (5.0, 5.0), other.environment)
+    info = Agent.cache_info()
+    assert info["getTravelCost"].hits == 1 and info["getTravelCost"].currsize == 2
+
+    Agent.clear_caches(problem.environment)
+    assert len(Agent.getDistance) == len(Agent.getTravelCost) == 1
+    Agent.clear_caches()
+    assert Agent.cache_info()["getDistance"] == Agent.CacheInfo(0, 0, 0, Agent.DEFAULT_CACHE_SIZE, 0)
+
+
+def test_concurrent_eviction():
+    cache = Agent.EndpointCache(lambda start, end, environment: start[0] * end[0], maxsize=64)
+
+    def lookup(offset):
+        for i in range(20000):
+            assert cache((i % 200 + offset,), (2,)) == (i % 200 + offset) * 2
+
+    # A full cache is shrunk while the other threads insert and move entries, the threads are switched often to expose races
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lookup, range(0, 400, 100)))
+    finally:
+        sys.setswitchinterval(interval)
+    assert len(cache) == 64
+    info = cache.cache_info()
+    assert info.evictions > 0 and info.currsize == 64
+
+
+def test_invalidation_is_scoped_by_problem():
+    boundary = shapely.box(0, 0, 100, 100)
+    problem = CoverageProblem.CoverageProblem([], boundary, shapely.MultiPolygon())
+    other = CoverageProblem.CoverageProblem([], boundary, shapely.MultiPolygon())
+    Agent.clear_caches()
+    for environment in (problem.environment, other.environment):
+        Agent.getTravelCost((10.0, 50.0), (90.0, 50.0), environment)
+    problem.add_restricted_area(shapely.box(45, 40, 55, 60))
+    # Only the entries of the changed problem are evicted
+    assert len(Agent.getDistance) == len(Agent.getTravelCost) == 1
+    assert ((10.0, 50.0), (90.0, 50.0), other.environment.cache_scope) in Agent.getDistance
+
+
+def test_bids_follow_added_restricted_areas():
+    problem = CoverageProblem.CoverageProblem([], shapely.box(0, 0, 100, 100), shapely.MultiPolygon())
+    environment = copy.deepcopy(problem.environment)
+    Agent.clear_caches()
+    starts, ends = [(90.0, 45.0), (90.0, 80.0)], [(95.0, 45.0), (95.0, 80.0)]
+    entry_costs = Agent.getOrientedInsertionCosts((10.0, 50.0), (10.0, 50.0), starts, ends, environment=environment)[0]
+    area_id = problem.add_restricted_area(shapely.box(45, 40, 55, 60), [environment])
+    assert Agent.getDistance((10.0, 50.0), (90.0, 50.0), environment) > 80.0
+    # Only the entry of the task behind the restricted area is affected
+    blocked_costs = Agent.getOrientedInsertionCosts((10.0, 50.0), (10.0, 50.0), starts, ends, environment=environment)[0]
+    assert blocked_costs[0] > entry_costs[0] and blocked_costs[1] == entry_costs[1]
+
+    problem.remove_restricted_area(area_id, [environment])
+    assert Agent.getDistance((10.0, 50.0), (90.0, 50.0), environment) == 80.0
+    assert np.array_equal(Agent.getOrientedInsertionCosts((10.0, 50.0), (10.0, 50.0), starts, ends, environment=environment)[0], entry_costs)
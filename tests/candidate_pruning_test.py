@@ -0,0 +1,17 @@
+import shapely
+
+from trajallocpy import Agent, Task
+
+
+def test_candidate_pruning():
+    tasks = [Task.TrajectoryTask(i, shapely.LineString([(10 * i, 0), (10 * i + 1, 0)])) for i in range(10)]
+    pruner = Agent.CandidatePruner(tasks, k=2)
+    assert pruner.prune({0, 1, 5, 9}, [(0, 0)]) == {0}
+    # Fall back to the nearest eligible tasks further away
+    assert pruner.prune({8, 9}, [(0, 0)]) == {8, 9}
+    assert pruner.total == 6 and pruner.considered == 3
+    assert abs(pruner.pruning_ratio - 0.5) < 1e-12
+
+    pruner = Agent.CandidatePruner(tasks, radius=5)
+    assert pruner.prune({0, 1, 5}, [(51, 0)]) == {5}
+    assert pruner.prune({0, 1}, [(51, 0)]) == {0, 1}
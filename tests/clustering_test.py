@@ -0,0 +1,22 @@
+import numpy as np
+import shapely
+
+from trajallocpy import Clustering, Task
+
+
+def test_cluster_tasks():
+    tasks = [Task.TrajectoryTask(i, shapely.LineString([(x, y), (x + 1, y)])) for i, (x, y) in enumerate([(0, 0), (2, 0), (50, 50), (52, 50)])]
+    for method in ("kmeans", "grid"):
+        labels = Clustering.cluster_tasks(tasks, 2, method)
+        assert labels[0] == labels[1] and labels[2] == labels[3] and labels[0] != labels[2]
+
+    cluster_tasks, members = Clustering.aggregate_clusters(tasks, labels)
+    assert sorted(members) == [[0, 1], [2, 3]]
+    assert all(task.reward == 200 for task in cluster_tasks)
+
+
+def test_kmeans_seed():
+    rng = np.random.default_rng(0)
+    tasks = [Task.TrajectoryTask(i, shapely.LineString(rng.uniform(0, 100, (2, 2)))) for i in range(50)]
+    labels = Clustering.cluster_tasks(tasks, 5, seed=1)
+    assert all(np.array_equal(Clustering.cluster_tasks(tasks, 5, seed=1), labels) for _ in range(5))
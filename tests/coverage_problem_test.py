@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+import shapely
+
+from trajallocpy import CoverageProblem, Task
+
+
+def _path_length(problem, start, goal):
+    return problem.environment.find_shortest_path(start, goal, free_space_after=True, verify=False)[1]
+
+
+def test_incremental_restricted_areas():
+    boundary = shapely.box(0, 0, 100, 100)
+    obstacles = shapely.MultiPolygon([shapely.box(20, 20, 40, 40), shapely.box(60, 10, 70, 50)])
+    problem = CoverageProblem.CoverageProblem([], boundary, obstacles)
+    wall = shapely.box(45, 30, 55, 95)
+
+    area_id = problem.add_restricted_area(wall)
+    rebuilt = CoverageProblem.CoverageProblem([], boundary, shapely.MultiPolygon(list(obstacles.geoms) + [wall]))
+    assert abs(_path_length(problem, (10, 80), (90, 80)) - _path_length(rebuilt, (10, 80), (90, 80))) < 1e-9
+
+    problem.remove_restricted_area(0)
+    problem.remove_restricted_area(area_id)
+    rebuilt = CoverageProblem.CoverageProblem([], boundary, shapely.MultiPolygon([shapely.box(60, 10, 70, 50)]))
+    assert abs(_path_length(problem, (10, 10), (90, 30)) - _path_length(rebuilt, (10, 10), (90, 30))) < 1e-9
+    assert problem.getRestrictedAreaIds() == [1]
+
+
+@pytest.mark.parametrize("method", ["rejection", "triangulation"])
+def test_sample_points_in_free_space(method):
+    obstacles = shapely.MultiPolygon([shapely.box(20, 20, 40, 40), shapely.box(60, 10, 70, 50)])
+    problem = CoverageProblem.CoverageProblem([], shapely.box(0, 0, 100, 100), obstacles)
+    sample = problem.sample_points(500, seed=1, method=method)
+    points = shapely.points(sample.points)
+    assert sample.points.shape == (500, 2)
+    assert shapely.contains(problem.getSearchArea(), points).all() and not shapely.intersects(obstacles, points).any()
+    assert 0.8 < sample.acceptance_rate <= 1.0
+    assert np.array_equal(problem.sample_points(500, seed=1, method=method).points, sample.points)
+
+
+def test_sample_points_in_thin_area():
+    # The search area covers a tiny fraction of its bounds, the points are drawn from its triangulation
+    corridor = shapely.Polygon([(0, 0), (1000, 0), (1000, 1), (1, 1), (1, 1000), (0, 1000)])
+    problem = CoverageProblem.CoverageProblem([], corridor, shapely.MultiPolygon())
+    sample = problem.sample_points(100, seed=1)
+    assert sample.acceptance_rate == 1.0 and shapely.contains_xy(corridor, *sample.points.T).all()
+    with pytest.raises(ValueError):
+        problem.sample_points(1, method="grid")
+    for method in ("rejection", "triangulation"):
+        assert problem.sample_points(0, method=method).points.shape == (0, 2)
+
+
+@pytest.mark.parametrize("clip", [False, True])
+def test_validate_tasks(clip):
+    obstacles = shapely.MultiPolygon([shapely.box(40, 40, 60, 60)])
+    problem = CoverageProblem.CoverageProblem([Task.TrajectoryTask(0, shapely.LineString([(10, 10), (10, 30)]))], shapely.box(0, 0, 100, 100), obstacles)
+    lines = [
+        [(10, 30), (10, 10)],  # The reverse of the existing task
+        [(20, 10), (20, 30)],
+        [(30, 50), (70, 50)],  # Crossing the restricted area
+        [(90, 80), (110, 80)],  # Leaving the search area
+        [(20, 30), (20, 10)],  # The reverse of a preceding task
+        [(30, 40), (50, 40)],  # Along the boundary of the restricted area
+    ]
+    tasks = [Task.TrajectoryTask(7, shapely.LineString(line)) for line in lines]
+    validation = problem.validate_tasks(tasks, clip=clip)
+    assert validation.duplicates.tolist() == [0, 4] and validation.rejected.tolist() == [2, 3]
+    expected = [[(20, 10), (20, 30)], [(30, 40), (50, 40)]]
+    if clip:
+        expected[1:1] = [[(30, 50), (40, 50)], [(60, 50), (70, 50)], [(90, 80), (100, 80)]]
+    assert validation.clipped.tolist() == ([2, 3] if clip else [])
+    assert [[task.start, task.end] for task in validation.tasks] == expected
+
+    added = problem.add_tasks(validation.tasks)
+    assert [task.id for task in problem.getTasks()] == list(range(len(expected) + 1)) and added == problem.getTasks()[1:]
+    # The given tasks are copied instead of renumbered
+    assert [task.id for task in tasks + validation.tasks] == [7] * (len(tasks) + len(expected))
+    assert problem.validate_tasks(validation.tasks).duplicates.tolist() == list(range(len(expected)))
+
+
+def test_clipped_parts_are_deduplicated():
+    obstacles = shapely.MultiPolygon([shapely.box(40, 40, 60, 60)])
+    existing = [Task.TrajectoryTask(0, shapely.LineString([(30, 50), (40, 50)]))]
+    problem = CoverageProblem.CoverageProblem(existing, shapely.box(0, 0, 100, 100), obstacles)
+    # The first part of the first task is the existing task, the second part of the second task is the second part of the first
+    tasks = [Task.TrajectoryTask(i, shapely.LineString(line)) for i, line in enumerate([[(30, 50), (70, 50)], [(35, 50), (70, 50)]])]
+    validation = problem.validate_tasks(tasks, clip=True)
+    assert [[task.start, task.end] for task in validation.tasks] == [[(60, 50), (70, 50)], [(35, 50), (40, 50)]]
+    assert validation.rejected.tolist() == validation.clipped.tolist() == validation.duplicates.tolist() == [0, 1]
+
+
+def test_initial_tasks_are_validated():
+    obstacles = shapely.MultiPolygon([shapely.box(40, 40, 60, 60)])
+    lines = [[(10, 10), (10, 30)], [(30, 50), (70, 50)], [(10, 30), (10, 10)], [(20, 10), (20, 30)]]
+    tasks = [Task.TrajectoryTask(i, shapely.LineString(line)) for i, line in enumerate(lines)]
+    with pytest.warns(UserWarning, match=r"1 of the tasks .*\(0 replaced .* and 1 are duplicates, the 2 valid tasks"):
+        problem = CoverageProblem.CoverageProblem(tasks, shapely.box(0, 0, 100, 100), obstacles)
+    assert problem.task_validation.rejected.tolist() == [1] and problem.task_validation.duplicates.tolist() == [2]
+    assert [(task.id, task.start) for task in problem.getTasks()] == [(0, (10, 10)), (1, (20, 10))]
+    assert tasks[3].id == 3
+    with pytest.warns(UserWarning, match="1 replaced by their clipped parts"):
+        clipped = CoverageProblem.CoverageProblem(tasks, shapely.box(0, 0, 100, 100), obstacles, clip=True)
+    assert clipped.getNumberOfTasks() == 4
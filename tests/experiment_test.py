@@ -0,0 +1,142 @@
+import timeit
+
+import pytest
+import shapely
+
+from trajallocpy import Agent, CoverageProblem, Experiment, Task, Utility
+
+
+def _runner(n_agents=2, **kwargs):
+    boundary = shapely.box(0, 0, 100, 100)
+    obstacles = shapely.MultiPolygon([shapely.box(40, 40, 60, 60)])
+    tasks = [Task.TrajectoryTask(i, shapely.LineString([(10 + 8 * i, 10 + 7 * (i % 3)), (12 + 8 * i, 20 + 7 * (i % 3))])) for i in range(10)]
+    problem = CoverageProblem.CoverageProblem(tasks, boundary, obstacles)
+    return Experiment.Runner(problem, [Agent.config(i, (5 + 5 * i, 5), 1000) for i in range(n_agents)], **kwargs)
+
+
+def test_snapshot_roundtrip(tmp_path):
+    runner = _runner()
+    runner.solve()
+    runner.save_snapshot(tmp_path / "snapshot.npz")
+
+    restored = Experiment.Runner(runner.coverage_problem, [Agent.config(i, (5 + 5 * i, 5), 1000) for i in range(2)])
+    restored.solve(snapshot=Experiment.Runner.load_snapshot(tmp_path / "snapshot.npz"))
+    assert restored.iterations == 0
+    for robot_id, robot in runner.robot_list.items():
+        assert restored.robot_list[robot_id].path == robot.path
+
+
+def test_deadline_resolves_conflicts(monkeypatch):
+    runner = _runner()
+    assert runner.solve(deadline=60)["converged"]
+    assert runner.solve(deadline=0)["deadline_reached"]
+
+    # The deadline passes after the first bundle phase, which leaves tasks claimed by both agents, before their consensus
+    clock = [0.0]
+
+    class TimedExecutor(Experiment.SerialExecutor):
+        def map(self, robots, method, *args):
+            results = super().map(robots, method, *args)
+            clock[0] += 1
+            return results
+
+    monkeypatch.setattr(timeit, "default_timer", lambda: clock[0])
+    monkeypatch.setitem(Experiment.EXECUTORS, "serial", TimedExecutor)
+    runner = _runner(bundle_executor="serial")
+    rounds = []
+    solve_info = runner.solve(deadline=0.5, verbose=False, callback=rounds.append)
+    assert solve_info["deadline_reached"] and solve_info["resolved_conflicts"] > 0
+    claimed = [set(bundle) for bundle in rounds[0].bundles.values()]
+    assert len(claimed[0] & claimed[1]) > 0
+    assert len(set(runner.robot_list[0].path) & set(runner.robot_list[1].path)) == 0
+    assert set(runner.robot_list[0].path) | set(runner.robot_list[1].path) == claimed[0] | claimed[1]
+
+
+def test_solve_rounds(capsys):
+    runner = _runner()
+    rounds = []
+    runner.solve(verbose=False, callback=rounds.append)
+    assert capsys.readouterr().out == ""
+    assert len(rounds) == runner.iterations + 1
+    assert rounds[-1].bundles == {robot_id: robot.bundle for robot_id, robot in runner.robot_list.items()}
+    assert all(len(round_info.bids[robot_id]) == len(round_info.bundles[robot_id]) for round_info in rounds for robot_id in runner.robot_list)
+
+    streamed = _runner()
+    assert [round_info.bundles for round_info in streamed.solve_iter(verbose=False)] == [round_info.bundles for round_info in rounds]
+
+
+def test_stopped_solve_cleans_up(monkeypatch):
+    closed = []
+
+    class RecordingPlotter:
+        def __init__(self, coverage_problem, robot_list):
+            pass
+
+        def update(self, round_info):
+            pass
+
+        def close(self, wait=True, text=None):
+            closed.append(text)
+
+    def stop(round_info):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(Utility, "LivePlotter", RecordingPlotter)
+    runner = _runner(enable_plotting=True)
+    for robot in runner.robot_list.values():
+        robot.auction_tasks = {0, 1}
+    rounds = runner.solve_iter(verbose=False)
+    next(rounds)
+    rounds.close()
+    assert len(closed) == 1 and all(robot.auction_tasks is None for robot in runner.robot_list.values())
+
+    for robot in runner.robot_list.values():
+        robot.auction_tasks = {0, 1}
+    with pytest.raises(KeyboardInterrupt):
+        runner.solve(verbose=False, callback=stop)
+    assert len(closed) == 2 and all(robot.auction_tasks is None for robot in runner.robot_list.values())
+
+
+def test_hierarchical_solve(monkeypatch):
+    bundles = []
+    for _ in range(2):
+        runner = _runner(3)
+        # The clusters are auctioned in the environments of the agents, no visibility graph is built for them
+        monkeypatch.setattr(CoverageProblem.IncrementalPolygonEnvironment, "store", None)
+        runner.solve(n_clusters=3, cluster_seed=0, verbose=False)
+        monkeypatch.undo()
+        bundles.append({robot_id: robot.bundle for robot_id, robot in runner.robot_list.items()})
+        assert sorted(task for bundle in bundles[-1].values() for task in bundle) == list(range(10))
+    assert bundles[0] == bundles[1]
+
+
+@pytest.mark.parametrize(
+    "executors",
+    [
+        {"bundle_executor": "serial"},
+        {"bundle_executor": "processes"},
+        {"consensus_executor": "threads"},
+        {"consensus_executor": "processes"},
+        {"consensus_executor": "threads", "use_kernels": True},
+    ],
+)
+def test_executors_are_deterministic(executors):
+    rounds = list(_runner(3, bundle_executor="threads").solve_iter(verbose=False))
+    parallel_rounds = list(_runner(3, **executors).solve_iter(verbose=False))
+    assert [r.bundles for r in parallel_rounds] == [r.bundles for r in rounds]
+    assert [r.bids for r in parallel_rounds] == [r.bids for r in rounds]
+
+
+def test_select_executor(monkeypatch):
+    monkeypatch.setattr(Experiment.os, "cpu_count", lambda: 8)
+    assert Experiment.select_executor(10) == "threads"
+    assert Experiment.select_executor(100) == "processes"
+    assert Experiment.select_executor(100, use_kernels=True) == "threads"
+    monkeypatch.setattr(Experiment.os, "cpu_count", lambda: 1)
+    assert Experiment.select_executor(1000) == "threads"
+    assert Experiment.select_consensus_executor() == "serial"
+    assert Experiment.select_consensus_executor(use_kernels=True) == "serial"
+    monkeypatch.setattr(Experiment.os, "cpu_count", lambda: 8)
+    assert Experiment.select_consensus_executor(use_kernels=True) == "threads"
+    with pytest.raises(ValueError):
+        _runner(bundle_executor="pool")
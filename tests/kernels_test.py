@@ -0,0 +1,108 @@
+import copy
+
+import numpy as np
+import pytest
+import shapely
+
+from trajallocpy import CBBA, Agent, Task
+
+
+@pytest.mark.parametrize("max_velocity, max_acceleration", [(5, 2), (15, 3)])
+def test_kernels_match_python_scores(max_velocity, max_acceleration):
+    rng = np.random.default_rng(1)
+    tasks = [Task.TrajectoryTask(i, shapely.LineString(rng.uniform(0, 100, (2, 2)))) for i in range(15)]
+    robot = CBBA.agent(
+        shapely.Point(50, 50), 0, number_of_agents=1, capacity=1000, tasks=tasks, max_velocity=max_velocity, max_acceleration=max_acceleration
+    )
+    for _ in range(4):
+        robot.use_kernels = False
+        expected = robot.getCij()
+        python_cost = Agent.getTotalTravelCost(robot.state, robot.getPathTasks(), robot.environment, robot.profile)
+        robot.use_kernels = True
+        result = robot.getCij()
+        for a, b in zip(expected[:3], result[:3]):
+            assert np.array_equal(a, b)
+        assert robot.getTotalTravelCost() == python_cost
+
+        j = int(np.argmax(result[1]))
+        if result[2][j]:
+            robot.reverse_task(j)
+        robot.bundle.append(j)
+        robot.path.insert(result[0][j], j)
+        robot.update_path_costs()
+        assert abs(robot.path_cost - robot.getTotalTravelCost()) < 1e-9
+
+
+def test_oriented_insertion_costs():
+    rng = np.random.default_rng(2)
+    tasks = [Task.TrajectoryTask(i, shapely.LineString(rng.uniform(0, 100, (2, 2)))) for i in range(20)]
+    previous_end, next_start = (10.0, 20.0), (80.0, 70.0)
+    entry_costs, exit_costs, is_reversed = Agent.getOrientedInsertionCosts(
+        previous_end, next_start, [task.start for task in tasks], [task.end for task in tasks]
+    )
+    assert is_reversed.any() and not is_reversed.all()
+    for task, entry_cost, exit_cost, should_reverse in zip(tasks, entry_costs, exit_costs, is_reversed):
+        oriented = task.reversed_copy() if should_reverse else task
+        assert abs(entry_cost - Agent.getTravelCost(previous_end, oriented.start)) < 1e-9
+        assert abs(exit_cost - Agent.getTravelCost(oriented.end, next_start)) < 1e-9
+        assert entry_cost + exit_cost <= Agent.getTravelCost(previous_end, task.start) + Agent.getTravelCost(task.end, next_start) + 1e-9
+
+
+def test_profiles_price_travel():
+    rng = np.random.default_rng(3)
+    tasks = [Task.TrajectoryTask(i, shapely.LineString(rng.uniform(0, 100, (2, 2)))) for i in range(10)]
+    fast = Agent.KinematicProfile(20.0, 4.0)
+    slow = Agent.KinematicProfile(2.0, 1.0)
+    distances = np.array([Agent.getDistance((0.0, 0.0), task.start) for task in tasks])
+    for profile in (fast, slow):
+        assert np.array_equal(profile.costs(distances), [Agent.getTravelCost((0.0, 0.0), task.start, None, profile) for task in tasks])
+    assert Agent.getTotalTravelCost((50.0, 50.0), tasks, None, fast) < Agent.getTotalTravelCost((50.0, 50.0), tasks, None, slow)
+
+
+def test_kernels_respect_point_estimation():
+    rng = np.random.default_rng(4)
+    tasks = [Task.TrajectoryTask(i, shapely.LineString(rng.uniform(0, 100, (2, 2)))) for i in range(15)]
+    robot = CBBA.agent(shapely.Point(50, 50), 0, number_of_agents=1, capacity=1000, tasks=tasks, point_estimation=True)
+    # With a task in the path the tasks are entered and left from different points, thus reversing them could be cheaper
+    robot.bundle.append(0)
+    robot.path.append(0)
+    robot.update_path_costs()
+    robot.use_kernels = False
+    expected = robot.getCij()
+    robot.use_kernels = True
+    result = robot.getCij()
+    assert not result[2].any()
+    for a, b in zip(expected[:3], result[:3]):
+        assert np.array_equal(a, b)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_consensus_kernel_matches_python(seed):
+    rng = np.random.default_rng(seed)
+    n_agents, n_tasks = 4, 12
+    tasks = [Task.TrajectoryTask(i, shapely.LineString(rng.uniform(0, 100, (2, 2)))) for i in range(n_tasks)]
+    robot = CBBA.agent(shapely.Point(50, 50), 1, number_of_agents=n_agents, capacity=1000, tasks=tasks)
+    robot.winning_bids = rng.choice([0.0, 1.0, 2.0], n_tasks)
+    robot.winning_agents = rng.integers(-1, n_agents, n_tasks)
+    robot.bundle = rng.permutation(n_tasks)[:5].tolist()
+    robot.winning_agents[robot.bundle] = robot.id
+    robot.path = sorted(robot.bundle)
+    robot.timestamps = dict(enumerate(rng.integers(0, 4, n_agents).tolist()))
+    robot.time_step = 4
+    robot.auction_tasks = set()
+
+    def message():
+        # Few distinct bids, such that the tie breaking rules are exercised as well
+        timestamps = dict(enumerate(rng.integers(0, 4, n_agents).tolist()))
+        return rng.choice([0.0, 1.0, 2.0], n_tasks).tolist(), rng.integers(-1, n_agents, n_tasks).tolist(), timestamps
+
+    robot.receive_message({k: message() for k in (0, 3)})
+    expected, result = copy.deepcopy(robot), robot
+    expected.update_task()
+    result.use_kernels = True
+    result.update_task()
+    assert np.array_equal(expected.winning_bids, result.winning_bids)
+    assert np.array_equal(expected.winning_agents, result.winning_agents)
+    assert np.array_equal(expected.removal_list, result.removal_list)
+    assert (expected.bundle, expected.path, expected.timestamps) == (result.bundle, result.path, result.timestamps)
+    assert expected.auction_tasks == result.auction_tasks and expected.time_step == result.time_step
@@ -0,0 +1,45 @@
+import itertools
+import queue
+
+import numpy as np
+import shapely
+
+from trajallocpy import CBBA, Agent, LocalSearch, Task
+
+
+def make_tasks(seed, n):
+    rng = np.random.default_rng(seed)
+    return [Task.TrajectoryTask(i, shapely.LineString(rng.uniform(0, 100, (2, 2)))) for i in range(n)]
+
+
+def test_improve_route_untangles_crossed_route():
+    # The sides of a square visited in a crossing order: left, right, top, bottom
+    sides = [[(0, 30), (0, 70)], [(100, 70), (100, 30)], [(30, 100), (70, 100)], [(70, 0), (30, 0)]]
+    tasks = [Task.TrajectoryTask(i, shapely.LineString(side)) for i, side in enumerate(sides)]
+    state = (10.0, 0.0)
+    table = LocalSearch.endpoint_cost_table(state, tasks, None)
+    identity = np.arange(len(tasks)), np.zeros(len(tasks), dtype=bool)
+    costs = [LocalSearch.route_cost(table, *identity)]
+
+    def record(order, flipped):
+        costs.append(LocalSearch.route_cost(table, order, flipped))
+        return True
+
+    order, flipped = LocalSearch.improve_route(table, is_feasible=record)
+    assert sorted(order) == list(range(len(tasks)))
+    assert all(cost < previous for previous, cost in itertools.pairwise(costs))
+    assert LocalSearch.route_cost(table, order, flipped) == costs[-1] < costs[0]
+    route = [state, *(point for i in order for point in (tasks[i].coords[::-1] if flipped[i] else tasks[i].coords))]
+    assert shapely.LinearRing(route).is_simple
+
+
+def test_improve_path_keeps_bundle():
+    tasks = make_tasks(6, 25)
+    robot = CBBA.agent(shapely.Point(50, 50), 0, number_of_agents=1, capacity=1000, tasks=tasks)
+    robot.build_bundle(queue.Queue())
+    bundle = sorted(robot.bundle)
+    cost = robot.path_cost
+    robot.improve_path(queue.Queue(), time_budget=5)
+    assert sorted(robot.path) == bundle
+    assert robot.path_cost <= cost
+    assert abs(robot.path_cost - Agent.getTotalTravelCost(robot.state, robot.getPathTasks(), robot.environment)) < 1e-9
@@ -0,0 +1,65 @@
+import pytest
+import shapely
+from matplotlib.animation import FFMpegWriter
+from PIL import Image
+
+from trajallocpy import Agent, CoverageProblem, Experiment, Task, Utility
+
+
+def _runner(**kwargs):
+    tasks = [Task.TrajectoryTask(i, shapely.LineString([(10 + 8 * i, 10), (12 + 8 * i, 30)])) for i in range(8)]
+    problem = CoverageProblem.CoverageProblem(tasks, shapely.box(0, 0, 100, 100), shapely.MultiPolygon([shapely.box(40, 40, 60, 60)]))
+    return Experiment.Runner(problem, [Agent.config(i, (5 + 5 * i, 5), 1000) for i in range(2)], **kwargs)
+
+
+def test_live_plotter_writes_frames(tmp_path):
+    runner = _runner()
+    plotter = Utility.LivePlotter(runner.coverage_problem, runner.robot_list.values(), max_fps=1000, frame_directory=tmp_path, show=False)
+    runner.solve(verbose=False, callback=plotter.update)
+    plotter.close(text="Final routes")
+    assert plotter.process.exitcode == 0
+    frames = sorted(tmp_path.glob("frame_*.png"))
+    assert 1 <= len(frames) <= runner.iterations + 2
+    with Image.open(frames[-1]) as frame:
+        assert frame.width > 0
+
+
+@pytest.mark.skipif(not FFMpegWriter.isAvailable(), reason="ffmpeg is not installed")
+def test_live_plotter_writes_animation(tmp_path):
+    runner = _runner()
+    animation_file = tmp_path / "solve.gif"
+    plotter = Utility.LivePlotter(runner.coverage_problem, runner.robot_list.values(), max_fps=1000, animation_file=animation_file, show=False)
+    runner.solve(verbose=False, callback=plotter.update)
+    plotter.close()
+    assert plotter.process.exitcode == 0
+    with Image.open(animation_file) as animation:
+        assert animation.n_frames >= 1
+
+
+def test_animation_requires_ffmpeg(monkeypatch, tmp_path):
+    monkeypatch.setattr(FFMpegWriter, "isAvailable", classmethod(lambda cls: False))
+    runner = _runner()
+    with pytest.raises(ValueError):
+        Utility.LivePlotter(runner.coverage_problem, runner.robot_list.values(), animation_file=tmp_path / "solve.mp4", show=False)
+
+
+def test_runner_plots_in_live_plotter(monkeypatch):
+    plotters = []
+
+    class RecordingPlotter:
+        def __init__(self, coverage_problem, robot_list):
+            self.iterations, self.final = [], None
+            plotters.append(self)
+
+        def update(self, round_info):
+            self.iterations.append(round_info.iteration)
+
+        def close(self, wait=True, text=None):
+            self.final = text
+
+    monkeypatch.setattr(Utility, "LivePlotter", RecordingPlotter)
+    # Nothing is drawn on the solver thread
+    monkeypatch.setattr(Utility.plt, "pause", None)
+    runner = _runner(enable_plotting=True)
+    runner.solve(verbose=False)
+    assert len(plotters) == 1 and plotters[0].iterations == list(range(runner.iterations + 1)) and plotters[0].final is not None
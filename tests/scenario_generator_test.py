@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+import shapely
+
+from trajallocpy import Agent, Experiment, ScenarioGenerator, Utility
+
+
+@pytest.mark.parametrize("obstacle_layout", ["random", "clustered"])
+def test_generated_tasks_avoid_obstacles(obstacle_layout):
+    arrays = ScenarioGenerator.generate_arrays(300, n_obstacles=12, obstacle_layout=obstacle_layout, seed=7)
+    regenerated = ScenarioGenerator.generate_arrays(300, n_obstacles=12, obstacle_layout=obstacle_layout, seed=7)
+    assert all(np.array_equal(arrays[key][0], regenerated[key][0]) for key in arrays)
+
+    problem = ScenarioGenerator.generate_coverage_problem(300, n_obstacles=12, obstacle_layout=obstacle_layout, seed=7)
+    lines = shapely.linestrings([[task.start, task.end] for task in problem.getTasks()])
+    assert problem.getNumberOfTasks() == 300
+    assert len(problem.getRestrictedAreas().geoms) > 0
+    assert not shapely.intersects(lines, problem.getRestrictedAreas()).any()
+    assert shapely.within(lines, problem.getSearchArea()).all()
+
+
+def test_exported_scenario_loads_identically(tmp_path):
+    arrays = ScenarioGenerator.generate_arrays(50, n_obstacles=5, seed=1)
+    ScenarioGenerator.export_geojson(arrays, tmp_path / "scenario.geojson")
+    loaded = Utility.loadCoverageProblem(str(tmp_path / "scenario.geojson"))
+    generated = ScenarioGenerator.generate_coverage_problem(50, n_obstacles=5, seed=1)
+    assert [(task.start, task.end) for task in loaded.getTasks()] == [(task.start, task.end) for task in generated.getTasks()]
+    assert loaded.getRestrictedAreas().equals(generated.getRestrictedAreas())
+    # The generated problem can be solved
+    runner = Experiment.Runner(generated, [Agent.config(i, (5 + 5 * i, 3), 10000) for i in range(2)])
+    assert runner.solve(verbose=False)["converged"]
+    assert sorted(task for robot in runner.robot_list.values() for task in robot.path) == list(range(50))
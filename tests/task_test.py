@@ -0,0 +1,30 @@
+import queue
+
+import numpy as np
+import shapely
+
+from trajallocpy import CBBA, Task
+
+
+def test_reverse_keeps_geometry():
+    trajectory = shapely.LineString([(0, 0), (1, 0), (1, 2)])
+    task = Task.TrajectoryTask(0, trajectory)
+    reversed_task = task.reversed_copy()
+    assert reversed_task.trajectory is trajectory
+    assert (reversed_task.start, reversed_task.end) == (task.end, task.start)
+    assert list(reversed_task.coords) == list(trajectory.coords)[::-1]
+    reversed_task.reverse()
+    assert (reversed_task.start, reversed_task.end, list(reversed_task.coords)) == (task.start, task.end, list(task.coords))
+
+
+def test_agents_share_tasks():
+    rng = np.random.default_rng(7)
+    tasks = [Task.TrajectoryTask(i, shapely.LineString(rng.uniform(0, 100, (2, 2)))) for i in range(20)]
+    endpoints = [(task.start, task.end) for task in tasks]
+    robot = CBBA.agent(shapely.Point(50, 50), 0, number_of_agents=1, capacity=1000, tasks=tasks)
+    robot.build_bundle(queue.Queue())
+    assert robot.is_reversed.any()
+    assert [(task.start, task.end) for task in tasks] == endpoints
+    for j, task in enumerate(robot.tasks):
+        assert task.reversed == robot.is_reversed[j]
+        assert tuple(robot.starts[j]) == task.start
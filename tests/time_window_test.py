@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import shapely
+
+from trajallocpy import CBBA, Agent, Task
+
+
+def make_tasks(rng, n):
+    tasks = []
+    for i in range(n):
+        start_time = rng.uniform(0, 60)
+        tasks.append(Task.TrajectoryTask(i, shapely.LineString(rng.uniform(0, 100, (2, 2))), start_time=start_time, end_time=start_time + rng.uniform(5, 60)))
+    return tasks
+
+
+def is_schedule_feasible(state, task_list):
+    times, _ = Agent.getScheduleTimes(state, task_list, None)
+    return all(time <= task.getLatestStartTime() for time, task in zip(times, task_list))
+
+
+def test_slack_feasibility_matches_schedule():
+    rng = np.random.default_rng(2)
+    tasks = make_tasks(rng, 40)
+    state = (50.0, 50.0)
+    path = []
+    for j in range(len(tasks)):
+        times, slack = Agent.getScheduleTimes(state, path, None)
+        for n in range(len(path) + 1):
+            expected = is_schedule_feasible(state, path[:n] + [tasks[j]] + path[n:])
+            assert Agent.isTimeWindowFeasible(state, path, times, slack, n, tasks[j], None) == expected
+        feasible = [n for n in range(len(path) + 1) if Agent.isTimeWindowFeasible(state, path, times, slack, n, tasks[j], None)]
+        if feasible:
+            path.insert(feasible[-1], tasks[j])
+
+
+def test_bundle_respects_time_windows():
+    rng = np.random.default_rng(3)
+    tasks = make_tasks(rng, 30)
+    for use_kernels in (False, True):
+        robot = CBBA.agent(shapely.Point(50, 50), 0, number_of_agents=1, capacity=1000, tasks=tasks, use_kernels=use_kernels)
+        robot.build_bundle(CBBA.multiprocessing.Queue())
+        assert len(robot.path) > 0
+        assert is_schedule_feasible(robot.state, robot.getPathTasks())
+        assert all(slack >= 0 for slack in robot.time_slack)
+
+
+@pytest.mark.parametrize("seed, capacity", [(1027, 90), (1188, 40)])
+def test_bundle_respects_capacity_with_time_windows(seed, capacity):
+    # The time windows of these tasks make the cheaper orientation infeasible for some insertions
+    for use_kernels in (False, True):
+        tasks = make_tasks(np.random.default_rng(seed), 25)
+        robot = CBBA.agent(shapely.Point(50, 50), 0, number_of_agents=1, capacity=capacity, tasks=tasks, use_kernels=use_kernels)
+        robot.build_bundle()
+        assert Agent.getTotalTravelCost(robot.state, robot.getPathTasks(), None, robot.profile) <= capacity
+        assert is_schedule_feasible(robot.state, robot.getPathTasks())
@@ -0,0 +1,119 @@
+import os
+import socket
+import time
+
+import pytest
+import shapely
+
+from trajallocpy import ACBBA, Agent, CoverageProblem, Experiment, Task, Transport
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_tcp_loopback_batches():
+    addresses = {0: ("127.0.0.1", _free_port()), 1: ("127.0.0.1", _free_port())}
+    sender = Transport.SocketTransport(0, addresses)
+    bids = [Agent.BidInformation(y=1.5 * j, z=0, t=10.0 + j, j=j, k=0) for j in range(100)]
+    # The receiver is not listening yet, the batches are queued until it is
+    sender.send(bids[:60])
+    assert sender.pending
+    receiver = Transport.SocketTransport(1, addresses)
+    sender.send(bids[60:])
+    received = []
+    end_time = time.monotonic() + 5
+    while len(received) < len(bids) and time.monotonic() < end_time:
+        sender.receive()
+        received.extend(Transport.from_bid_array(receiver.receive(0.01)))
+    assert received == bids
+    assert receiver.heard == {0} and not sender.pending
+    sender.close()
+    receiver.close()
+
+
+def test_connect_does_not_block():
+    # Peer 1 never accepts, its backlog is filled such that connecting to it hangs
+    stalled = socket.socket()
+    stalled.bind(("127.0.0.1", 0))
+    stalled.listen(0)
+    queued = socket.create_connection(stalled.getsockname())
+    addresses = {0: ("127.0.0.1", _free_port()), 1: stalled.getsockname(), 2: ("127.0.0.1", _free_port())}
+    sender = Transport.SocketTransport(0, addresses, connect_timeout=5)
+    receiver = Transport.SocketTransport(2, addresses)
+    bids = [Agent.BidInformation(y=1.0, z=0, t=1.0, j=0, k=0)]
+    start = time.monotonic()
+    sender.send(bids)
+    assert time.monotonic() - start < 0.5
+    received = []
+    while len(received) == 0 and time.monotonic() - start < 5:
+        sender.receive()
+        received.extend(Transport.from_bid_array(receiver.receive(0.01)))
+    # The stalled peer only delays its own messages
+    assert received == bids and time.monotonic() - start < 1 and sender.pending
+    for sock in (sender, receiver, queued, stalled):
+        sock.close()
+
+
+def test_distributed_solve_is_conflict_free():
+    tasks = [Task.TrajectoryTask(i, shapely.LineString([(10 + 8 * i, 10 + 7 * (i % 3)), (12 + 8 * i, 20 + 7 * (i % 3))])) for i in range(8)]
+    problem = CoverageProblem.CoverageProblem(tasks, shapely.box(0, 0, 100, 100), shapely.MultiPolygon())
+    agents = [Agent.config(i, (5 + 40 * i, 5), 1000) for i in range(3)]
+    results = Experiment.solve_distributed(problem, agents, idle_timeout=0.5, deadline=30)
+    paths = [set(result["path"]) for result in results.values()]
+    assert sum(len(path) for path in paths) == len(set().union(*paths)) == len(tasks)
+    for result in results.values():
+        assert result["stats"]["bids_sent"] > 0 and result["stats"]["latency"] <= result["stats"]["time"]
+        # The coalescing in the outbox never sends more bids than were queued
+        assert result["stats"]["bids_sent"] <= result["stats"]["bids_queued"]
+
+
+def test_bid_encoding_roundtrip():
+    bids = [Agent.BidInformation(y=199541.89 + j, z=j % 3 - 1, t=1e6 + j / 7, j=j, k=2) for j in range(50)]
+    payload = Transport.encode_bids(bids)
+    assert len(payload) == len(bids) * Transport.BID_DTYPE.itemsize == len(bids) * 24
+    decoded = Transport.decode_bids(payload)
+    assert not decoded.flags.writeable
+    assert Transport.from_bid_array(decoded) == bids
+    assert Transport.encode_bids(decoded) == payload
+
+
+def test_outbox_coalesces_rebroadcasts():
+    outbox = ACBBA.Outbox()
+    stale = Agent.BidInformation(y=1.0, z=0, t=1.0, j=3, k=0)
+    fresh = Agent.BidInformation(y=2.0, z=1, t=2.0, j=3, k=0)
+    other = Agent.BidInformation(y=5.0, z=0, t=2.0, j=4, k=0)
+    # Peer 1 has sent the fresh bid on task 3, it only needs the bid on task 4
+    outbox.acknowledge([(2.0, 1, 2.0, 3, 1)])
+    outbox.put([stale, other, fresh], [1, 2])
+    assert outbox.flush() == [([other], [1]), ([fresh, other], [2])]
+    assert (outbox.queued, outbox.sent) == (6, 3)
+    # Bids already sent are not repeated
+    outbox.put([fresh, other], [1, 2])
+    assert outbox.flush() == [] and outbox.sent == 3
+    # Received batches are acknowledged as decoded, without creating a BidInformation per bid
+    outbox.acknowledge(Transport.decode_bids(Transport.encode_bids([Agent.BidInformation(y=7.0, z=2, t=3.0, j=4, k=2)])))
+    assert outbox.acknowledged[2][4] == (7.0, 2, 3.0)
+
+
+def test_distributed_solve_raises_when_an_agent_dies(monkeypatch):
+    tasks = [Task.TrajectoryTask(i, shapely.LineString([(10 + 8 * i, 10), (12 + 8 * i, 20)])) for i in range(4)]
+    problem = CoverageProblem.CoverageProblem(tasks, shapely.box(0, 0, 100, 100), shapely.MultiPolygon())
+    run = ACBBA.agent.run
+    # The agent processes are forked, agent 1 exits without putting its result
+    monkeypatch.setattr(ACBBA.agent, "run", lambda self, **kwargs: os._exit(3) if self.id == 1 else run(self, **kwargs))
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match=r"\[1\]"):
+        Experiment.solve_distributed(problem, [Agent.config(i, (5 + 40 * i, 5), 1000) for i in range(2)], idle_timeout=60)
+    assert time.monotonic() - start < 30
+
+
+def test_bids_are_timestamped_with_the_wall_clock():
+    # The timestamps are compared between agents on separate nodes, a per-host clock origin would make them incomparable
+    tasks = [Task.TrajectoryTask(i, shapely.LineString([(10 + 8 * i, 10), (12 + 8 * i, 20)])) for i in range(3)]
+    robot = ACBBA.agent(shapely.Point(5, 5), 0, capacity=1000, tasks=tasks)
+    before = time.time()
+    bids = robot.build_bundle()
+    assert len(bids) > 0 and all(before <= bid.t <= time.time() for bid in bids)
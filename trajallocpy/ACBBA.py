@@ -1,9 +1,7 @@
-import copy
 import itertools
 import math
 import random
 import time
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
 from functools import cache
 from multiprocessing import Pool
@@ -15,6 +13,68 @@ from trajallocpy.Agent import *
 from trajallocpy.Task import TrajectoryTask
 
 
+def _bid_time():
+    # The timestamps of the bids are compared between the agents, which may run on separate nodes, thus they are taken from
+    # the wall clock (synchronised between the nodes, e.g. by NTP) instead of the monotonic clock whose origin differs per host
+    return time.time()
+
+
+def _bid_tuples(bids):
+    # Returns the bids, a list of BidInformation or a bid array (see Transport.BID_DTYPE), as (y, z, t, j, k) tuples
+    if isinstance(bids, np.ndarray):
+        # The records are converted to tuples in one step instead of creating an object per bid
+        return bids.tolist()
+    return [(bid.y, bid.z, bid.t, bid.j, bid.k) for bid in bids]
+
+
+class Outbox:
+    """Coalesces the rebroadcasts of an agent before they are sent to its neighbours
+
+    Only the last bid queued on each task is kept for each destination, as it reflects the current information of the agent.
+    A bid identical to what the destination already holds is dropped: the destination holds the bids it has sent (the k of a
+    bid is its sender) and the bids sent to it. The number of bids queued and sent, counted per destination, measure the
+    coalescing.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        # The (y, z, t) held by each destination by task
+        self.acknowledged = {}
+        self.queued = 0
+        self.sent = 0
+
+    def put(self, bids: List[BidInformation], destinations):
+        destinations = list(destinations)
+        for destination in destinations:
+            pending = self.pending.setdefault(destination, {})
+            for bid in bids:
+                pending[bid.j] = bid
+        self.queued += len(bids) * len(destinations)
+
+    def acknowledge(self, bids):
+        """Records the received bids, (y, z, t, j, k) tuples or a bid array (see Transport.BID_DTYPE), as held by their senders"""
+        if isinstance(bids, np.ndarray):
+            bids = bids.tolist()
+        for y, z, t, j, k in bids:
+            self.acknowledged.setdefault(k, {})[j] = (y, z, t)
+
+    def flush(self):
+        """Returns the coalesced bids as a list of (bids, destinations) batches, the destinations with identical bids share a batch"""
+        batches = {}
+        for destination, pending in self.pending.items():
+            acknowledged = self.acknowledged.setdefault(destination, {})
+            bids = [bid for j, bid in pending.items() if acknowledged.get(j) != (bid.y, bid.z, bid.t)]
+            if len(bids) == 0:
+                continue
+            for bid in bids:
+                acknowledged[bid.j] = (bid.y, bid.z, bid.t)
+            self.sent += len(bids)
+            key = tuple((bid.y, bid.z, bid.t, bid.j, bid.k) for bid in bids)
+            batches.setdefault(key, (bids, []))[1].append(destination)
+        self.pending = {}
+        return list(batches.values())
+
+
 class agent:
     def __init__(
         self,
@@ -25,13 +85,19 @@ class agent:
         tasks=None,
         color=None,
         point_estimation=False,
-        max_velocity=3,
-        max_acceleration=1,
+        max_velocity=5,
+        max_acceleration=2,
+        candidate_k=None,
+        candidate_radius=None,
+        transport=None,
     ):
         self.environment = environment
+        # Exchanges the bids with the other agents when running as a separate process, see Transport and run
+        self.transport = transport
         self.tasks = None
         if tasks is not None:
-            self.tasks = {x.id: x for x in copy.deepcopy(tasks)}
+            # The tasks are shared between the agents, a task reversed by this agent is replaced by a reversed copy
+            self.tasks = {x.id: x for x in tasks}
 
         self.use_single_point_estimation = point_estimation
         if color is None:
@@ -43,9 +109,10 @@ class agent:
         else:
             self.color = color
 
-        # TODO this should be configurable
         self.max_velocity = max_velocity
         self.max_acceleration = max_acceleration
+        # The travel costs are priced with the speed class of the agent
+        self.profile = KinematicProfile(float(max_velocity), float(max_acceleration))
 
         # Agent ID
         self.id = id
@@ -60,6 +127,9 @@ class agent:
         self.bundle = []
         # Path
         self.path = []
+        # Cumulative travel cost until the end of each task in the path and the total travel cost including returning home
+        self.path_costs = []
+        self.path_cost = 0
         # Maximum task capacity
         if capacity is None:
             raise Exception("Error: agent capacity cannot be None")
@@ -77,6 +147,13 @@ class agent:
         self.removal_list = {}
         self.removal_threshold = 5  # TODO find a good value for this when ros is implemented
         self.message_history = []
+        # Coalesces the rebroadcasts sent to the neighbours
+        self.outbox = Outbox()
+
+        # Only consider the tasks nearest to the path when building the bundle
+        self.pruner = None
+        if candidate_k is not None or candidate_radius is not None:
+            self.pruner = CandidatePruner(list(self.tasks.values()), keys=list(self.tasks.keys()), k=candidate_k, radius=candidate_radius)
 
     def __repr__(self) -> str:
         return f"Agent {self.id} \n path {self.path} \n  bundle {self.bundle} \n y(winning bids) {self.y} \n z(winning agents) {self.z} \n t(timestamps) {self.t} \n"
@@ -85,6 +162,8 @@ class agent:
         # add the tasks to self.tasks dictionary
         for task in tasks:
             self.tasks[task.id] = task
+        if self.pruner is not None:
+            self.pruner.update_tasks(list(self.tasks.values()), keys=list(self.tasks.keys()))
 
     def __str__(self) -> str:
         return f"Agent {self.id} \n path {self.path} \n  bundle {self.bundle} \n y(winning bids) {self.y} \n z(winning agents) {self.z} \n t(timestamps) {self.t} \n"
@@ -98,9 +177,16 @@ class agent:
     def send_message(self):  # TODO rename and make it return bidinformation
         return self.y, self.z, self.t
 
-    def getCij(self):
+    def update_path_costs(self):
+        path_tasks = self.getPathTasks()
+        self.path_costs = getCumulativeTravelCosts(self.state, path_tasks, self.environment, self.profile)
+        self.path_cost = getPathCost(self.state, path_tasks, self.path_costs, self.environment, self.profile)
+
+    def getCij(self, use_pruning=True, excluded=()):
+        # The capacity is checked in the orientation which is bid on, the orientation minimising the travel cost or the opposite
+        # one when only it fits
         # Calculate Sp_i
-        S_p = calculatePathReward(self.state, self.getPathTasks(), self.environment, self.Lambda)
+        S_p = calculatePathReward(self.state, self.getPathTasks(), self.environment, self.Lambda, self.profile)
         # init
         best_pos = None
         c = 0
@@ -108,36 +194,91 @@ class agent:
         best_task = None
         # Collect the tasks which should be considered for planning
         keys_above_threshold = [key for key, value in self.removal_list.items() if value > self.removal_threshold]
-        tasks_to_check = set(self.tasks.keys()).difference(self.bundle).difference(keys_above_threshold)
+        tasks_to_check = set(self.tasks.keys()).difference(self.bundle).difference(keys_above_threshold).difference(excluded)
+        if self.pruner is not None and use_pruning:
+            tasks_to_check = self.pruner.prune(tasks_to_check, getQueryPoints(self.state, self.getPathTasks()))
         # Combine the tasks and positions to check
-
+        path_tasks = self.getPathTasks()
+        leg_costs = getLegCosts(self.state, path_tasks, self.environment, self.profile)
         for n, j in itertools.product(range(len(self.path) + 1), tasks_to_check):
-            S_pj, should_be_reversed = calculatePathRewardWithNewTask(
-                j, n, self.state, self.tasks, self.path, self.environment, self.use_single_point_estimation
+            previous_end = self.state if n == 0 else path_tasks[n - 1].end
+            next_start = self.state if n == len(self.path) else path_tasks[n].start
+            entry_costs, exit_costs, is_reversed = getOrientedInsertionCosts(
+                previous_end,
+                next_start,
+                [self.tasks[j].start],
+                [self.tasks[j].end],
+                not self.use_single_point_estimation,
+                self.profile,
+                self.environment,
+            )
+            oriented_costs = (entry_costs[0], exit_costs[0], bool(is_reversed[0]))
+            # Skip the insertions exceeding the capacity before evaluating the reward
+            if not self.__fits(previous_end, next_start, j, oriented_costs):
+                if self.use_single_point_estimation:
+                    continue
+                oriented_costs = getOrientedCosts(previous_end, next_start, self.tasks[j], not oriented_costs[2], self.environment, self.profile)
+                if not self.__fits(previous_end, next_start, j, oriented_costs):
+                    continue
+            S_pj, should_be_reversed, _ = calculatePathRewardWithNewTask(
+                j,
+                n,
+                self.state,
+                self.tasks,
+                self.path,
+                self.environment,
+                self.Lambda,
+                self.use_single_point_estimation,
+                oriented_costs,
+                self.profile,
+                leg_costs,
             )
             c_ijn = S_pj - S_p
 
-            if c_ijn > c:  # and c_ijn > self.y.get(j, -1):  # TODO: Figure out if this is bad for the general solution
+            # Only bid on the tasks which can be won from the current winner, ties are won by the lowest id
+            y_j = self.y.get(j, 0)
+            if c_ijn > c and (c_ijn > y_j or (c_ijn == y_j and self.id < self.z.get(j, -1))):
                 c = c_ijn  # Store the cost
                 best_pos = n
                 reverse = should_be_reversed
                 best_task = j
-        # reverse the task with max reward if necesarry
-        if reverse:
-            self.tasks[j].reverse()
 
-        return best_task, best_pos, c
+        return best_task, best_pos, c, reverse
+
+    def __fits(self, previous_end, next_start, j, oriented_costs):
+        entry_cost, exit_cost, _ = oriented_costs
+        removed_cost = getTravelCost(previous_end, next_start, self.environment, self.profile)
+        return self.path_cost + entry_cost + self.profile.cost(self.tasks[j].length) + exit_cost - removed_cost <= self.capacity
+
+    def reverse_task(self, j):
+        self.tasks[j] = self.tasks[j].reversed_copy()
 
     def build_bundle(self):
         if self.tasks is None:
             return
         bid_list = []
-        bundle_time = time.monotonic()
-        while getTotalTravelCost(self.state, self.getPathTasks(), self.environment) <= self.capacity:
-            J_i, n_J, c = self.getCij()
+        bundle_time = _bid_time()
+        # The tasks whose bid turned out to exceed the capacity, which are not bid on again
+        excluded = set()
+        while self.path_cost <= self.capacity:
+            J_i, n_J, c, reverse = self.getCij(excluded=excluded)
+            if J_i is None and self.pruner is not None:
+                # None of the nearby tasks improves the path, fall back to checking all the tasks
+                J_i, n_J, c, reverse = self.getCij(use_pruning=False, excluded=excluded)
             if J_i is None:
                 break
+            # reverse the task with max reward if necesarry
+            if reverse:
+                self.reverse_task(J_i)
+            # getCij checked the capacity in this orientation, the task is dropped rather than inserted in another orientation
+            # with an unchecked cost and a stale bid
+            if self.path_cost + getInsertionCost(self.state, self.getPathTasks(), n_J, self.tasks[J_i], self.environment, self.profile) > self.capacity:
+                if reverse:
+                    self.reverse_task(J_i)
+                excluded.add(J_i)
+                continue
             self.bundle.append(J_i)
+            self.path_cost += insertPathCost(self.path_costs, self.state, self.getPathTasks(), n_J, self.tasks[J_i], self.environment, self.profile)
             self.path.insert(n_J, J_i)
 
             self.y[J_i] = c
@@ -147,7 +288,7 @@ class agent:
         return bid_list
 
     def __update_time(self, task):
-        self.t[task] = time.monotonic()
+        self.t[task] = _bid_time()
 
     def __action_rule(self, k, j, task, z_kj, y_kj, t_kj, z_ij, y_ij, t_ij) -> BidInformation:
         eps = np.finfo(float).eps
@@ -291,47 +432,94 @@ class agent:
         self.__leave()
         return own_info
 
-    def __rebroadcast(self, information):
-        y = information["y"]
-        z = information["z"]
-        t = information["t"]
-        self.send_information(y, z, t, self.id)
-
-    def __receive_information(self):
-        raise NotImplementedError()
-        # message = self.my_socket.recieve(self.agent)
-        # if message is None:
-        #     return None
-        # return message
-
-    def send_information(self, y, z, t, k):
-        """This function is used for sharing information between agents and is not implemented in this base class
+    def __rebroadcast(self):
+        # Sends the coalesced rebroadcasts, returns the number of batches sent
+        batches = self.outbox.flush()
+        for bids, destinations in batches:
+            self.send_information(bids, destinations)
+        return len(batches)
+
+    def __receive_information(self, timeout=0.0) -> List[BidInformation]:
+        if self.transport is None:
+            raise NotImplementedError()
+        return self.transport.receive(timeout)
+
+    def send_information(self, bids: List[BidInformation], destinations=None):
+        """Sends a batch of bids to the destinations (all the other agents by default) over the transport
+
         Raises
         ------
         NotImplementedError
-            _description_
+            When the agent has no transport, subclasses may implement their own communication instead
         """
-        raise NotImplementedError()
-        # msg = {self.agent: {"y": y, "z": z, "t": t}}
-        # self.my_socket.send(self.agent, msg, k)
-
-    def update_task_async(self, bids: List[BidInformation]):
+        if self.transport is None:
+            raise NotImplementedError()
+        self.transport.send(bids, destinations)
+
+    def run(self, idle_timeout=1.0, deadline=None, poll_interval=0.01):
+        """Runs the asynchronous consensus with the other agents over the transport
+
+        The agent builds its bundle, broadcasts its bids and rebroadcasts the outcome of the received bids until it has heard
+        from all the other agents, all its bids are delivered and nothing has been received for idle_timeout seconds, or until
+        the deadline (sec) has passed. As the other agents are silent while they process a batch, the idle time is at least
+        twice the longest time this agent has spent processing a batch. The rebroadcasts are coalesced by the outbox.
+
+        Returns
+        -------
+        dict
+            The time (sec) until the last change of the winning bids ("latency"), the total time, the number of bids received,
+            queued for and sent to the other agents (before and after coalescing, counted per destination) and the transport
+            counters
+        """
+        start_time = last_change = time.monotonic()
+        bids_received = 0
+        self.outbox.put(self.build_bundle() or [], self.transport.peer_ids)
+        if self.__rebroadcast() == 0:
+            # The first batch is sent even when empty, such that the other agents know that this agent is running
+            self.send_information([])
+        last_activity = time.monotonic()
+        busy_time = last_activity - start_time
+        while (time.monotonic() - last_activity < max(idle_timeout, 2 * busy_time) or self.transport.pending or not self.transport.heard_all) and (
+            deadline is None or time.monotonic() - start_time < deadline
+        ):
+            received = self.__receive_information(poll_interval)
+            if len(received) == 0:
+                continue
+            received_time = time.monotonic()
+            bids_received += len(received)
+            self.outbox.acknowledge(received)
+            winners = dict(self.z), dict(self.y)
+            rebroadcasts = self.update_task_async(received)
+            # Tasks lost during the update free up capacity for new tasks
+            rebroadcasts.extend(self.build_bundle() or [])
+            if winners != (self.z, self.y):
+                last_change = time.monotonic()
+            # The coalescing drops the information the other agents already hold, otherwise the agents echo each other
+            self.outbox.put(rebroadcasts, self.transport.peer_ids)
+            self.__rebroadcast()
+            last_activity = time.monotonic()
+            busy_time = max(busy_time, last_activity - received_time)
+        end_time = time.monotonic()
+        return {
+            "latency": last_change - start_time,
+            "time": end_time - start_time,
+            "bids_queued": self.outbox.queued,
+            "bids_sent": self.outbox.sent,
+            "bids_received": bids_received,
+            "messages_sent": getattr(self.transport, "messages_sent", None),
+            "bytes_sent": getattr(self.transport, "bytes_sent", None),
+        }
+
+    def update_task_async(self, bids):
+        """Applies the received bids, a list of BidInformation or a bid array (see Transport.BID_DTYPE), returns the rebroadcasts"""
         # Update Process
         rebroadcasts = []
-        for bid_info in bids:
-            j = bid_info.j
-            k = bid_info.k
-
+        for y_kj, z_kj, t_kj, j, k in _bid_tuples(bids):
             # Own info
             y_ij = self.y.get(j, 0)
             z_ij = self.z.get(j, -1)
             t_ij = self.t.get(j, 0)
 
-            # Recieved info
-            y_kj = bid_info.y  # Winning bids
-            z_kj = bid_info.z  # Winning agent
-            t_kj = bid_info.t  # Timestamps
-
             rebroadcast = self.__action_rule(k=k, j=j, task=j, z_kj=z_kj, y_kj=y_kj, t_kj=t_kj, z_ij=z_ij, y_ij=y_ij, t_ij=t_ij)
             if rebroadcast is not None:
                 rebroadcasts.append(rebroadcast)
@@ -342,12 +530,11 @@ class agent:
         rebroadcasts = []
 
         for k in Y:
-            for j in self.tasks:
-                # Recieve info
-                y_kj = Y[k][0].get(j, 0)  # Winning bids
-                z_kj = Y[k][1].get(j, -1)  # Winning agent
-                t_kj = Y[k][2].get(j, 0)  # Timestamps
-
+            # Recieve info: the winning bids, winning agents and timestamps
+            y_k, z_k, t_k = Y[k][0], Y[k][1], Y[k][2]
+            received = [(y_k.get(j, 0), z_k.get(j, -1), t_k.get(j, 0), j, k) for j in self.tasks]
+            self.outbox.acknowledge(received)
+            for y_kj, z_kj, t_kj, j, _ in received:
                 # Own info
                 y_ij = self.y.get(j, 0)
                 z_ij = self.z.get(j, -1)
@@ -376,16 +563,17 @@ class agent:
         for idx in b_retry:
             self.y[idx] = 0
             self.z[idx] = -1
-            self.t[idx] = time.monotonic()
+            self.t[idx] = _bid_time()
 
         self.removal_list[task] = self.removal_list.get(task, 0) + 1
         self.path = [num for num in self.path if num not in self.bundle[index:]]
         self.bundle = self.bundle[:index]
+        self.update_path_costs()
 
     def __reset(self, task):
         self.y[task] = 0
         self.z[task] = -1
-        self.t[task] = time.monotonic()
+        self.t[task] = _bid_time()
         self.__update_path(task)
 
     def __leave(self):
@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 import math
+import threading
 from dataclasses import dataclass
-from functools import cache
+from functools import update_wrapper
 from multiprocessing import Pool
-from typing import List
+from typing import List, NamedTuple
 
 import numpy as np
+import shapely
+from scipy.spatial import KDTree
 
 from trajallocpy.Task import TrajectoryTask
 
@@ -15,8 +18,8 @@ class config:
     id: int
     position: list
     capacity: int  # time in seconds
-    max_velocity: float = 3  # m/s
-    max_acceleration: float = 1  # m/s^2
+    max_velocity: float = 5  # m/s
+    max_acceleration: float = 2  # m/s^2
 
 
 # class Agent:
@@ -36,26 +39,211 @@ class BidInformation:
     # sender_id: int
 
 
+# Maximum number of entries of the distance and travel cost caches, each entry takes roughly 200 bytes
+DEFAULT_CACHE_SIZE = 2**18
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+
+class EndpointCache:
+    """Memoizes a function of (start, end, environment, *args) and allows evicting the entries affected by a change of the environment
+
+    The entries are scoped by the cache_scope attribute of the environment (see CoverageProblem), such that the copies of an
+    environment held by the agents share their entries, and can be dropped per scenario with clear. When maxsize is given,
+    the least recently used ("lru") or the oldest ("fifo") entry is evicted once the cache is full. The recency of the entries
+    is only tracked once the cache is half full, such that the hits stay cheap while the working set fits. The cache can be
+    shared by threads: the entries are only changed while holding the lock, the counters are approximate.
+    """
+
+    def __init__(self, func, maxsize=DEFAULT_CACHE_SIZE, policy="lru"):
+        update_wrapper(self, func)
+        self.entries = {}
+        # Held while changing the entries, the lookups are atomic
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.configure(maxsize, policy)
+
+    def configure(self, maxsize=DEFAULT_CACHE_SIZE, policy="lru"):
+        if policy not in ("lru", "fifo"):
+            raise ValueError(f"Error: unknown eviction policy {policy}")
+        with self.lock:
+            self.maxsize = maxsize
+            self.policy = policy
+            # Size above which a hit moves the entry to the end of the (insertion ordered) entries
+            self.__recency_size = maxsize // 2 if policy == "lru" and maxsize is not None else math.inf
+            self.__shrink()
+
+    def __call__(self, start, end, environment=None, *args):
+        key = (start, end, getattr(environment, "cache_scope", environment), *args)
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            value = self.__wrapped__(start, end, environment, *args)
+            with self.lock:
+                self.entries[key] = value
+                self.__shrink()
+            return value
+        self.hits += 1
+        if len(self.entries) > self.__recency_size:
+            with self.lock:
+                # Another thread can have evicted the entry meanwhile
+                self.entries[key] = self.entries.pop(key, value)
+        return value
+
+    def __shrink(self):
+        # Evicts the oldest entries until the cache fits, the lock must be held
+        while self.maxsize is not None and len(self.entries) > self.maxsize:
+            del self.entries[next(iter(self.entries))]
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self.entries))
+
+    def cache_clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def items(self, environment):
+        """Returns the (key, value) pairs of the entries in the scope of the environment"""
+        scope = getattr(environment, "cache_scope", environment)
+        with self.lock:
+            return [(key, value) for key, value in self.entries.items() if key[2] == scope]
+
+    def clear(self, environment):
+        """Drops the entries in the scope of the environment"""
+        self.evict([key for key, _ in self.items(environment)])
+
+    def evict(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+
+class CandidatePruner:
+    """Limits the tasks considered during bundle construction to the tasks near the agent and its path
+
+    A KD-tree over the start and end points of the tasks is queried for the k nearest endpoints and/or the endpoints
+    within radius of the agent state and the endpoints of the tasks in the path.
+    If none of the nearest tasks are eligible, k is increased, and finally all the eligible tasks are used.
+    """
+
+    def __init__(self, tasks, keys=None, k=None, radius=None):
+        if k is None and radius is None:
+            raise ValueError("Error: either k or radius has to be given for candidate pruning")
+        self.k = k
+        self.radius = radius
+        # Number of candidate tasks before and after the pruning, for evaluating the pruning ratio
+        self.total = 0
+        self.considered = 0
+        self.update_tasks(tasks, keys)
+
+    def update_tasks(self, tasks, keys=None):
+        self.keys = np.arange(len(tasks)) if keys is None else np.array(keys)
+        endpoints = [task.start for task in tasks] + [task.end for task in tasks]
+        self.tree = KDTree(np.array(endpoints, dtype=float).reshape(-1, 2))
+
+    @property
+    def pruning_ratio(self):
+        """The fraction of the candidate tasks which has been pruned"""
+        return 1 - self.considered / self.total if self.total > 0 else 0.0
+
+    def __nearest(self, points, eligible):
+        n = self.tree.n
+        if self.radius is not None:
+            rows = np.concatenate([np.array(r, dtype=int) for r in self.tree.query_ball_point(points, self.radius)])
+            candidates = eligible.intersection(self.keys[rows % len(self.keys)].tolist())
+            if self.k is None or len(candidates) > 0:
+                return candidates
+        k = self.k
+        while True:
+            _, rows = self.tree.query(points, k=min(k, n))
+            candidates = eligible.intersection(self.keys[np.unique(rows) % len(self.keys)].tolist())
+            if len(candidates) > 0 or k >= n:
+                return candidates
+            k *= 4
+
+    def prune(self, eligible: set, points) -> set:
+        """Returns the eligible tasks near the points, or all the eligible tasks if none of them are near"""
+        candidates = self.__nearest(np.array(points, dtype=float).reshape(-1, 2), eligible) if len(eligible) > 0 else eligible
+        if len(candidates) == 0:
+            candidates = eligible
+        self.total += len(eligible)
+        self.considered += len(candidates)
+        return candidates
+
+
+def getQueryPoints(state, path_tasks):
+    """Returns the points from which candidate tasks are searched, the agent state and the endpoints of the tasks in the path"""
+    return [state] + [point for task in path_tasks for point in (task.start, task.end)]
+
+
 def distanceToCost(dist, max_velocity=5, max_acceleration=2):
     d_a = (max_velocity**2) / max_acceleration
     result = math.sqrt(4 * dist / max_acceleration) if dist < d_a else max_velocity / max_acceleration + dist / max_velocity
     return result
 
 
-@cache
+def distancesToCost(distances, max_velocity=5, max_acceleration=2):
+    """Vectorized distanceToCost"""
+    d_a = (max_velocity**2) / max_acceleration
+    return np.where(distances < d_a, np.sqrt(4 * distances / max_acceleration), max_velocity / max_acceleration + distances / max_velocity)
+
+
+class KinematicProfile(NamedTuple):
+    """The speed class of an agent, converts distances into travel times
+
+    Agents with the same profile share the converted travel costs, while the distances are shared by all the agents.
+    """
+
+    max_velocity: float = 5.0  # m/s
+    max_acceleration: float = 2.0  # m/s^2
+
+    def cost(self, dist):
+        return distanceToCost(dist, self.max_velocity, self.max_acceleration)
+
+    def costs(self, distances):
+        return distancesToCost(distances, self.max_velocity, self.max_acceleration)
+
+
+DEFAULT_PROFILE = KinematicProfile()
+
+
+def hasAddedRestrictedAreas(environment) -> bool:
+    """Checks whether restricted areas were added to the environment while solving, which the distances have to go around"""
+    return bool(getattr(environment, "added_holes", None))
+
+
+@EndpointCache
 def getDistance(start, end, environment=None):
-    # TODO this is a temporary fix for improving the performance of the code
-    dist = [(a - b) ** 2 for a, b in zip(start, end)]
-    dist = math.sqrt(sum(dist))
-    return dist
-    # If there is no environment defined, use euclidean
-    if environment is None:
-        # This is a optimised way of calculating euclidean distance: https://stackoverflow.com/questions/37794849/efficient-and-precise-calculation-of-the-euclidean-distance
-        dist = [(a - b) ** 2 for a, b in zip(start, end)]
-        dist = math.sqrt(sum(dist))
-    else:
+    """Returns the distance between start and end used for the travel costs
+
+    The restricted areas of the initial problem are ignored for performance, the distance is euclidean
+    (https://stackoverflow.com/questions/37794849/efficient-and-precise-calculation-of-the-euclidean-distance).
+    The restricted areas added while solving (see CoverageProblem.add_restricted_area) are followed, when the straight line
+    crosses one of them the length of the shortest path around it is used. The cached entries are evicted by invalidate_region.
+    """
+    if hasAddedRestrictedAreas(environment) and environment.crosses_added_holes(start, end):
         path, dist = environment.find_shortest_path(start, end, free_space_after=False, verify=False)
-    return dist
+        if dist is not None:
+            return dist
+    dist = [(a - b) ** 2 for a, b in zip(start, end)]
+    return math.sqrt(sum(dist))
 
 
 def getTravelPath(position, assigned_tasks, environment):
@@ -66,100 +254,227 @@ def getTravelPath(position, assigned_tasks, environment):
         path, dist = environment.find_shortest_path(position, assigned_tasks[0].start, free_space_after=False, verify=False)
         full_path.extend(path)
         for i in range(len(assigned_tasks) - 1):
-            full_path.extend(assigned_tasks[i].trajectory.coords)
+            full_path.extend(assigned_tasks[i].coords)
             path, dist = environment.find_shortest_path(assigned_tasks[i].end, assigned_tasks[i + 1].start, free_space_after=False, verify=False)
             full_path.extend(path)
-            task_paths.append(assigned_tasks[i].trajectory.coords)
+            task_paths.append(assigned_tasks[i].coords)
             travel_paths.append(path)
-        full_path.extend(assigned_tasks[-1].trajectory.coords)
-        task_paths.append(assigned_tasks[-1].trajectory.coords)
+        full_path.extend(assigned_tasks[-1].coords)
+        task_paths.append(assigned_tasks[-1].coords)
 
     return full_path, travel_paths, task_paths
 
 
-@cache
-def getTravelCost(start, end, environment):
-    return distanceToCost(getDistance(start, end, environment))
+@EndpointCache
+def getTravelCost(start, end, environment=None, profile=DEFAULT_PROFILE):
+    return profile.cost(getDistance(start, end, environment))
 
 
-def getTimeDiscountedReward(cost, Lambda, task: TrajectoryTask):
-    # return np.exp((Lambda - 1) * cost) * task.reward +1
-    # return Lambda ** (cost) + task.reward
-    return max(0, -math.log(cost) + 1000) * task.reward
+def invalidate_region(region, environment):
+    """Evicts the cached distances and travel costs in the scope of the environment whose shortest path may pass through the region
 
+    Any path of length d between a start and end lies within the ellipse with the focal points start and end,
+    so an entry can only be affected if dist(start, region) + dist(region, end) <= d.
+    """
+    items = getDistance.items(environment)
+    if len(items) > 0:
+        starts = shapely.points([key[0] for key, _ in items])
+        ends = shapely.points([key[1] for key, _ in items])
+        distances = np.fromiter((distance for _, distance in items), dtype=float, count=len(items))
+        shapely.prepare(region)
+        affected = shapely.distance(starts, region) + shapely.distance(ends, region) <= distances
+        getDistance.evict([key for (key, _), is_affected in zip(items, affected) if is_affected])
+    # The travel costs are derived from the distances, evict the ones without a valid distance
+    getTravelCost.evict([key for key, _ in getTravelCost.items(environment) if key[:3] not in getDistance])
 
-def getMinTravelCost(point, task: TrajectoryTask, environment):
-    result = getTravelCost(point, task.start, environment)
-    distance_to_end = getTravelCost(point, task.end, environment)
-    shouldBeReversed = False
-    if result > distance_to_end:
-        result = distance_to_end
-        shouldBeReversed = True
-    return result, shouldBeReversed
 
+def configure_caches(maxsize=DEFAULT_CACHE_SIZE, policy="lru"):
+    """Sets the maximum number of entries (None for unbounded) and the eviction policy of the distance and travel cost caches"""
+    for cache in (getDistance, getTravelCost):
+        cache.configure(maxsize, policy)
 
-def test_calculatePathRewardWithNewTask(environment, agent, taskCurr, taskPrev, timePrev, taskNext, timeNext, Lambda):
-    # TODO
-    # * Keep track of the time/distance of each task in the path and store it in a vector, just like the path
-    # * Iterate through the vector and calculate
 
-    if taskPrev == None:  # First task in the path
-        dt = getMinTravelCost(agent.state, taskCurr, environment)
-        minStart = max(taskCurr.start_time, agent.availability_time + dt)
-    else:  # Not the first in the task
-        dt = getMinTravelCost(taskPrev.end, taskCurr, environment)
-        minStart = max(taskCurr.start_time, timePrev + distanceToCost(taskPrev.length) + dt)  # i have to have time to do task at j-1 and go to task m
+def cache_info() -> dict:
+    """Returns the hit, miss, eviction and size counters of the distance and travel cost caches"""
+    return {cache.__name__: cache.cache_info() for cache in (getDistance, getTravelCost)}
 
-    if taskNext == None:
-        maxStart = taskCurr.end_time
-    else:  # Not the last task in the path and we can still make the promised task
-        dt = getMinTravelCost(taskCurr.end, taskNext, environment)
-        maxStart = min(taskCurr.end_time, timeNext - distanceToCost(taskCurr.length) - dt)
 
-    reward = getTimeDiscountedReward(dt, Lambda, taskCurr)
-    penalty = getTravelCost(agent.state, taskCurr.start, environment)
-    score = reward - penalty
+def clear_caches(environment=None):
+    """Drops the cached distances and travel costs of the scenario of the environment, or all of them when it is not given"""
+    for cache in (getDistance, getTravelCost):
+        if environment is None:
+            cache.cache_clear()
+        else:
+            cache.clear(environment)
 
-    return score, minStart, maxStart
 
+def getTimeDiscountedReward(cost, Lambda, task: TrajectoryTask):
+    # return np.exp((Lambda - 1) * cost) * task.reward +1
+    # return Lambda ** (cost) + task.reward
+    return max(0, -math.log(cost) + 1000) * task.reward
+
+
+def getOrientedInsertionCosts(previous_end, next_start, starts, ends, allow_reversal=True, profile=DEFAULT_PROFILE, environment=None):
+    """Evaluates the four endpoint combinations of inserting each of the tasks between two neighbours in one step
+
+    Parameters
+    ----------
+    previous_end
+        The point the inserted task is entered from, the end of the preceding task or the agent state
+    next_start
+        The point the inserted task is exited to, the start of the succeeding task or the agent state
+    starts, ends
+        The start and end points of the candidate tasks
+    profile
+        The kinematic profile of the agent, the distances to all the endpoints are converted in one step
+    environment
+        The environment of the agent, the distances crossing the restricted areas added to it are taken from getDistance
+
+    Returns
+    -------
+    tuple
+        The travel cost into and out of each task and whether it should be reversed, the orientation minimises the sum of the two.
+        The distances are the same as getDistance
+    """
+    endpoints = np.stack([np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)])
+    to_distances = np.sqrt(((endpoints - np.asarray(previous_end, dtype=float)) ** 2).sum(axis=-1))
+    from_distances = np.sqrt(((endpoints - np.asarray(next_start, dtype=float)) ** 2).sum(axis=-1))
+    if hasAddedRestrictedAreas(environment):
+        # Only the few lines crossing an added restricted area need a shortest path
+        previous_end, next_start = tuple(previous_end), tuple(next_start)
+        for index in zip(*np.nonzero(environment.crosses_added_holes(previous_end, endpoints))):
+            to_distances[index] = getDistance(previous_end, tuple(endpoints[index]), environment)
+        for index in zip(*np.nonzero(environment.crosses_added_holes(endpoints, next_start))):
+            from_distances[index] = getDistance(tuple(endpoints[index]), next_start, environment)
+    to_start, to_end = profile.costs(to_distances)
+    from_start, from_end = profile.costs(from_distances)
+    is_reversed = (to_end + from_start < to_start + from_end) & allow_reversal
+    return np.where(is_reversed, to_end, to_start), np.where(is_reversed, from_start, from_end), is_reversed
+
+
+def getOrientedCosts(previous_end, next_start, task: TrajectoryTask, is_reversed, environment=None, profile=DEFAULT_PROFILE):
+    """Returns the travel cost into and out of the task inserted between two neighbours in the given orientation and the
+    orientation, like getOrientedInsertionCosts for a single task with a fixed orientation"""
+    first, last = (task.end, task.start) if is_reversed else (task.start, task.end)
+    return getTravelCost(previous_end, first, environment, profile), getTravelCost(last, next_start, environment, profile), is_reversed
+
+
+def getScheduleTimes(position, task_list: List[TrajectoryTask], environment, availability_time=0, profile=DEFAULT_PROFILE):
+    """Returns the start time of each task in the task list and the forward time slack of each position
+
+    The agent waits when arriving before the start time of a task. The forward slack of position i is how much the start of
+    task i can be postponed without any of the succeeding tasks starting after their latest start time, the waiting times absorb
+    part of the delay. A negative slack means that the path already violates a time window.
+    """
+    times = []
+    waiting_times = []
+    time = availability_time
+    previous_end = position
+    for task in task_list:
+        arrival = time + getTravelCost(previous_end, task.start, environment, profile)
+        time = max(arrival, task.start_time)
+        times.append(time)
+        waiting_times.append(time - arrival)
+        time += profile.cost(task.length)
+        previous_end = task.end
+
+    slack = [0] * len(task_list)
+    next_slack = math.inf
+    for i in reversed(range(len(task_list))):
+        slack[i] = min(task_list[i].getLatestStartTime() - times[i], next_slack)
+        next_slack = waiting_times[i] + slack[i]
+    return times, slack
+
+
+def isTimeWindowFeasible(
+    position, task_list: List[TrajectoryTask], times, slack, n, task: TrajectoryTask, environment, availability_time=0, profile=DEFAULT_PROFILE
+):
+    """Checks whether inserting the task at index n keeps every task within its time window, in constant time using the
+    start times and forward slack from getScheduleTimes"""
+    if n == 0:
+        departure = availability_time
+        previous_end = position
+    else:
+        departure = times[n - 1] + profile.cost(task_list[n - 1].length)
+        previous_end = task_list[n - 1].end
+    start = max(departure + getTravelCost(previous_end, task.start, environment, profile), task.start_time)
+    if start > task.getLatestStartTime():
+        return False
+    if n == len(task_list):
+        return True
+    # The succeeding tasks are delayed by the push forward of the next task
+    arrival = start + profile.cost(task.length) + getTravelCost(task.end, task_list[n].start, environment, profile)
+    return arrival - times[n] <= slack[n]
+
+
+def getLegCosts(position, task_list: List[TrajectoryTask], environment, profile=DEFAULT_PROFILE):
+    """Returns the travel cost into each task of the task list followed by the cost of returning home from the last task"""
+    if len(task_list) == 0:
+        return []
+    previous_ends = [position] + [task.end for task in task_list[:-1]]
+    leg_costs = [getTravelCost(previous_end, task.start, environment, profile) for previous_end, task in zip(previous_ends, task_list)]
+    leg_costs.append(getTravelCost(task_list[-1].end, position, environment, profile))
+    return leg_costs
+
+
+def calculatePathRewardWithNewTask(
+    j,
+    n,
+    state,
+    tasks,
+    path,
+    environment,
+    Lambda,
+    use_single_point_estimation=False,
+    oriented_costs=None,
+    profile=DEFAULT_PROFILE,
+    leg_costs=None,
+):
+    """Returns the path reward when inserting task j at index n of the path and whether the task should be reversed
+
+    oriented_costs is the travel cost into and out of the task and its orientation (see getOrientedInsertionCosts),
+    it is computed when not given, such that the costs of many candidates can be evaluated in one step.
+    Likewise leg_costs are the travel costs of the path (see getLegCosts), which are shared by all the candidates.
+    """
+    previous_end = state if n == 0 else tasks[path[n - 1]].end
+    next_start = state if n == len(path) else tasks[path[n]].start
+    if oriented_costs is None:
+        # With single point estimation the direction of the task is not optimised
+        entry_costs, exit_costs, is_reversed = getOrientedInsertionCosts(
+            previous_end,
+            next_start,
+            [tasks[j].start],
+            [tasks[j].end],
+            allow_reversal=not use_single_point_estimation,
+            profile=profile,
+            environment=environment,
+        )
+        oriented_costs = (entry_costs[0], exit_costs[0], is_reversed[0])
+    entry_cost, exit_cost, is_reversed = oriented_costs
+    if leg_costs is None:
+        leg_costs = getLegCosts(state, [tasks[t] for t in path], environment, profile)
 
-def calculatePathRewardWithNewTask(j, n, state, tasks, path, environment, Lambda, use_single_point_estimation=False):
     temp_path = list(path)
     temp_path.insert(n, j)
-    # print(j)
-    is_reversed = False
-    # travel cost to first task
-    travel_cost = getTravelCost(state, tasks[temp_path[0]].start, environment)
-    S_p = getTimeDiscountedReward(travel_cost, Lambda, tasks[temp_path[0]])
-    best_time = 0
-    # Use a single point instead of greedily optimising the direction
-    for p_idx in range(len(temp_path) - 1):
-        previous_task = tasks[temp_path[p_idx]]
-        next_task = tasks[temp_path[p_idx + 1]]
-        if use_single_point_estimation:
-            travel_cost += getTravelCost(previous_task.end, next_task.start)
+    travel_cost = 0
+    S_p = 0
+    for p_idx, t in enumerate(temp_path):
+        if p_idx == n:
+            travel_cost += entry_cost
+        elif p_idx == n + 1:
+            # The task after the inserted task is travelled to from the end given by the orientation
+            travel_cost += exit_cost
         else:
-            if p_idx == n - 1:
-                # The task is inserted at n, when evaluating the task use n-1 to determine whether it should be reversed
-                temp_cost, is_reversed = getMinTravelCost(previous_task.end, next_task, environment)
-
-                travel_cost += temp_cost
-
-            elif p_idx == n:
-                # the task after has to use the is_reversed bool to determine where to travel from
-                if is_reversed:
-                    travel_cost += getTravelCost(previous_task.end, next_task.start, environment)
-                else:
-                    travel_cost += getTravelCost(previous_task.end, next_task.start, environment)
-            else:
-                travel_cost += getTravelCost(previous_task.end, next_task.start, environment)
-            # Scale the travelcost with the reward/priority
-        S_p += getTimeDiscountedReward(travel_cost, Lambda, next_task)
+            # The legs after the inserted task are shifted by one
+            travel_cost += leg_costs[p_idx if p_idx < n else p_idx - 1]
+        # Scale the travelcost with the reward/priority
+        S_p += getTimeDiscountedReward(travel_cost, Lambda, tasks[t])
 
     # Add the cost for returning home
-    travel_cost += getTravelCost(tasks[temp_path[-1]].end, state, environment)
+    travel_cost += exit_cost if n == len(path) else leg_costs[-1]
     S_p += getTimeDiscountedReward(travel_cost, Lambda, tasks[temp_path[-1]])
-    return (S_p, is_reversed, best_time)
+    best_time = 0
+    return (S_p, bool(is_reversed), best_time)
 
 
 # This is only used for evaluations!
@@ -186,31 +501,76 @@ def getTotalTaskLength(task_list):
     return task_length
 
 
-def getTotalTravelCost(position, task_list: List[TrajectoryTask], environment):
+def getTotalTravelCost(position, task_list: List[TrajectoryTask], environment, profile=DEFAULT_PROFILE):
     total_cost = 0
     if len(task_list) != 0:
         # Add the cost of travelling to the first task
-        total_cost = getTravelCost(position, task_list[0].start, environment)
+        total_cost = getTravelCost(position, task_list[0].start, environment, profile)
         # The cost of travelling between tasks
         for t_index in range(len(task_list) - 1):
-            total_cost += getTravelCost(task_list[t_index].end, task_list[t_index + 1].start, environment)
+            total_cost += getTravelCost(task_list[t_index].end, task_list[t_index + 1].start, environment, profile)
         # The cost of executing the task
         for t_index in range(len(task_list)):
-            total_cost += distanceToCost(task_list[t_index].length)
+            total_cost += profile.cost(task_list[t_index].length)
         # Add the cost of returning home
-        total_cost += getTravelCost(position, task_list[-1].end, environment)
+        total_cost += getTravelCost(position, task_list[-1].end, environment, profile)
     return total_cost
 
 
+def getInsertionCost(position, task_list: List[TrajectoryTask], n, task: TrajectoryTask, environment, profile=DEFAULT_PROFILE):
+    """Returns the increase of the total travel cost (see getTotalTravelCost) when inserting the task at index n of the task list"""
+    previous_end = position if n == 0 else task_list[n - 1].end
+    next_start = position if n == len(task_list) else task_list[n].start
+    return (
+        getTravelCost(previous_end, task.start, environment, profile)
+        + profile.cost(task.length)
+        + getTravelCost(task.end, next_start, environment, profile)
+        - getTravelCost(previous_end, next_start, environment, profile)
+    )
+
+
+def getCumulativeTravelCosts(position, task_list: List[TrajectoryTask], environment, profile=DEFAULT_PROFILE):
+    """Returns the travel cost until the end of each task in the task list, the total travel cost is the last entry plus the cost of returning home"""
+    cumulative_costs = []
+    cost = 0
+    previous_end = position
+    for task in task_list:
+        cost += getTravelCost(previous_end, task.start, environment, profile) + profile.cost(task.length)
+        cumulative_costs.append(cost)
+        previous_end = task.end
+    return cumulative_costs
+
+
+def insertPathCost(path_costs, position, task_list: List[TrajectoryTask], n, task: TrajectoryTask, environment, profile=DEFAULT_PROFILE):
+    """Updates the cumulative travel costs of the task list (see getCumulativeTravelCosts) for inserting the task at index n
+
+    Returns the increase of the total travel cost
+    """
+    previous_end = position if n == 0 else task_list[n - 1].end
+    previous_cost = 0 if n == 0 else path_costs[n - 1]
+    insertion_cost = getInsertionCost(position, task_list, n, task, environment, profile)
+    path_costs.insert(n, previous_cost + getTravelCost(previous_end, task.start, environment, profile) + profile.cost(task.length))
+    for i in range(n + 1, len(path_costs)):
+        path_costs[i] += insertion_cost
+    return insertion_cost
+
+
+def getPathCost(position, task_list: List[TrajectoryTask], path_costs, environment, profile=DEFAULT_PROFILE):
+    """Returns the total travel cost from the cumulative travel costs, by adding the cost of returning home"""
+    if len(task_list) == 0:
+        return 0
+    return path_costs[-1] + getTravelCost(position, task_list[-1].end, environment, profile)
+
+
 # S_i calculation of the agent
-def calculatePathReward(position, task_list: List[TrajectoryTask], environment, Lambda=0.95):
+def calculatePathReward(position, task_list: List[TrajectoryTask], environment, Lambda=0.95, profile=DEFAULT_PROFILE):
     S_p = 0
 
     if len(task_list) > 0:
-        travel_cost = getTravelCost(position, task_list[0].start, environment)
+        travel_cost = getTravelCost(position, task_list[0].start, environment, profile)
         S_p += getTimeDiscountedReward(travel_cost, Lambda, task_list[0])
         for t_index in range(len(task_list) - 1):
-            travel_cost += getTravelCost(task_list[t_index].end, task_list[t_index + 1].start, environment)
+            travel_cost += getTravelCost(task_list[t_index].end, task_list[t_index + 1].start, environment, profile)
             S_p += getTimeDiscountedReward(travel_cost, Lambda, task_list[t_index + 1])
     return S_p
 
@@ -220,8 +580,8 @@ def getTrajectory(task_list: List[TrajectoryTask]):
     if len(task_list) > 0:
         trajectory.append(task_list[0].start)
         for t_index in range(len(task_list) - 1):
-            trajectory.extend(task_list[t_index].trajectory.coords)
+            trajectory.extend(task_list[t_index].coords)
             trajectory.append(task_list[t_index].end)
-        trajectory.extend(task_list[-1].trajectory.coords)
+        trajectory.extend(task_list[-1].coords)
         trajectory.append(task_list[-1].end)
     return trajectory
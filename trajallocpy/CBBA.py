@@ -1,24 +1,52 @@
-import copy
-import itertools
+from __future__ import annotations
+
+import functools
 import multiprocessing
 import random
+import timeit
 from typing import List
 
 import numpy as np
 
-from trajallocpy import Agent
+from trajallocpy import Agent, Kernels, LocalSearch
 from trajallocpy.Task import TrajectoryTask
 
 EPSILON = np.finfo(float).eps
 
 
+def _reserve(buffer: np.ndarray, size: int, fill_value) -> np.ndarray:
+    """Returns a buffer which can hold at least size elements, growing it geometrically keeps appending amortized O(1)"""
+    if size <= len(buffer):
+        return buffer
+    grown = np.full((max(size, 2 * len(buffer)),) + buffer.shape[1:], fill_value, dtype=buffer.dtype)
+    grown[: len(buffer)] = buffer
+    return grown
+
+
 class BundleResult:
     def __init__(self, agent: Agent):
         self.bundle = agent.bundle
         self.path = agent.path
+        self.path_costs = agent.path_costs
+        self.path_cost = agent.path_cost
+        self.times = agent.times
+        self.time_slack = agent.time_slack
         self.winning_agents = agent.winning_agents
         self.winning_bids = agent.winning_bids
+        # The tasks are reversed in the process building the bundle
+        self.is_reversed = agent.is_reversed
         self.id = agent.id
+        self.pruning = None if agent.pruner is None else (agent.pruner.total, agent.pruner.considered)
+
+
+class ConsensusResult(BundleResult):
+    def __init__(self, agent: Agent, converged):
+        super().__init__(agent)
+        self.removal_list = agent.removal_list
+        self.timestamps = agent.timestamps
+        self.time_step = agent.time_step
+        self.auction_tasks = agent.auction_tasks
+        self.converged = converged
 
 
 class agent:
@@ -32,10 +60,25 @@ class agent:
         tasks=None,
         color=None,
         point_estimation=False,
+        candidate_k=None,
+        candidate_radius=None,
+        use_kernels=False,
+        max_velocity=5,
+        max_acceleration=2,
     ):
         self.environment = environment
-        self.tasks = copy.deepcopy(tasks)
         self.task_num = len(tasks)
+        self._tasks = np.empty(self.task_num, dtype=object)
+        # The tasks are shared between the agents, a task reversed by this agent is replaced by a reversed copy
+        self._tasks[:] = list(tasks)
+        # Orientation of each task relative to the given task
+        self._reversed = np.zeros(self.task_num, dtype=bool)
+        # Array backed endpoints of the tasks, used by the compiled scoring kernels
+        self.use_kernels = use_kernels
+        self._starts, self._ends, self._rewards, self._lengths = Kernels.task_arrays(self.tasks)
+        self._start_times, self._latest_starts = Kernels.time_window_arrays(self.tasks)
+        # The time windows are only checked when one of the tasks expires
+        self.has_time_windows = bool(np.isfinite(self._latest_starts).any())
         self.use_single_point_estimation = point_estimation
         if color is None:
             self.color = (
@@ -46,23 +89,29 @@ class agent:
         else:
             self.color = color
 
-        # TODO this should be configurable
-        self.max_velocity = 3
-        self.max_acceleration = 1
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        # The travel costs are priced with the speed class of the agent
+        self.profile = Agent.KinematicProfile(float(max_velocity), float(max_acceleration))
 
         # Agent ID
         self.id = id
 
         # Local Winning Agent List
-        self.winning_agents = np.ones(self.task_num, dtype=np.int8) * self.id
+        self._winning_agents = np.ones(self.task_num, dtype=np.int8) * self.id
         # Local Winning Bid List
-        self.winning_bids = np.array([0 for _ in range(self.task_num)], dtype=np.float64)
+        self._winning_bids = np.zeros(self.task_num, dtype=np.float64)
         # Bundle
         self.bundle = []
         # Path
         self.path = []
-        # times: List of time in seconds to each task in the path
+        # Cumulative travel cost until the end of each task in the path and the total travel cost including returning home
+        self.path_costs = []
+        self.path_cost = 0
+        # times: List of time in seconds to the start of each task in the path
         self.times = []
+        # time_slack: List of how long the start of each task in the path can be postponed without violating a time window
+        self.time_slack = []
         # Maximum task capacity
         if capacity is None:
             raise Exception("Error: agent capacity cannot be None")
@@ -84,34 +133,189 @@ class agent:
 
         self.availability_time = 0
 
-        self.removal_list = np.zeros(self.task_num, dtype=np.int8)
+        self._removal_list = np.zeros(self.task_num, dtype=np.int8)
         self.removal_threshold = 5
 
+        # Tasks open for auction, None means all tasks. Used for only re-auctioning the tasks added during a run
+        self.auction_tasks = None
+
+        # Only consider the tasks nearest to the path when building the bundle
+        self.pruner = None
+        if candidate_k is not None or candidate_radius is not None:
+            self.pruner = Agent.CandidatePruner(self.tasks, k=candidate_k, radius=candidate_radius)
+
+    # The task arrays are views into buffers with spare capacity, such that tasks can be added during a run
+    @property
+    def tasks(self):
+        return self._tasks[: self.task_num]
+
+    @property
+    def starts(self):
+        return self._starts[: self.task_num]
+
+    @property
+    def ends(self):
+        return self._ends[: self.task_num]
+
+    @property
+    def rewards(self):
+        return self._rewards[: self.task_num]
+
+    @property
+    def lengths(self):
+        return self._lengths[: self.task_num]
+
+    @property
+    def is_reversed(self):
+        return self._reversed[: self.task_num]
+
+    @property
+    def winning_agents(self):
+        return self._winning_agents[: self.task_num]
+
+    @winning_agents.setter
+    def winning_agents(self, value):
+        self._winning_agents[: self.task_num] = value
+
+    @property
+    def winning_bids(self):
+        return self._winning_bids[: self.task_num]
+
+    @winning_bids.setter
+    def winning_bids(self, value):
+        self._winning_bids[: self.task_num] = value
+
+    @property
+    def removal_list(self):
+        return self._removal_list[: self.task_num]
+
     def update_bundle_result(self, state: BundleResult):
         if self.id == state.id:
             self.bundle = state.bundle
             self.path = state.path
+            self.path_costs = state.path_costs
+            self.path_cost = state.path_cost
+            self.times = state.times
+            self.time_slack = state.time_slack
             self.winning_agents = state.winning_agents
             self.winning_bids = state.winning_bids
+            for j in np.flatnonzero(self.is_reversed != state.is_reversed):
+                self.reverse_task(j)
+            if state.pruning is not None:
+                self.pruner.total, self.pruner.considered = state.pruning
+            if isinstance(state, ConsensusResult):
+                self.removal_list[:] = state.removal_list
+                self.timestamps = state.timestamps
+                self.time_step = state.time_step
+                self.auction_tasks = state.auction_tasks
 
     def add_tasks(self, tasks):
-        self.tasks.extend(tasks)
+        """Appends the tasks to the task list, the existing bundle and bids are kept and only the new tasks are opened for auction"""
+        tasks = list(tasks)
+        new_task_num = self.task_num + len(tasks)
+        self._tasks = _reserve(self._tasks, new_task_num, None)
+        self._starts = _reserve(self._starts, new_task_num, 0)
+        self._ends = _reserve(self._ends, new_task_num, 0)
+        self._rewards = _reserve(self._rewards, new_task_num, 0)
+        self._lengths = _reserve(self._lengths, new_task_num, 0)
+        self._start_times = _reserve(self._start_times, new_task_num, 0)
+        self._latest_starts = _reserve(self._latest_starts, new_task_num, np.inf)
+        self._winning_agents = _reserve(self._winning_agents, new_task_num, -1)
+        self._winning_bids = _reserve(self._winning_bids, new_task_num, 0)
+        self._removal_list = _reserve(self._removal_list, new_task_num, 0)
+        self._reversed = _reserve(self._reversed, new_task_num, False)
+
+        self._tasks[self.task_num : new_task_num] = tasks
+        (
+            self._starts[self.task_num : new_task_num],
+            self._ends[self.task_num : new_task_num],
+            self._rewards[self.task_num : new_task_num],
+            self._lengths[self.task_num : new_task_num],
+        ) = Kernels.task_arrays(tasks)
+        self._start_times[self.task_num : new_task_num], self._latest_starts[self.task_num : new_task_num] = Kernels.time_window_arrays(tasks)
+        self.has_time_windows = self.has_time_windows or bool(np.isfinite(self._latest_starts[self.task_num : new_task_num]).any())
+        self._winning_agents[self.task_num : new_task_num] = -1
+        self._winning_bids[self.task_num : new_task_num] = 0
+        self._removal_list[self.task_num : new_task_num] = 0
+        self._reversed[self.task_num : new_task_num] = False
+        if self.auction_tasks is None:
+            self.auction_tasks = set()
+        self.auction_tasks.update(range(self.task_num, new_task_num))
+        self.task_num = new_task_num
+        if self.pruner is not None:
+            self.pruner.update_tasks(self.tasks)
+
+    def get_state(self) -> dict:
+        """Returns the allocation state of the agent, the task orientation is given relative to the tasks the agent was given"""
+        return {
+            "bundle": np.array(self.bundle, dtype=np.int64),
+            "path": np.array(self.path, dtype=np.int64),
+            "times": np.array(self.times, dtype=np.float64),
+            "winning_bids": self.winning_bids.copy(),
+            "winning_agents": self.winning_agents.copy(),
+            "removal_list": self.removal_list.copy(),
+            "timestamps": np.array([self.timestamps[a] for a in sorted(self.timestamps)], dtype=np.int64),
+            "time_step": self.time_step,
+            "reversed": self.is_reversed.copy(),
+        }
+
+    def set_state(self, state: dict):
+        if len(state["winning_bids"]) != self.task_num:
+            raise ValueError(f"Error: the state has {len(state['winning_bids'])} tasks, but agent {self.id} has {self.task_num} tasks")
+        self.bundle = state["bundle"].tolist()
+        self.path = state["path"].tolist()
+        self.winning_bids = state["winning_bids"]
+        self.winning_agents = state["winning_agents"]
+        self.removal_list[:] = state["removal_list"]
+        self.timestamps = dict(enumerate(state["timestamps"].tolist()))
+        self.time_step = int(state["time_step"])
+        for j in np.flatnonzero(self.is_reversed != state["reversed"]):
+            self.reverse_task(j)
+        self.update_path_costs()
+        self.update_times()
+
+    def reverse_task(self, j):
+        self._tasks[j] = self._tasks[j].reversed_copy()
+        self._reversed[j] = not self._reversed[j]
+        self._starts[j], self._ends[j] = self._ends[j].copy(), self._starts[j].copy()
+
+    def update_path_costs(self):
+        """Recomputes the cumulative travel costs of the path, only needed when the path is changed outside of build_bundle"""
+        path_tasks = self.getPathTasks()
+        self.path_costs = Agent.getCumulativeTravelCosts(self.state, path_tasks, self.environment, self.profile)
+        self.path_cost = Agent.getPathCost(self.state, path_tasks, self.path_costs, self.environment, self.profile)
+
+    def update_times(self):
+        """Recomputes the start times and forward time slack of the tasks in the path"""
+        self.times, self.time_slack = Agent.getScheduleTimes(self.state, self.getPathTasks(), self.environment, self.availability_time, self.profile)
+
+    def __use_compiled_costs(self):
+        # The kernels compute euclidean distances, which do not go around the restricted areas added while solving
+        return self.use_kernels and not Agent.hasAddedRestrictedAreas(self.environment)
+
+    def getTotalTravelCost(self):
+        if self.__use_compiled_costs():
+            path = np.array(self.path, dtype=np.int64)
+            return Kernels.total_travel_cost(np.array(self.state), self._starts, self._ends, self._lengths, path, *self.profile)
+        return Agent.getTotalTravelCost(self.state, self.getPathTasks(), self.environment, self.profile)
 
     def getPathTasks(self) -> List[TrajectoryTask]:
         return self.tasks[self.path]
 
     def send_message(self):
-        return self.winning_bids.tolist(), self.winning_agents.tolist(), self.timestamps
+        # The timestamps are copied, as they are updated in place during the consensus of this agent
+        return self.winning_bids.tolist(), self.winning_agents.tolist(), dict(self.timestamps)
 
     def receive_message(self, Y):
         self.Y = Y
 
-    def getCij(self):
+    def getCij(self, use_pruning=True, excluded=()):
         """
-        Returns the cost list c_ij for agent i where the position n results in the greatest reward
+        Returns the cost list c_ij for agent i where the position n results in the greatest reward, the excluded tasks are not bid on
+
+        The capacity and the time windows are checked in the orientation which is bid on, which is the orientation minimising
+        the travel cost or the opposite one when only it is feasible.
         """
-        # Calculate Sp_i
-        S_p = Agent.calculatePathReward(self.state, self.getPathTasks(), self.environment, self.Lambda)
         # init
         best_pos = np.zeros(self.task_num, dtype=int)
         c = np.zeros(self.task_num)
@@ -119,32 +323,125 @@ class agent:
         best_time = 0
         # Collect the tasks which should be considered for planning
         ignore_tasks = [key for key, value in enumerate(self.removal_list) if value > self.removal_threshold]
-        tasks_to_check = set(range(len(self.tasks))).difference(self.bundle).difference(ignore_tasks)
+        tasks_to_check = set(range(self.task_num)) if self.auction_tasks is None else set(self.auction_tasks)
+        tasks_to_check = tasks_to_check.difference(self.bundle).difference(ignore_tasks).difference(excluded)
+        if self.pruner is not None and use_pruning:
+            tasks_to_check = self.pruner.prune(tasks_to_check, Agent.getQueryPoints(self.state, self.getPathTasks()))
+
+        if self.__use_compiled_costs():
+            candidates = np.fromiter(tasks_to_check, dtype=np.int64, count=len(tasks_to_check))
+            path = np.array(self.path, dtype=np.int64)
+            time_windows = None
+            if self.has_time_windows:
+                time_windows = (
+                    self._start_times[: self.task_num],
+                    self._latest_starts[: self.task_num],
+                    np.array(self.times, dtype=np.float64),
+                    np.array(self.time_slack, dtype=np.float64),
+                    float(self.availability_time),
+                )
+            c, best_pos, reverse = Kernels.best_insertions(
+                candidates,
+                np.array(self.state),
+                self.starts,
+                self.ends,
+                self.rewards,
+                self.lengths,
+                path,
+                self.capacity - self.path_cost,
+                time_windows,
+                not self.use_single_point_estimation,
+                *self.profile,
+            )
+            return (best_pos, c, reverse, best_time)
 
-        for n, j in itertools.product(range(len(self.path) + 1), tasks_to_check):
-            S_pj, should_be_reversed, best_time = Agent.calculatePathRewardWithNewTask(
-                j, n, self.state, self.tasks, self.path, self.environment, self.Lambda, self.use_single_point_estimation
+        # Calculate Sp_i
+        path_tasks = self.getPathTasks()
+        S_p = Agent.calculatePathReward(self.state, path_tasks, self.environment, self.Lambda, self.profile)
+        leg_costs = Agent.getLegCosts(self.state, path_tasks, self.environment, self.profile)
+        candidates = np.fromiter(tasks_to_check, dtype=np.int64, count=len(tasks_to_check))
+        for n in range(len(self.path) + 1):
+            previous_end = self.state if n == 0 else path_tasks[n - 1].end
+            next_start = self.state if n == len(self.path) else path_tasks[n].start
+            # The travel costs into and out of all the candidates in both orientations are evaluated at once
+            entry_costs, exit_costs, is_reversed = Agent.getOrientedInsertionCosts(
+                previous_end,
+                next_start,
+                self.starts[candidates],
+                self.ends[candidates],
+                allow_reversal=not self.use_single_point_estimation,
+                profile=self.profile,
+                environment=self.environment,
             )
-            c_ijn = S_pj - S_p
-            if c[j] < c_ijn:
-                c[j] = c_ijn  # Store the cost
-                best_pos[j] = n
-                reverse[j] = should_be_reversed
+            removed_cost = Agent.getTravelCost(previous_end, next_start, self.environment, self.profile)
+            service_costs = self.profile.costs(self.lengths[candidates])
+            for j, entry_cost, exit_cost, service_cost, should_reverse in zip(candidates, entry_costs, exit_costs, service_costs, is_reversed):
+                # Skip the infeasible insertions before evaluating the reward, trying the opposite orientation when allowed
+                oriented_costs = (entry_cost, exit_cost, bool(should_reverse))
+                if not self.__is_feasible_orientation(n, j, path_tasks, oriented_costs, service_cost, removed_cost):
+                    if self.use_single_point_estimation:
+                        continue
+                    oriented_costs = Agent.getOrientedCosts(previous_end, next_start, self.tasks[j], not should_reverse, self.environment, self.profile)
+                    if not self.__is_feasible_orientation(n, j, path_tasks, oriented_costs, service_cost, removed_cost):
+                        continue
+                S_pj, should_be_reversed, best_time = Agent.calculatePathRewardWithNewTask(
+                    j,
+                    n,
+                    self.state,
+                    self.tasks,
+                    self.path,
+                    self.environment,
+                    self.Lambda,
+                    self.use_single_point_estimation,
+                    oriented_costs,
+                    self.profile,
+                    leg_costs,
+                )
+                c_ijn = S_pj - S_p
+                if c[j] < c_ijn:
+                    c[j] = c_ijn  # Store the cost
+                    best_pos[j] = n
+                    reverse[j] = should_be_reversed
 
         return (best_pos, c, reverse, best_time)
 
-    def update_time(self, index, time):
-        self.times.insert(index, time)
-        # Correct the times after the insertion
-        for i in range(index + 1, len(self.times)):
-            self.times[i] += time
-
-    def build_bundle(self, queue: multiprocessing.Queue):
-        while Agent.getTotalTravelCost(self.state, self.getPathTasks(), self.environment) <= self.capacity:
-            best_pos, c, reverse, best_time = self.getCij()
-            D1 = c - self.winning_bids > EPSILON
-            D2 = abs(c - self.winning_bids) <= EPSILON
-            h = D1 | (D2 & (self.id < self.winning_agents))
+    def __is_feasible_orientation(self, n, j, path_tasks, oriented_costs, service_cost, removed_cost):
+        entry_cost, exit_cost, is_reversed = oriented_costs
+        if self.path_cost + (entry_cost + service_cost + exit_cost - removed_cost) > self.capacity:
+            return False
+        # The time windows are checked in constant time using the forward slack of the path
+        task = self.tasks[j].reversed_copy() if is_reversed else self.tasks[j]
+        return not self.has_time_windows or Agent.isTimeWindowFeasible(
+            self.state, path_tasks, self.times, self.time_slack, n, task, self.environment, self.availability_time, self.profile
+        )
+
+    def __is_feasible_insertion(self, n, j):
+        path_tasks = self.getPathTasks()
+        if self.path_cost + Agent.getInsertionCost(self.state, path_tasks, n, self.tasks[j], self.environment, self.profile) > self.capacity:
+            return False
+        return not self.has_time_windows or Agent.isTimeWindowFeasible(
+            self.state, path_tasks, self.times, self.time_slack, n, self.tasks[j], self.environment, self.availability_time, self.profile
+        )
+
+    def __winnable(self, c):
+        D1 = c - self.winning_bids > EPSILON
+        D2 = abs(c - self.winning_bids) <= EPSILON
+        return D1 | (D2 & (self.id < self.winning_agents))
+
+    def build_bundle(self, queue: multiprocessing.Queue | None = None, deadline=None) -> BundleResult:
+        """Adds tasks to the bundle until no task can be won, the capacity is reached or the deadline (timeit.default_timer) has passed
+
+        The result is returned, and put in the queue when given such that the bundle can be built in a separate process
+        """
+        # The tasks whose bid turned out to be infeasible, which are not bid on again
+        excluded = set()
+        while self.path_cost <= self.capacity and (deadline is None or timeit.default_timer() < deadline):
+            best_pos, c, reverse, _ = self.getCij(excluded=excluded)
+            h = self.__winnable(c)
+            if sum(h) == 0 and self.pruner is not None:
+                # None of the nearby tasks can be won, fall back to checking all the tasks
+                best_pos, c, reverse, _ = self.getCij(use_pruning=False, excluded=excluded)
+                h = self.__winnable(c)
             if sum(h) == 0:  # No valid task
                 break
 
@@ -154,18 +451,71 @@ class agent:
 
             # reverse the task with max reward if necesarry
             if reverse[J_i]:
-                self.tasks[J_i].reverse()
+                self.reverse_task(J_i)
+            # getCij checked the insertion in this orientation, the check is repeated with the costs used for the path cost,
+            # the task is dropped rather than inserted in another orientation with an unchecked cost and a stale bid
+            if not self.__is_feasible_insertion(n_J, J_i):
+                if reverse[J_i]:
+                    self.reverse_task(J_i)
+                excluded.add(J_i)
+                continue
 
             self.bundle.append(J_i)
+            self.path_cost += Agent.insertPathCost(self.path_costs, self.state, self.getPathTasks(), n_J, self.tasks[J_i], self.environment, self.profile)
             self.path.insert(n_J, J_i)
-            self.update_time(n_J, best_time)
+            self.update_times()
 
             self.winning_bids[J_i] = c[J_i]
             self.winning_agents[J_i] = self.id
 
-        queue.put(BundleResult(self))
+        return self.__put_result(queue, BundleResult(self))
+
+    def drop_task(self, j, winning_agent, winning_bid):
+        """Removes the task from the bundle and path in favour of the winning agent, without releasing the succeeding tasks"""
+        self.bundle.remove(j)
+        self.path.remove(j)
+        self.winning_agents[j] = winning_agent
+        self.winning_bids[j] = winning_bid
+        self.update_path_costs()
+        self.update_times()
+
+    def improve_path(self, queue: multiprocessing.Queue | None = None, time_budget=None) -> BundleResult:
+        """Improves the order and orientation of the tasks in the path by local search (see LocalSearch), the bundle is unchanged"""
+        path_tasks = self.getPathTasks()
+        if len(path_tasks) > 1:
+            table = LocalSearch.endpoint_cost_table(self.state, path_tasks, self.environment, self.profile)
+            is_feasible = None
+            if self.has_time_windows:
+                is_feasible = functools.partial(
+                    LocalSearch.schedule_feasible,
+                    table,
+                    self.profile.costs(self.lengths[self.path]),
+                    [task.start_time for task in path_tasks],
+                    [task.getLatestStartTime() for task in path_tasks],
+                    self.availability_time,
+                )
+            order, flipped = LocalSearch.improve_route(table, time_budget, is_feasible)
+            path = np.array(self.path)
+            for j in path[flipped]:
+                self.reverse_task(j)
+            self.path = path[order].tolist()
+            self.update_path_costs()
+            self.update_times()
+        return self.__put_result(queue, BundleResult(self))
+
+    def run_consensus(self, queue: multiprocessing.Queue | None = None) -> ConsensusResult:
+        """Updates the bids with the received messages (see update_task), the result is returned and put in the queue when given"""
+        return self.__put_result(queue, ConsensusResult(self, self.update_task()))
+
+    @staticmethod
+    def __put_result(queue, result):
+        if queue is not None:
+            queue.put(result)
+        return result
 
     def update_task(self):
+        if self.use_kernels:
+            return self.__update_task_compiled()
         id_list = list(self.Y.keys())
         id_list.insert(0, self.id)
 
@@ -300,6 +650,43 @@ class agent:
         converged = False
         return converged
 
+    def __update_task_compiled(self):
+        # Same rules as update_task, run by a compiled kernel which releases the GIL such that agents in threads update in parallel
+        neighbours = np.array(list(self.Y.keys()), dtype=np.int64)
+        agent_ids = sorted(self.timestamps)
+        shape = (len(neighbours), self.task_num)
+        bids = np.array([self.Y[k][0] for k in neighbours], dtype=np.float64).reshape(shape)
+        agents = np.array([self.Y[k][1] for k in neighbours], dtype=np.int64).reshape(shape)
+        neighbour_timestamps = np.array([[self.Y[k][2][a] for a in agent_ids] for k in neighbours], dtype=np.int64)
+        neighbour_timestamps = neighbour_timestamps.reshape(len(neighbours), len(agent_ids))
+        timestamps = np.array([self.timestamps[a] for a in agent_ids], dtype=np.int64)
+        bundle_length = Kernels.consensus_update(
+            self.id,
+            self.winning_bids,
+            self.winning_agents,
+            timestamps,
+            self.time_step,
+            neighbours,
+            bids,
+            agents,
+            neighbour_timestamps,
+            np.array(self.bundle, dtype=np.int64),
+            self.removal_list,
+            EPSILON,
+        )
+        self.timestamps = dict(zip(agent_ids, timestamps.tolist()))
+        if bundle_length < len(self.bundle):
+            displaced = self.bundle[bundle_length:]
+            self.path = [num for num in self.path if num not in displaced]
+            self.update_path_costs()
+            self.update_times()
+            if self.auction_tasks is not None:
+                self.auction_tasks.update(displaced)
+            self.bundle = self.bundle[:bundle_length]
+
+        self.time_step += 1
+        return False
+
     def __update_path(self, task):
         if task not in self.bundle:
             return
@@ -311,6 +698,11 @@ class agent:
 
         self.removal_list[task] = self.removal_list[task] + 1
         self.path = [num for num in self.path if num not in self.bundle[index:]]
+        self.update_path_costs()
+        self.update_times()
+        if self.auction_tasks is not None:
+            # The displaced tasks has to be re-auctioned as well
+            self.auction_tasks.update(self.bundle[index:])
         self.bundle = self.bundle[:index]
 
     def __update(self, j, y_kj, z_kj):
@@ -0,0 +1,89 @@
+import warnings
+from typing import List
+
+import numpy as np
+import shapely
+from scipy.cluster.vq import kmeans2
+
+from trajallocpy.Task import TrajectoryTask
+
+
+def cluster_tasks(tasks: List[TrajectoryTask], n_clusters: int, method="kmeans", seed=None) -> np.ndarray:
+    """Clusters the tasks spatially based on their midpoints
+
+    Parameters
+    ----------
+    tasks
+        The tasks to cluster
+    n_clusters
+        The (maximum) number of clusters, empty clusters are removed
+    method
+        "kmeans" for k-means clustering or "grid" for a uniform grid over the bounding box of the tasks
+    seed
+        Seed or numpy Generator for the initial k-means centroids, None draws them from fresh entropy
+
+    Returns
+    -------
+    np.ndarray
+        The cluster label of each task, the labels are 0..number of clusters - 1
+    """
+    midpoints = shapely.get_coordinates(shapely.line_interpolate_point([task.trajectory for task in tasks], 0.5, normalized=True))
+    n_clusters = min(n_clusters, len(tasks))
+    if method == "kmeans":
+        with warnings.catch_warnings():
+            # Empty clusters are removed below
+            warnings.simplefilter("ignore", UserWarning)
+            _, labels = kmeans2(midpoints, n_clusters, minit="++", seed=seed)
+    elif method == "grid":
+        cells_per_axis = int(np.ceil(np.sqrt(n_clusters)))
+        min_xy = midpoints.min(axis=0)
+        cell_size = np.maximum(midpoints.max(axis=0) - min_xy, np.finfo(float).eps) / cells_per_axis
+        cells = np.minimum(((midpoints - min_xy) // cell_size).astype(int), cells_per_axis - 1)
+        labels = cells[:, 0] + cells[:, 1] * cells_per_axis
+    else:
+        raise ValueError(f"Error: unknown clustering method {method}")
+    _, labels = np.unique(labels, return_inverse=True)
+    return labels
+
+
+def _order_tasks(tasks: List[TrajectoryTask]):
+    # Greedy nearest neighbour ordering of the tasks, returns the coordinates of the resulting trajectory
+    starts = np.array([task.start for task in tasks])
+    ends = np.array([task.end for task in tasks])
+    remaining = np.ones(len(tasks), dtype=bool)
+    coords = list(tasks[0].coords)
+    remaining[0] = False
+    position = ends[0]
+    for _ in range(len(tasks) - 1):
+        to_start = np.where(remaining, np.hypot(*(starts - position).T), np.inf)
+        to_end = np.where(remaining, np.hypot(*(ends - position).T), np.inf)
+        if to_start.min() <= to_end.min():
+            current = int(to_start.argmin())
+            coords.extend(tasks[current].coords)
+            position = ends[current]
+        else:
+            current = int(to_end.argmin())
+            coords.extend(tasks[current].coords[::-1])
+            position = starts[current]
+        remaining[current] = False
+    return coords
+
+
+def aggregate_clusters(tasks: List[TrajectoryTask], labels: np.ndarray):
+    """Creates an aggregate task for each cluster
+
+    The trajectory of an aggregate task visits the tasks of the cluster in a greedy nearest neighbour order
+    and its reward is the sum of the rewards of the tasks.
+
+    Returns
+    -------
+    tuple
+        The aggregate tasks and the indices of the tasks in each cluster
+    """
+    members = [np.flatnonzero(labels == label).tolist() for label in range(labels.max() + 1)]
+    cluster_tasks = []
+    for cluster_id, task_indices in enumerate(members):
+        cluster = [tasks[i] for i in task_indices]
+        trajectory = shapely.LineString(_order_tasks(cluster))
+        cluster_tasks.append(TrajectoryTask(cluster_id, trajectory, reward=sum(task.reward for task in cluster)))
+    return cluster_tasks, members
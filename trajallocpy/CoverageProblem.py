@@ -1,10 +1,213 @@
+import dataclasses
+import itertools
+import math
 import random
-from typing import List
+import warnings
+from typing import List, NamedTuple
 
+import networkx as nx
+import numpy as np
 import shapely.geometry
-from extremitypathfinder import PolygonEnvironment
+from extremitypathfinder import PolygonEnvironment, utils
 
-from trajallocpy import Task
+from trajallocpy import Agent, Task
+
+_cache_scopes = itertools.count()
+
+# Expected acceptance rate of the rejection sampling below which the points are sampled from a triangulation of the free space
+TRIANGULATION_ACCEPTANCE = 0.25
+
+# Resolution of the endpoint coordinates when comparing tasks for duplicates
+ENDPOINT_RESOLUTION = 1e-6
+
+
+class PointSample(NamedTuple):
+    points: np.ndarray  # (n, 2) array of points in the free space
+    acceptance_rate: float  # Fraction of the drawn candidate points which were in the free space
+
+
+class TaskValidation(NamedTuple):
+    tasks: List[Task.TrajectoryTask]  # The valid tasks in the given order
+    rejected: np.ndarray  # Indices of the given tasks leaving the search area or crossing a restricted area
+    clipped: np.ndarray  # Indices of the rejected tasks replaced by their parts inside the free space
+    duplicates: np.ndarray  # Indices of the given tasks with the same endpoints as an existing or a preceding task (or part)
+
+
+def _endpoint_keys(lines) -> np.ndarray:
+    # Returns the quantized endpoints of the task lines as rows, ordered such that a task and its reverse have the same row
+    coords, index = shapely.get_coordinates(lines, return_index=True)
+    counts = np.bincount(index, minlength=len(lines))
+    last = np.cumsum(counts) - 1
+    first = last - counts + 1
+    points = np.round(np.stack([coords[first], coords[last]], axis=1) / ENDPOINT_RESOLUTION).astype(np.int64)
+    start, end = points[:, 0], points[:, 1]
+    swap = (start[:, 0] > end[:, 0]) | ((start[:, 0] == end[:, 0]) & (start[:, 1] > end[:, 1]))
+    points[swap] = points[swap, ::-1]
+    return points.reshape(-1, 4)
+
+
+def _is_first(existing_keys, keys) -> np.ndarray:
+    # Returns whether each row of keys differs from the existing rows and the preceding rows of keys
+    keys = np.concatenate([existing_keys, keys])
+    # The sort is stable, thus the first row of each group of equal rows is the existing or the preceding one
+    order = np.lexsort(keys.T[::-1])
+    is_first = np.ones(len(keys), dtype=bool)
+    is_first[order[1:]] = (keys[order[1:]] != keys[order[:-1]]).any(axis=1)
+    return is_first[len(existing_keys) :]
+
+
+def _task_lines(tasks) -> np.ndarray:
+    return np.fromiter((task.trajectory for task in tasks), dtype=object, count=len(tasks))
+
+
+def _crosses_interior(lines, polygon):
+    # Lines which only touch the boundary of the polygon are still valid visibility edges
+    return shapely.relate_pattern(lines, polygon, "T********")
+
+
+class IncrementalPolygonEnvironment(PolygonEnvironment):
+    """PolygonEnvironment which can add and remove holes without recomputing the whole visibility graph
+
+    Holes are appended after the existing polygons, so the vertex indices of the existing graph stay valid
+    and only the visibility edges crossing the changed hole has to be checked.
+    The holes added after storing the environment are kept in added_holes, the distances of the agents (see Agent.getDistance)
+    only leave the straight line when it crosses one of them.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.added_holes = []
+
+    def crosses_added_holes(self, starts, ends) -> np.ndarray:
+        """Checks whether the straight lines between the (broadcast) start and end points pass through the interior of one of the added holes"""
+        starts, ends = np.broadcast_arrays(np.asarray(starts, dtype=float), np.asarray(ends, dtype=float))
+        lines = shapely.linestrings(np.stack([starts, ends], axis=-2))
+        crosses = np.zeros(np.shape(lines), dtype=bool)
+        for polygon in self.added_holes:
+            crosses |= _crosses_interior(lines, polygon)
+        return crosses
+
+    def _compile(self):
+        (
+            self.coords,
+            self.extremity_indices,
+            self.extremity_mask,
+            self.vertex_edge_idxs,
+            self.edge_vertex_idxs,
+        ) = utils.compile_polygon_datastructs(self.boundary_polygon, self.holes)
+        self.nr_vertices = self.edge_vertex_idxs.shape[0]
+        self.idx_start = self.nr_vertices
+        self.idx_goal = self.nr_vertices + 1
+        # Drop the temporary start and goal entries of previous queries, their indices might be reused
+        extremities = set(self.extremity_indices)
+        self.reprs_n_distances = {i: v for i, v in self.reprs_n_distances.items() if i in extremities}
+
+    def _shares_vertices(self, hole):
+        # Identical vertices are merged in the graph, which is not supported by the incremental update
+        others = np.concatenate([self.boundary_polygon] + [h for h in self.holes if h is not hole])
+        return not set(map(tuple, hole)).isdisjoint(map(tuple, others))
+
+    def _rebuild(self):
+        self.prepared = False
+        self.store(self.boundary_polygon, self.holes, validate=False)
+
+    def _add_visible_edges(self, origin, candidates):
+        vert_idx2repr, vert_idx2dist = self.reprs_n_distances[origin]
+        candidates = {i for i in candidates if vert_idx2dist[i] != 0.0}
+        visible = utils.find_visible(
+            origin,
+            candidates,
+            set(range(self.nr_edges)),
+            self.coords,
+            vert_idx2repr,
+            vert_idx2dist,
+            self.edge_vertex_idxs,
+            self.vertex_edge_idxs,
+            self.extremity_mask,
+        )
+        for i in visible:
+            self.graph.add_edge(origin, i, weight=vert_idx2dist[i])
+
+    def add_hole(self, hole_coordinates):
+        """Adds a hole (clockwise, without repeating the first point) and updates the affected visibility edges"""
+        hole = np.array(hole_coordinates, dtype=float)
+        first_new_idx = self.nr_vertices
+        self.holes.append(hole)
+        polygon = shapely.Polygon(hole)
+        shapely.prepare(polygon)
+        self.added_holes.append(polygon)
+        if self._shares_vertices(hole):
+            self._rebuild()
+            return
+        self._compile()
+
+        # Remove the existing edges which are now blocked by the hole
+        edges = np.array(self.graph.edges, dtype=int).reshape(-1, 2)
+        if len(edges) > 0:
+            lines = shapely.linestrings(self.coords[edges])
+            blocked = _crosses_interior(lines, polygon)
+            self.graph.remove_edges_from(map(tuple, edges[blocked]))
+
+        # Extend the representations of the existing extremities with the vertices of the hole
+        for i, repr_n_dist in self.reprs_n_distances.items():
+            extension = utils.cmp_reps_n_distances(0, np.vstack([self.coords[i], hole]))[:, 1:]
+            self.reprs_n_distances[i] = np.concatenate([repr_n_dist[:, :first_new_idx], extension], axis=1)
+
+        # Connect the extremities of the new hole to the rest of the graph
+        new_extremities = [i for i in self.extremity_indices if i >= first_new_idx]
+        for origin in new_extremities:
+            self.reprs_n_distances[origin] = utils.cmp_reps_n_distances(origin, self.coords)
+        self.graph.add_nodes_from(new_extremities)
+        nodes = list(self.graph.nodes)
+        for origin in new_extremities:
+            self._add_visible_edges(origin, [i for i in nodes if i < origin])
+
+    def remove_hole(self, hole_index):
+        """Removes the hole at hole_index and restores the visibility edges it was blocking"""
+        hole = self.holes[hole_index]
+        self.added_holes = [polygon for polygon in self.added_holes if not np.array_equal(shapely.get_coordinates(polygon.exterior)[:-1], hole)]
+        if self._shares_vertices(hole):
+            del self.holes[hole_index]
+            self._rebuild()
+            return
+        first_idx = len(self.boundary_polygon) + sum(len(h) for h in self.holes[:hole_index])
+        last_idx = first_idx + len(hole)
+        del self.holes[hole_index]
+
+        # Shift the indices of the succeeding vertices to fill the gap
+        self.graph.remove_nodes_from(range(first_idx, last_idx))
+        nx.relabel_nodes(self.graph, {i: i - len(hole) for i in self.graph.nodes if i >= last_idx}, copy=False)
+        shifted = {}
+        for i, repr_n_dist in self.reprs_n_distances.items():
+            if first_idx <= i < last_idx:
+                continue
+            columns = np.arange(first_idx, min(last_idx, repr_n_dist.shape[1]))
+            shifted[i - len(hole) if i >= last_idx else i] = np.delete(repr_n_dist, columns, axis=1)
+        self.reprs_n_distances = shifted
+        self._compile()
+
+        # Only pairs of extremities whose line of sight passed the hole can have become visible
+        polygon = shapely.Polygon(hole)
+        shapely.prepare(polygon)
+        extremities = np.array(sorted(self.graph.nodes), dtype=int)
+        points = self.coords[extremities]
+        min_x, min_y, max_x, max_y = polygon.bounds
+        u, v = np.triu_indices(len(extremities), k=1)
+        in_bounds = (
+            (np.maximum(points[u, 0], points[v, 0]) >= min_x)
+            & (np.minimum(points[u, 0], points[v, 0]) <= max_x)
+            & (np.maximum(points[u, 1], points[v, 1]) >= min_y)
+            & (np.minimum(points[u, 1], points[v, 1]) <= max_y)
+        )
+        u, v = u[in_bounds], v[in_bounds]
+        lines = shapely.linestrings(np.stack([points[u], points[v]], axis=1))
+        # Lines touching the hole might have been blocked by one of its vertices as well
+        affected = shapely.intersects(lines, polygon)
+        candidates = {}
+        for lower, higher in zip(extremities[u[affected]], extremities[v[affected]]):
+            candidates.setdefault(higher, set()).add(lower)
+        for origin, lower in candidates.items():
+            self._add_visible_edges(origin, lower)
 
 
 class CoverageProblem:
@@ -13,37 +216,239 @@ class CoverageProblem:
         tasks: List[Task.TrajectoryTask],
         search_area: shapely.Polygon,
         restricted_areas: shapely.geometry.MultiPolygon,
+        clip=False,
     ):
+        """The tasks are checked like added tasks (see validate_tasks), the validation is kept in task_validation
+
+        A warning is issued when tasks are rejected or dropped as duplicates. The kept tasks get their position in the task
+        list as id (see add_tasks), so the ids differ from the given ones after a dropped task.
+        """
         self.__restricted_areas = restricted_areas
         self.__search_area = search_area
+        # The restricted areas are stored by id, in the same order as the holes of the environment
+        self.__obstacles = dict(enumerate(restricted_areas.geoms))
+        self.__next_obstacle_id = len(self.__obstacles)
 
         # TODO Use extremity planner to save the graph
-        self.environment = PolygonEnvironment()
+        self.environment = IncrementalPolygonEnvironment()
         holes = []
         for polygon in restricted_areas.geoms:
             # Properly orient the obstacle polygons
-            holes.append(list(shapely.geometry.polygon.orient(polygon, -1).exterior.coords[:-1]))
+            holes.append(self.__hole_coordinates(polygon))
         shapely.geometry.polygon.orient(search_area, 1.0)
 
         self.environment.store(list(shapely.geometry.polygon.orient(search_area, 1.0).exterior.coords[:-1]), holes, validate=False)
+        # The cached distances are scoped per problem, the copies of the environment held by the agents keep the scope
+        self.environment.cache_scope = next(_cache_scopes)
+
+        self.__tasks = []
+        # The search area without the restricted areas, computed when sampling points or clipping tasks
+        self.__free_space = None
+        # Spatial index of the restricted areas, computed when validating tasks, and the endpoint keys of the tasks
+        self.__restricted_tree = None
+        self.__endpoint_keys = np.empty((0, 4), dtype=np.int64)
+        self.task_validation = self.validate_tasks(tasks, clip)
+        rejected, clipped, duplicates = (len(indices) for indices in self.task_validation[1:])
+        if rejected > 0 or duplicates > 0:
+            warnings.warn(
+                f"{rejected} of the tasks leave the search area or cross a restricted area ({clipped} replaced by their clipped parts) and "
+                f"{duplicates} are duplicates, the {len(self.task_validation.tasks)} valid tasks get their position as id (see task_validation)",
+                stacklevel=2,
+            )
+        self.add_tasks(self.task_validation.tasks)
 
-        self.__tasks = tasks
+    @staticmethod
+    def __hole_coordinates(polygon):
+        return list(shapely.geometry.polygon.orient(polygon, -1).exterior.coords[:-1])
 
     def getRestrictedAreas(self):
         return self.__restricted_areas
 
+    def getRestrictedAreaIds(self):
+        return list(self.__obstacles.keys())
+
+    def add_restricted_area(self, polygon: shapely.Polygon, environments=()) -> int:
+        """Adds a restricted area and updates the environment(s) incrementally
+
+        Parameters
+        ----------
+        polygon
+            The new restricted area, it must not overlap the existing restricted areas
+        environments
+            Additional copies of the environment (e.g. the agents' environments) which should be updated as well
+
+        Returns
+        -------
+        int
+            The id of the restricted area, used for removing it again
+        """
+        obstacle_id = self.__next_obstacle_id
+        self.__next_obstacle_id += 1
+        self.__obstacles[obstacle_id] = polygon
+        self.__restricted_areas = shapely.geometry.MultiPolygon(list(self.__obstacles.values()))
+        self.__free_space = None
+        self.__restricted_tree = None
+        hole = self.__hole_coordinates(polygon)
+        for environment in (self.environment, *environments):
+            environment.add_hole(hole)
+        Agent.invalidate_region(polygon, self.environment)
+        return obstacle_id
+
+    def remove_restricted_area(self, obstacle_id: int, environments=()) -> shapely.Polygon:
+        """Removes the restricted area with the given id and updates the environment(s) incrementally"""
+        hole_index = list(self.__obstacles.keys()).index(obstacle_id)
+        polygon = self.__obstacles.pop(obstacle_id)
+        self.__restricted_areas = shapely.geometry.MultiPolygon(list(self.__obstacles.values()))
+        self.__free_space = None
+        self.__restricted_tree = None
+        for environment in (self.environment, *environments):
+            environment.remove_hole(hole_index)
+        Agent.invalidate_region(polygon, self.environment)
+        return polygon
+
     def getSearchArea(self):
         return self.__search_area
 
     def getTasks(self):
         return self.__tasks
 
+    def add_tasks(self, tasks: List[Task.TrajectoryTask]) -> List[Task.TrajectoryTask]:
+        """Appends the tasks with their ids set to their index in the task list, returns the appended tasks (see validate_tasks
+        for checking them first). The given tasks are not changed, a task with another id is appended as a copy."""
+        tasks = [task if task.id == id else dataclasses.replace(task, id=id) for id, task in enumerate(tasks, start=len(self.__tasks))]
+        self.__tasks.extend(tasks)
+        self.__endpoint_keys = np.concatenate([self.__endpoint_keys, _endpoint_keys(_task_lines(tasks))])
+        return tasks
+
+    def validate_tasks(self, tasks: List[Task.TrajectoryTask], clip=False) -> TaskValidation:
+        """Checks new tasks against the geometry and the existing tasks of the problem, before adding them
+
+        The checks are vectorized over all the tasks: the duplicates are found by sorting the quantized endpoints (a task and
+        its reverse are duplicates), the tasks are tested against the prepared search area and the restricted areas found by
+        a spatial index. The parts of the clipped tasks are checked for duplicates as well.
+
+        Parameters
+        ----------
+        tasks
+            The new tasks
+        clip
+            Whether to replace the tasks leaving the search area or crossing a restricted area by their parts inside the free
+            space instead of dropping them
+
+        Returns
+        -------
+        TaskValidation
+            The valid tasks, the parts of the clipped tasks are copies of them, and the indices of the invalid tasks
+        """
+        tasks = list(tasks)
+        lines = _task_lines(tasks)
+        is_duplicate = ~_is_first(self.__endpoint_keys, _endpoint_keys(lines))
+
+        candidates = np.flatnonzero(~is_duplicate)
+        lines = lines[candidates]
+        shapely.prepare(self.__search_area)
+        valid = shapely.covers(self.__search_area, lines)
+        if self.__restricted_tree is None:
+            self.__restricted_tree = shapely.STRtree(list(self.__obstacles.values()))
+        inside = np.flatnonzero(valid)
+        line_index, area_index = self.__restricted_tree.query(lines[inside], predicate="intersects")
+        crossing = _crosses_interior(lines[inside[line_index]], self.__restricted_tree.geometries[area_index])
+        valid[inside[line_index[crossing]]] = False
+
+        parts_by_task = {}
+        if clip and not valid.all():
+            parts, index = shapely.get_parts(shapely.intersection(lines[~valid], self.__get_free_space()), return_index=True)
+            # The parts only touching the free space are points
+            is_line = (shapely.get_type_id(parts) == shapely.GeometryType.LINESTRING) & (shapely.length(parts) > 0)
+            for i, part in zip(candidates[~valid][index[is_line]], parts[is_line]):
+                parts_by_task.setdefault(i, []).append(part)
+
+        valid_tasks, origins = [], []
+        for i, is_valid in zip(candidates.tolist(), valid.tolist()):
+            if is_valid:
+                valid_tasks.append(tasks[i])
+                origins.append(i)
+            else:
+                for part in parts_by_task.get(i, []):
+                    valid_tasks.append(dataclasses.replace(tasks[i], trajectory=part, start=None, end=None, length=0))
+                    origins.append(i)
+        origins = np.array(origins, dtype=np.int64)
+        duplicates = np.flatnonzero(is_duplicate)
+        clipped = np.empty(0, dtype=np.int64)
+        if len(parts_by_task) > 0:
+            # A part can have the same endpoints as an existing task, a given task or another part
+            is_first = _is_first(self.__endpoint_keys, _endpoint_keys(_task_lines(valid_tasks)))
+            valid_tasks = [task for task, keep in zip(valid_tasks, is_first.tolist()) if keep]
+            duplicates = np.union1d(duplicates, origins[~is_first])
+            clipped = np.intersect1d(origins[is_first], candidates[~valid])
+        return TaskValidation(valid_tasks, candidates[~valid], clipped, duplicates)
+
     def getNumberOfTasks(self):
         return len(self.__tasks)
 
     def generate_random_point_in_problem(self) -> shapely.geometry.Point:
+        # Seeded from the random module, such that random.seed still determines the point
+        return shapely.geometry.Point(self.sample_points(1, seed=random.getrandbits(64)).points[0])
+
+    def __get_free_space(self):
+        if self.__free_space is None:
+            self.__free_space = shapely.difference(self.__search_area, self.__restricted_areas)
+            shapely.prepare(self.__free_space)
+        return self.__free_space
+
+    def sample_points(self, n, seed=None, method="auto") -> PointSample:
+        """Samples n points uniformly from the search area outside the restricted areas, e.g. for placing the agents
+
+        Parameters
+        ----------
+        seed
+            Seed or numpy Generator for drawing the points
+        method
+            "rejection" draws candidate points in the bounding box of the search area in batches and keeps the points in
+            the free space, "triangulation" draws the points from the triangles of a triangulation of the free space, which
+            accepts every point. "auto" uses the triangulation when the expected acceptance rate of the rejection sampling
+            is below TRIANGULATION_ACCEPTANCE
+
+        Returns
+        -------
+        PointSample
+            The points and the acceptance rate of the candidate points
+        """
+        rng = np.random.default_rng(seed)
+        if n == 0:
+            return PointSample(np.empty((0, 2)), 1.0)
+        free_space = self.__get_free_space()
         minx, miny, maxx, maxy = self.__search_area.bounds
-        while True:
-            point = shapely.geometry.Point(random.uniform(minx, maxx), random.uniform(miny, maxy))  # noqa: S311
-            if not self.__restricted_areas.contains(point) and self.__search_area.contains(point):
-                return point
+        expected_rate = free_space.area / ((maxx - minx) * (maxy - miny)) if free_space.area > 0 else 0.0
+        if expected_rate == 0:
+            raise ValueError("Error: the restricted areas cover the whole search area")
+        if method == "auto":
+            method = "triangulation" if expected_rate < TRIANGULATION_ACCEPTANCE else "rejection"
+        if method == "triangulation":
+            return PointSample(self.__sample_triangulation(free_space, n, rng), 1.0)
+        if method != "rejection":
+            raise ValueError(f"Error: unknown sampling method {method}")
+
+        batches = []
+        accepted = drawn = 0
+        while accepted < n:
+            # The batch is sized by the expected acceptance rate, such that it is mostly done in one batch
+            size = math.ceil((n - accepted) / expected_rate * 1.2) + 16
+            x, y = rng.uniform(minx, maxx, size), rng.uniform(miny, maxy, size)
+            inside = shapely.contains_xy(free_space, x, y)
+            batches.append(np.stack([x[inside], y[inside]], axis=1))
+            accepted += int(inside.sum())
+            drawn += size
+        return PointSample(np.concatenate(batches)[:n], accepted / drawn)
+
+    @staticmethod
+    def __sample_triangulation(free_space, n, rng: np.random.Generator):
+        triangles = shapely.get_parts(shapely.constrained_delaunay_triangles(free_space))
+        corners = shapely.get_coordinates(shapely.get_exterior_ring(triangles)).reshape(len(triangles), 4, 2)[:, :3]
+        areas = shapely.area(triangles)
+        chosen = corners[rng.choice(len(triangles), size=n, p=areas / areas.sum())]
+        # Uniform barycentric coordinates, the points outside the triangle are reflected into it
+        u, v = rng.uniform(size=(2, n, 1))
+        outside = u + v > 1
+        u[outside], v[outside] = 1 - u[outside], 1 - v[outside]
+        return chosen[:, 0] + u * (chosen[:, 1] - chosen[:, 0]) + v * (chosen[:, 2] - chosen[:, 0])
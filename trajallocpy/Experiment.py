@@ -1,40 +1,233 @@
 import copy
 import multiprocessing
+import os
+import queue
+import tempfile
 import threading
 import timeit
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from multiprocessing import Queue
 from threading import Thread
 
 import numpy as np
 import shapely
 
-from trajallocpy import ACBBA, CBBA, Agent, CoverageProblem, Utility
+from trajallocpy import ACBBA, CBBA, Agent, Clustering, CoverageProblem, Transport, Utility
+
+# Version of the snapshot format, increment when the layout changes
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_RAGGED = ("bundle", "path", "times")
+_SNAPSHOT_FIXED = ("winning_bids", "winning_agents", "removal_list", "timestamps", "time_step", "reversed")
+
+
+@dataclass
+class RoundInfo:
+    """Lightweight snapshot of a solve round, yielded by Runner.solve_iter"""
+
+    iteration: int
+    bundles: dict  # The bundle of each agent by id
+    bids: dict  # The winning bids of each agent on its bundle
+    churn: dict  # The tasks each agent lost during the consensus
+    bundle_time: float  # Duration of the bundle phase (sec)
+    consensus_time: float  # Duration of the consensus phase (sec)
+
+
+class SerialExecutor:
+    """Runs a method of every agent one after another, working on the agents in place"""
+
+    def map(self, robots, method, *args):
+        return [getattr(robot, method)(None, *args) for robot in robots]
+
+
+class ThreadExecutor:
+    """Runs a method of every agent in its own thread, working on the agents in place without copying them
+
+    Only the compiled kernels (see Kernels) release the GIL, thus the agents only run in parallel when using them. This holds for
+    the bundle phase and the consensus updates.
+    """
+
+    def map(self, robots, method, *args):
+        robots = list(robots)
+        with ThreadPoolExecutor(max_workers=len(robots)) as executor:
+            return list(executor.map(lambda robot: getattr(robot, method)(None, *args), robots))
+
+
+def _collect_results(result_queue, processes: dict, result_id) -> dict:
+    """Returns the result each process puts in the queue by id, raises when a process exits without putting its result
+
+    The results are read while the processes are running, as a process only exits once its result is read from the queue.
+    The queue is polled such that a process which has died is noticed, the remaining processes are then terminated.
+    """
+    results = {}
+    try:
+        while len(results) < len(processes):
+            try:
+                result = result_queue.get(timeout=0.1)
+                results[result_id(result)] = result
+            except queue.Empty:
+                # The result of an exited process is in the queue before it exits
+                failed = {id: process.exitcode for id, process in processes.items() if id not in results and not process.is_alive()}
+                if len(failed) > 0 and result_queue.empty():
+                    raise RuntimeError(f"Error: the processes of agents {sorted(failed)} exited without a result, exit codes {list(failed.values())}")
+    finally:
+        for process in processes.values():
+            if process.is_alive() and len(results) < len(processes):
+                process.terminate()
+            process.join()
+    return results
+
+
+class ProcessExecutor:
+    """Runs a method of every agent in its own forked process, the agents are updated with the results sent back by the processes"""
+
+    def map(self, robots, method, *args):
+        robots = {robot.id: robot for robot in robots}
+        result_queue = multiprocessing.Queue()
+        processes: list[multiprocessing.Process] = []
+        for robot in robots.values():
+            process = multiprocessing.Process(target=getattr(robot, method), args=(result_queue, *args))
+            process.start()
+            processes.append(process)
+
+        results = _collect_results(result_queue, dict(zip(robots, processes)), lambda result: result.id)
+        for robot_id, result in results.items():
+            robots[robot_id].update_bundle_result(result)
+        return [results[robot_id] for robot_id in robots]
+
+
+EXECUTORS = {"serial": SerialExecutor, "threads": ThreadExecutor, "processes": ProcessExecutor}
+
+# Number of tasks from which building the bundles in processes outweighs forking and sending back the results, the compiled
+# kernels are an order of magnitude faster, thus they need larger problems
+PROCESS_MIN_TASKS = 32
+PROCESS_MIN_TASKS_KERNELS = 256
+
+
+def select_executor(n_tasks, use_kernels=False):
+    """Returns the executor for running the agents: processes for large problems on multi-core machines, otherwise threads
+    which avoid forking and pickling"""
+    if (os.cpu_count() or 1) > 1 and n_tasks >= (PROCESS_MIN_TASKS_KERNELS if use_kernels else PROCESS_MIN_TASKS):
+        return "processes"
+    return "threads"
+
+
+def select_consensus_executor(use_kernels=False):
+    """Returns the executor for the consensus updates: threads on multi-core machines when the updates run in the compiled
+    kernels, which release the GIL, otherwise serial. A consensus update is too short to outweigh forking a process."""
+    if use_kernels and (os.cpu_count() or 1) > 1:
+        return "threads"
+    return "serial"
+
+
+def _run_distributed_agent(agent: Agent.config, coverage_problem, addresses, idle_timeout, deadline, result_queue):
+    # Process target of solve_distributed, the agent only communicates through its transport
+    transport = Transport.SocketTransport(agent.id, addresses)
+    robot = ACBBA.agent(
+        state=shapely.Point(agent.position),
+        id=agent.id,
+        capacity=agent.capacity,
+        environment=coverage_problem.environment,
+        tasks=coverage_problem.getTasks(),
+        max_velocity=agent.max_velocity,
+        max_acceleration=agent.max_acceleration,
+        transport=transport,
+    )
+    try:
+        stats = robot.run(idle_timeout=idle_timeout, deadline=deadline)
+    finally:
+        transport.close()
+    result_queue.put({"id": agent.id, "bundle": robot.bundle, "path": robot.path, "winning_agents": dict(robot.z), "stats": stats})
+
+
+def solve_distributed(coverage_problem: CoverageProblem.CoverageProblem, agents: list[Agent.config], addresses=None, idle_timeout=1.0, deadline=None):
+    """Solves the problem with ACBBA, running each agent as a separate process which exchanges its bids over sockets
+
+    Parameters
+    ----------
+    addresses
+        The address of each agent by id (see Transport.SocketTransport), Unix sockets in a temporary directory by default.
+        With TCP addresses the agents can also be started on separate nodes by calling ACBBA.agent.run directly, the clocks of
+        the nodes must be synchronised as the bids are timestamped with the wall clock.
+    idle_timeout
+        An agent stops when it has not received any bids for idle_timeout seconds
+
+    Returns
+    -------
+    dict
+        The bundle, path, winning agents and run statistics (see ACBBA.agent.run) of each agent by id
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        if addresses is None:
+            addresses = Transport.local_addresses(len(agents), directory)
+        result_queue = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=_run_distributed_agent, args=(agent, coverage_problem, addresses, idle_timeout, deadline, result_queue))
+            for agent in agents
+        ]
+        for process in processes:
+            process.start()
+        results = _collect_results(result_queue, {agent.id: process for agent, process in zip(agents, processes)}, lambda result: result["id"])
+    return results
 
 
 class Runner:
-    def __init__(self, coverage_problem: CoverageProblem.CoverageProblem, agents: list[Agent.config], enable_plotting=False):
+    def __init__(
+        self,
+        coverage_problem: CoverageProblem.CoverageProblem,
+        agents: list[Agent.config],
+        enable_plotting=False,
+        candidate_k=None,
+        candidate_radius=None,
+        use_kernels=False,
+        bundle_executor="auto",
+        consensus_executor="serial",
+    ):
+        # How the bundle (and local search) phase and the consensus updates of the agents are run, see EXECUTORS. "auto"
+        # selects the executor by the problem size and the use of the kernels (see select_executor and select_consensus_executor)
+        for executor in (bundle_executor, consensus_executor):
+            if executor != "auto" and executor not in EXECUTORS:
+                raise ValueError(f"Error: unknown executor {executor}")
+        self.bundle_executor = bundle_executor
+        self.consensus_executor = consensus_executor
         # Task definition
         self.coverage_problem = coverage_problem
-        self.robot_list = {}
-
-        for agent in agents:
-            self.robot_list[agent.id] = CBBA.agent(
-                id=agent.id,
-                state=shapely.Point(agent.position),
-                environment=copy.deepcopy(self.coverage_problem.environment),
-                tasks=np.array(self.coverage_problem.getTasks()),
-                capacity=agent.capacity,
-                number_of_agents=len(agents),
-                point_estimation=False,
+        self.agent_configs = agents
+        self.robot_list = {
+            agent.id: self.__create_agent(
+                agent,
+                self.coverage_problem.getTasks(),
+                copy.deepcopy(self.coverage_problem.environment),
+                candidate_k=candidate_k,
+                candidate_radius=candidate_radius,
+                use_kernels=use_kernels,
             )
+            for agent in agents
+        }
         self.communication_graph = np.ones((len(agents), len(agents)))
         self.plot = enable_plotting
 
         # Results
+        # Metadata of the last solve, see solve
+        self.solve_info = {}
         self.routes = {}
         self.transport = {}
         self.tasks = {}
 
+    def __create_agent(self, agent: Agent.config, tasks, environment, **kwargs) -> CBBA.agent:
+        return CBBA.agent(
+            id=agent.id,
+            state=shapely.Point(agent.position),
+            environment=environment,
+            tasks=np.array(tasks),
+            capacity=agent.capacity,
+            number_of_agents=len(self.agent_configs),
+            point_estimation=False,
+            max_velocity=agent.max_velocity,
+            max_acceleration=agent.max_acceleration,
+            **kwargs,
+        )
+
     def evaluateSolution(self):
         total_path_length = 0
         total_task_length = 0
@@ -44,11 +237,11 @@ class Runner:
         for r in self.robot_list.values():
             total_path_length += Agent.getTotalPathLength(r.state, r.getPathTasks(), r.environment)
             total_task_length += Agent.getTotalTaskLength(r.getPathTasks())
-            agent_path_cost = Agent.getTotalTravelCost(r.state, r.getPathTasks(), r.environment)
+            agent_path_cost = Agent.getTotalTravelCost(r.state, r.getPathTasks(), r.environment, r.profile)
             total_path_cost += agent_path_cost
             route = [r.state]
             for task in r.getPathTasks():
-                route.extend(list(task.trajectory.coords))
+                route.extend(list(task.coords))
             route.append(r.state)
             route_list.append(route)
 
@@ -72,14 +265,277 @@ class Runner:
             max_path_cost,
         )
 
-    def add_tasks(self, tasks):
-        # TODO make sure that the tasks are within the search area
+    def pruning_ratio(self):
+        """The fraction of the candidate tasks pruned during bundle construction, None if candidate pruning is disabled"""
+        pruners = [robot.pruner for robot in self.robot_list.values() if robot.pruner is not None]
+        total = sum(pruner.total for pruner in pruners)
+        if len(pruners) == 0:
+            return None
+        return 1 - sum(pruner.considered for pruner in pruners) / total if total > 0 else 0.0
+
+    def add_tasks(self, tasks, clip=False) -> CoverageProblem.TaskValidation:
+        """Adds tasks to a (solved) problem, the next call to solve only re-auctions the new tasks and the tasks they displace
+
+        The tasks outside the search area, crossing a restricted area (unless clipped) or already in the problem are not added,
+        see CoverageProblem.validate_tasks. Returns the validation, holding the added tasks.
+        """
+        validation = self.coverage_problem.validate_tasks(tasks, clip)
+        validation = validation._replace(tasks=self.coverage_problem.add_tasks(validation.tasks))
+        for robot in self.robot_list.values():
+            robot.add_tasks(validation.tasks)
+        return validation
+
+    def add_restricted_area(self, polygon: shapely.Polygon) -> int:
+        """Adds a restricted area to the coverage problem and the environments of the agents, returns the id of the area"""
+        return self.coverage_problem.add_restricted_area(polygon, [robot.environment for robot in self.robot_list.values()])
+
+    def remove_restricted_area(self, area_id: int):
+        return self.coverage_problem.remove_restricted_area(area_id, [robot.environment for robot in self.robot_list.values()])
+
+    def save_snapshot(self, file):
+        """Saves the allocation state of all agents as a compressed npz file
+
+        The snapshot only contains the allocation (bundles, paths, bids, timestamps and task orientations),
+        it is restored into a Runner created from the same coverage problem, thus the geometry is not recomputed.
+        """
+        states = [self.robot_list[robot_id].get_state() for robot_id in sorted(self.robot_list)]
+        arrays = {
+            "version": np.array(SNAPSHOT_VERSION),
+            "agent_ids": np.array(sorted(self.robot_list), dtype=np.int64),
+            "task_num": np.array(self.coverage_problem.getNumberOfTasks()),
+        }
+        for key in _SNAPSHOT_FIXED:
+            arrays[key] = np.stack([state[key] for state in states])
+        # The ragged lists are concatenated and split by their offsets
+        for key in _SNAPSHOT_RAGGED:
+            arrays[key] = np.concatenate([state[key] for state in states])
+            arrays[key + "_offsets"] = np.cumsum([0] + [len(state[key]) for state in states])
+        np.savez_compressed(file, **arrays)
+
+    @staticmethod
+    def load_snapshot(file) -> dict:
+        """Loads a snapshot saved by save_snapshot, returns the state of each agent by id"""
+        with np.load(file) as data:
+            if int(data["version"]) != SNAPSHOT_VERSION:
+                raise ValueError(f"Error: unsupported snapshot version {int(data['version'])}, expected {SNAPSHOT_VERSION}")
+            snapshot = {}
+            for index, agent_id in enumerate(data["agent_ids"].tolist()):
+                state = {key: data[key][index] for key in _SNAPSHOT_FIXED}
+                for key in _SNAPSHOT_RAGGED:
+                    offsets = data[key + "_offsets"]
+                    state[key] = data[key][offsets[index] : offsets[index + 1]]
+                snapshot[agent_id] = state
+        return snapshot
+
+    def restore_snapshot(self, snapshot: dict):
+        if set(snapshot) != set(self.robot_list):
+            raise ValueError(f"Error: the snapshot contains agents {sorted(snapshot)}, expected {sorted(self.robot_list)}")
+        for robot_id, state in snapshot.items():
+            self.robot_list[robot_id].set_state(state)
+
+    def __share_auction_tasks(self):
+        # Tasks displaced from the bundle of one agent should be open for auction by all agents
+        auction_tasks = [robot.auction_tasks for robot in self.robot_list.values() if robot.auction_tasks is not None]
+        if len(auction_tasks) > 0:
+            shared = set().union(*auction_tasks)
+            for robot in self.robot_list.values():
+                robot.auction_tasks = set(shared)
+
+    def __build_bundles(self, deadline=None):
+        self.__executor(self.bundle_executor).map(self.robot_list.values(), "build_bundle", deadline)
+
+    def __improve_paths(self, time_budget):
+        self.__executor(self.bundle_executor).map(self.robot_list.values(), "improve_path", time_budget)
+
+    def __update_tasks(self):
+        # Runs the consensus update of every agent on the consensus executor, returns whether each agent has converged
+        # The updates only read the message pool and write the state of their own agent, thus the order does not matter
+        name = self.consensus_executor
+        if name == "auto":
+            name = select_consensus_executor(next(iter(self.robot_list.values())).use_kernels)
+        results = self.__executor(name).map(self.robot_list.values(), "run_consensus")
+        return [result.converged for result in results]
+
+    def __executor(self, name):
+        if name == "auto":
+            robot = next(iter(self.robot_list.values()))
+            name = select_executor(robot.task_num, robot.use_kernels)
+        return EXECUTORS[name]()
+
+    def __consensus(self):
+        # Exchanges the bids between the connected agents and updates their bundles, returns whether the agents have converged
+        # Communication stage
+        message_pool = [robot.send_message() for robot in self.robot_list.values()]
+        for robot_id, robot in self.robot_list.items():
+            # Recieve winning bidlist from neighbors
+            g = self.communication_graph[robot_id]
+
+            (connected,) = np.where(g == 1)
+            connected = list(connected)
+            connected.remove(robot_id)
+
+            Y = {neighbor_id: message_pool[neighbor_id] for neighbor_id in connected} if len(connected) > 0 else None
+            robot.Y = Y
+
+        # The Runner only runs CBBA agents, the asynchronous ACBBA agents exchange and coalesce their bids in ACBBA.agent.run
+        converged_list = []
+        if Y is not None:
+            converged_list = self.__update_tasks()
+        if sum(converged_list) == len(self.robot_list):
+            return True
+        self.__share_auction_tasks()
+        return False
+
+    def __resolve_conflicts(self):
+        # Keeps every task claimed by more than one agent only in the path of the highest bidder, ties are won by the lowest id
+        claims = {}
+        for robot in self.robot_list.values():
+            for j in robot.path:
+                claims.setdefault(j, []).append(robot)
+        removed = 0
+        for j, claimants in claims.items():
+            if len(claimants) > 1:
+                winner = max(claimants, key=lambda robot: (robot.winning_bids[j], -robot.id))
+                for robot in claimants:
+                    if robot is not winner:
+                        robot.drop_task(j, winner.id, winner.winning_bids[j])
+                        removed += 1
+        return removed
+
+    def __save_routes(self):
+        for robot in self.robot_list.values():
+            self.routes[robot.id], self.transport[robot.id], self.tasks[robot.id] = Agent.getTravelPath(
+                robot.state, robot.getPathTasks(), robot.environment
+            )
+
+    def __cluster_runner(self, cluster_tasks):
+        # Runner auctioning the aggregate tasks of the clusters in the same problem. Its agents use the environments of the
+        # agents of this runner, thus the visibility graph is not built again and the distances between the endpoints of the
+        # clusters, which are endpoints of their tasks, are cached for the auction of the tasks as well
+        runner = copy.copy(self)
+        runner.robot_list = {
+            agent.id: self.__create_agent(agent, cluster_tasks, self.robot_list[agent.id].environment) for agent in self.agent_configs
+        }
+        runner.plot = False
+        runner.solve_info, runner.routes, runner.transport, runner.tasks = {}, {}, {}, {}
+        return runner
+
+    def __solve_hierarchical(self, n_clusters, clustering, cluster_seed, profiling_enabled, debug, local_search_time, deadline, verbose):
+        # Generator yielding the rounds of the flat solve over the leftover tasks, returns the solve metadata
+        self.start_time = timeit.default_timer()
+        tasks = self.coverage_problem.getTasks()
+        labels = Clustering.cluster_tasks(tasks, n_clusters, clustering, seed=cluster_seed)
+        cluster_tasks, members = Clustering.aggregate_clusters(tasks, labels)
+
+        # Auction the clusters as aggregate tasks
+        cluster_runner = self.__cluster_runner(cluster_tasks)
+        cluster_runner.solve(profiling_enabled=profiling_enabled, debug=debug, deadline=deadline, verbose=verbose)
 
-        # TODO make sure that the tasks not already in the list
-        for robot in self.robot_list:
-            robot.add_tasks(tasks)
+        # The clusters are disjoint, thus the agents can build their bundles within their own clusters without consensus
+        for robot_id, cluster_robot in cluster_runner.robot_list.items():
+            self.robot_list[robot_id].auction_tasks = {task for cluster in cluster_robot.bundle for task in members[cluster]}
+        self.__build_bundles(None if deadline is None else self.start_time + deadline)
 
-    def solve(self, profiling_enabled=False, debug=False):
+        # Auction the tasks left over (e.g. from clusters exceeding the capacity) among all agents
+        assigned = {task for robot in self.robot_list.values() for task in robot.bundle}
+        for robot in self.robot_list.values():
+            robot.auction_tasks = set(range(len(tasks))).difference(assigned)
+        start_time = self.start_time
+        remaining = None if deadline is None else deadline - (timeit.default_timer() - start_time)
+        solve_info = yield from self.solve_iter(
+            profiling_enabled=profiling_enabled, debug=debug, local_search_time=local_search_time, deadline=remaining, verbose=verbose
+        )
+        self.start_time = start_time
+        self.iterations += cluster_runner.iterations + 1
+        solve_info["converged"] = solve_info["converged"] and cluster_runner.solve_info["converged"]
+        solve_info["iterations"] = self.iterations
+        return solve_info
+
+    def solve(
+        self,
+        profiling_enabled=False,
+        debug=False,
+        snapshot=None,
+        n_clusters=None,
+        clustering="kmeans",
+        local_search_time=None,
+        deadline=None,
+        verbose=True,
+        callback=None,
+        cluster_seed=None,
+    ):
+        """Solves the allocation, see solve_iter for the parameters
+
+        Parameters
+        ----------
+        callback
+            Called with the RoundInfo of every round
+
+        Returns
+        -------
+        dict
+            Metadata of the solve, see solve_iter
+        """
+        for round_info in self.solve_iter(
+            profiling_enabled, debug, snapshot, n_clusters, clustering, local_search_time, deadline, verbose, cluster_seed
+        ):
+            if callback is not None:
+                callback(round_info)
+        return self.solve_info
+
+    def solve_iter(
+        self,
+        profiling_enabled=False,
+        debug=False,
+        snapshot=None,
+        n_clusters=None,
+        clustering="kmeans",
+        local_search_time=None,
+        deadline=None,
+        verbose=True,
+        cluster_seed=None,
+    ):
+        """Solves the allocation, yielding a RoundInfo after every bundle and consensus round
+
+        The allocation is finalized (conflicts, local search and routes) when the generator is exhausted.
+
+        Parameters
+        ----------
+        snapshot
+            Allocation state to warm start the solve from (see load_snapshot)
+        n_clusters
+            Solve hierarchically: the tasks are clustered spatially into n_clusters clusters, which are auctioned
+            as aggregate tasks, after which every agent builds its bundle from the tasks in the clusters it won.
+            None solves the flat problem
+        clustering
+            The clustering method, "kmeans" or "grid"
+        local_search_time
+            Time budget in seconds for improving the paths of the agents by local search (2-opt, or-opt and orientation flips)
+            after the consensus, the agents are improved in parallel and keep their tasks. None disables the local search
+        deadline
+            Time budget in seconds for the solve. The budget is checked between the bundle and consensus phases and
+            between the bundle steps of the agents. When it is spent, the tasks still claimed by several agents are kept
+            by the highest bidder, such that the allocation reached so far is conflict free. None solves until convergence
+        verbose
+            Print the progress of every round
+        cluster_seed
+            Seed or numpy Generator for the k-means clustering of the hierarchical solve, None clusters nondeterministically
+
+        Returns
+        -------
+        dict
+            Metadata of the solve (also stored in solve_info): whether the allocation converged, whether the deadline
+            was reached, the number of iterations and the number of conflicting claims removed
+        """
+        solve_start = timeit.default_timer()
+        deadline_time = None if deadline is None else solve_start + deadline
+        if snapshot is not None:
+            self.restore_snapshot(snapshot)
+        if n_clusters is not None:
+            self.solve_info = yield from self.__solve_hierarchical(
+                n_clusters, clustering, cluster_seed, profiling_enabled, debug, local_search_time, deadline, verbose
+            )
+            return self.solve_info
         if profiling_enabled:
             print("Profiling enabled!")
             import cProfile
@@ -91,126 +547,110 @@ class Runner:
             pr.enable()
         t = 0  # Iteration number
 
+        plotter = None
         if self.plot:
-            plotter = Utility.Plotter(self.robot_list.values(), self.communication_graph)
-            # Plot the search area and restricted area
-            plotter.plotPolygon(self.coverage_problem.getSearchArea(), color=(0, 0, 0, 0.5))
-            plotter.plotMultiPolygon(self.coverage_problem.getRestrictedAreas(), color=(0, 0, 0, 0.2), fill=True)
+            # The routes are plotted in a separate process, such that the plotting does not block the solver
+            plotter = Utility.LivePlotter(self.coverage_problem, self.robot_list.values())
         self.start_time = timeit.default_timer()
 
-        result_queue = multiprocessing.Queue()
-        # result_queue.cancel_join_thread()
-        while True:
-            converged_list = []
-
-            print("Iteration {}".format(t + 1))
-            # Phase 1: Auction Process
-
-            # Create a list to store the threads
-            processes: list[multiprocessing.Process] = []
-            # Start multiple threads
-
-            for robot in self.robot_list.values():
-                # robot.build_bundle(result_queue)
-                process = multiprocessing.Process(target=robot.build_bundle, args=(result_queue,))
-                process.start()
-                processes.append(process)
-
-            # Wait for all processes to finish
-            for process in processes:
-                process.join()
-
-            # Extract results from the queue
-            while not result_queue.empty():
-                result = result_queue.get()
-                self.robot_list[result.id].update_bundle_result(result)
-
-            if debug:
-                print("Bundle")
-                for robot in self.robot_list.values():
-                    print(robot.bundle)
-                print("Path")
-                for robot in self.robot_list.values():
-                    print(robot.path)
-            previous_bundle = {robot_id: robot.bundle.copy() for robot_id, robot in self.robot_list.items()}
-
-            # Do not communicate if there are no agents to communicate with
-            if len(self.robot_list) <= 1:
-                break
-
-            # Communication stage
-            message_pool = [robot.send_message() for robot in self.robot_list.values()]
-            for robot_id, robot in self.robot_list.items():
-                # Recieve winning bidlist from neighbors
-                g = self.communication_graph[robot_id]
-
-                (connected,) = np.where(g == 1)
-                connected = list(connected)
-                connected.remove(robot_id)
-
-                Y = {neighbor_id: message_pool[neighbor_id] for neighbor_id in connected} if len(connected) > 0 else None
-                robot.Y = Y
-
-            # Phase 2: Consensus Process
-            if isinstance(self.robot_list[0], ACBBA.agent):  # ACBBA
-                messages = 0
-                for robot in self.robot_list.values():
-                    # Update local information and decision
-                    messages += len(robot.update_task(robot.Y))
-
-                if messages == 0:
-                    break
-            else:  # CBBA
-                converged_list = []
-                if Y is not None:
+        converged = False
+        deadline_reached = False
+        try:
+            while True:
+                if verbose:
+                    print("Iteration {}".format(t + 1))
+                # Phase 1: Auction Process
+                phase_start = timeit.default_timer()
+                self.__build_bundles(deadline_time)
+                bundle_time = timeit.default_timer() - phase_start
+
+                if debug:
+                    print("Bundle")
                     for robot in self.robot_list.values():
-                        converged = robot.update_task()
-                        converged_list.append(converged)
-                if sum(converged_list) == len(self.robot_list):
-                    break
-            bundle_diff = {robot_id: set(previous_bundle[robot_id]) - set(robot.bundle) for robot_id, robot in self.robot_list.items()}
-            print("Bundle Difference:", bundle_diff)
-            if all(len(s) == 0 for s in bundle_diff.values()):
-                break
-            if debug:
-                # Plot
+                        print(robot.bundle)
+                    print("Path")
+                    for robot in self.robot_list.values():
+                        print(robot.path)
+                previous_bundle = {robot_id: robot.bundle.copy() for robot_id, robot in self.robot_list.items()}
+
+                # Phase 2: Consensus Process
+                phase_start = timeit.default_timer()
+                if len(self.robot_list) <= 1:
+                    # Do not communicate if there are no agents to communicate with
+                    converged = True
+                elif deadline_time is not None and phase_start >= deadline_time:
+                    deadline_reached = True
+                else:
+                    converged = self.__consensus()
+                consensus_time = timeit.default_timer() - phase_start
+
+                bundle_diff = {robot_id: set(previous_bundle[robot_id]) - set(robot.bundle) for robot_id, robot in self.robot_list.items()}
+                if verbose:
+                    print("Bundle Difference:", bundle_diff)
+                if not converged and not deadline_reached:
+                    if all(len(s) == 0 for s in bundle_diff.values()):
+                        converged = True
+                    elif deadline_time is not None and timeit.default_timer() >= deadline_time:
+                        deadline_reached = True
+                round_info = RoundInfo(
+                    iteration=t,
+                    bundles={robot_id: list(robot.bundle) for robot_id, robot in self.robot_list.items()},
+                    bids={robot_id: robot.winning_bids[robot.bundle].tolist() for robot_id, robot in self.robot_list.items()},
+                    churn=bundle_diff,
+                    bundle_time=bundle_time,
+                    consensus_time=consensus_time,
+                )
                 if self.plot:
-                    plotter.setTitle("Time Step:{}".format(t))
-                    plotter.plotAgents(self.robot_list.values())
-                    plotter.pause(0.1)
-                    # plotter.save("iteration{}.png".format(t))
-
-                print("Bundle")
-                for robot in self.robot_list.values():
-                    print(robot.bundle)
-                print("Path")
-                for robot in self.robot_list.values():
-                    print(robot.path)
-
-            t += 1
-
-        self.iterations = t
-
-        if profiling_enabled:
-            print("Profiling finished:")
-            s = io.StringIO()
-            sortby = SortKey.CUMULATIVE
-            ps = pstats.Stats(pr, stream=s).sort_stats(sortby)
-            ps.print_stats(100)
-            pr.disable()
-
-        self.end_time = timeit.default_timer()
-
-        # Save the results in the object
-        for robot in self.robot_list.values():
-            self.routes[robot.id], self.transport[robot.id], self.tasks[robot.id] = Agent.getTravelPath(
-                robot.state, robot.getPathTasks(), robot.environment
-            )
-
-        if self.plot:
-            plotter.plotAgents(self.robot_list.values())
-        if self.plot:
-            plotter.show()
+                    plotter.update(round_info)
+                yield round_info
+                if converged or deadline_reached:
+                    break
+                if debug:
+                    print("Bundle")
+                    for robot in self.robot_list.values():
+                        print(robot.bundle)
+                    print("Path")
+                    for robot in self.robot_list.values():
+                        print(robot.path)
+
+                t += 1
+
+            # Without convergence the same task can still be in several paths
+            resolved_conflicts = 0 if converged else self.__resolve_conflicts()
+
+            if local_search_time is not None and deadline_time is not None:
+                local_search_time = min(local_search_time, deadline_time - timeit.default_timer())
+            if local_search_time is not None and local_search_time > 0:
+                self.__improve_paths(local_search_time)
+
+            if profiling_enabled:
+                print("Profiling finished:")
+                s = io.StringIO()
+                sortby = SortKey.CUMULATIVE
+                ps = pstats.Stats(pr, stream=s).sort_stats(sortby)
+                ps.print_stats(100)
+                pr.disable()
+
+            self.end_time = timeit.default_timer()
+
+            # Save the results in the object
+            self.__save_routes()
+        finally:
+            # Also run when the caller stops iterating early or the solve raises
+            self.iterations = t
+            # The re-auction is done, open all tasks for the next solve
+            for robot in self.robot_list.values():
+                robot.auction_tasks = None
+            if plotter is not None:
+                plotter.close(text="Final routes")
+
+        self.solve_info = {
+            "converged": converged,
+            "deadline_reached": deadline_reached,
+            "iterations": self.iterations,
+            "resolved_conflicts": resolved_conflicts,
+        }
+        return self.solve_info
 
 
 # TODO refactor the experiment class, to provide utility to perform replanning.
@@ -0,0 +1,342 @@
+"""Compiled versions of the scoring functions in Agent, working on arrays of task endpoints instead of task objects
+
+The kernels are compiled with numba when it is installed (it is pulled in by extremitypathfinder[numba]) and the compiled
+code is cached on disk, such that the compilation is only done once per machine. The compiled kernels release the GIL, such
+that agents building their bundles in threads run them in parallel. Without numba the kernels run as plain Python.
+The kernels give the same scores as the corresponding functions in Agent.
+"""
+import math
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # pragma: no cover
+    numba = None
+
+
+def _jit(func):
+    if numba is None:
+        return func
+    return numba.njit(cache=True, nogil=True)(func)
+
+
+ENABLED = numba is not None
+
+
+def task_arrays(tasks):
+    """Returns the start points, end points, rewards and lengths of the tasks as arrays"""
+    starts = np.array([task.start for task in tasks], dtype=np.float64).reshape(-1, 2)
+    ends = np.array([task.end for task in tasks], dtype=np.float64).reshape(-1, 2)
+    rewards = np.array([task.reward for task in tasks], dtype=np.float64)
+    lengths = np.array([task.length for task in tasks], dtype=np.float64)
+    return starts, ends, rewards, lengths
+
+
+def time_window_arrays(tasks):
+    """Returns the start times and latest start times of the tasks as arrays"""
+    start_times = np.array([task.start_time for task in tasks], dtype=np.float64)
+    latest_starts = np.array([task.getLatestStartTime() for task in tasks], dtype=np.float64)
+    return start_times, latest_starts
+
+
+@_jit
+def distance_to_cost(dist, max_velocity, max_acceleration):
+    d_a = (max_velocity**2) / max_acceleration
+    if dist < d_a:
+        return math.sqrt(4 * dist / max_acceleration)
+    return max_velocity / max_acceleration + dist / max_velocity
+
+
+@_jit
+def travel_cost(start, end, max_velocity, max_acceleration):
+    return distance_to_cost(math.sqrt((start[0] - end[0]) ** 2 + (start[1] - end[1]) ** 2), max_velocity, max_acceleration)
+
+
+@_jit
+def time_discounted_reward(cost, reward):
+    return max(0.0, -math.log(cost) + 1000) * reward
+
+
+@_jit
+def path_reward(state, starts, ends, rewards, path, max_velocity, max_acceleration):
+    S_p = 0.0
+    if len(path) > 0:
+        travel_cost_sum = travel_cost(state, starts[path[0]], max_velocity, max_acceleration)
+        S_p += time_discounted_reward(travel_cost_sum, rewards[path[0]])
+        for t_index in range(len(path) - 1):
+            travel_cost_sum += travel_cost(ends[path[t_index]], starts[path[t_index + 1]], max_velocity, max_acceleration)
+            S_p += time_discounted_reward(travel_cost_sum, rewards[path[t_index + 1]])
+    return S_p
+
+
+@_jit
+def oriented_insertion_costs(j, n, state, starts, ends, path, allow_reversal, max_velocity, max_acceleration):
+    """Returns the travel cost into and out of task j inserted at n in the orientation minimising their sum, whether it is
+    reversed and the cost of the travel it replaces (see Agent.getOrientedInsertionCosts)"""
+    previous_end = state if n == 0 else ends[path[n - 1]]
+    next_start = state if n == len(path) else starts[path[n]]
+    to_start = travel_cost(previous_end, starts[j], max_velocity, max_acceleration)
+    to_end = travel_cost(previous_end, ends[j], max_velocity, max_acceleration)
+    from_start = travel_cost(starts[j], next_start, max_velocity, max_acceleration)
+    from_end = travel_cost(ends[j], next_start, max_velocity, max_acceleration)
+    removed_cost = travel_cost(previous_end, next_start, max_velocity, max_acceleration)
+    if allow_reversal and to_end + from_start < to_start + from_end:
+        return to_end, from_start, True, removed_cost
+    return to_start, from_end, False, removed_cost
+
+
+@_jit
+def insertion_costs(j, n, state, starts, ends, path, is_reversed, max_velocity, max_acceleration):
+    """Returns the travel cost into and out of task j inserted at n in the given orientation"""
+    previous_end = state if n == 0 else ends[path[n - 1]]
+    next_start = state if n == len(path) else starts[path[n]]
+    first, last = (ends[j], starts[j]) if is_reversed else (starts[j], ends[j])
+    return travel_cost(previous_end, first, max_velocity, max_acceleration), travel_cost(last, next_start, max_velocity, max_acceleration)
+
+
+@_jit
+def path_reward_with_new_task(j, n, state, starts, ends, rewards, path, entry_cost, exit_cost, max_velocity, max_acceleration):
+    travel_cost_sum = 0.0
+    S_p = 0.0
+    for p_idx in range(len(path) + 1):
+        if p_idx < n:
+            t = path[p_idx]
+        elif p_idx == n:
+            t = j
+        else:
+            t = path[p_idx - 1]
+        if p_idx == n:
+            travel_cost_sum += entry_cost
+        elif p_idx == n + 1:
+            travel_cost_sum += exit_cost
+        elif p_idx == 0:
+            travel_cost_sum += travel_cost(state, starts[t], max_velocity, max_acceleration)
+        else:
+            # The preceding task is from the path, as the task after the inserted task is handled above
+            travel_cost_sum += travel_cost(ends[path[p_idx - 1] if p_idx <= n else path[p_idx - 2]], starts[t], max_velocity, max_acceleration)
+        S_p += time_discounted_reward(travel_cost_sum, rewards[t])
+
+    # Add the cost for returning home
+    if n == len(path):
+        travel_cost_sum += exit_cost
+        S_p += time_discounted_reward(travel_cost_sum, rewards[j])
+    else:
+        travel_cost_sum += travel_cost(ends[path[-1]], state, max_velocity, max_acceleration)
+        S_p += time_discounted_reward(travel_cost_sum, rewards[path[-1]])
+    return S_p
+
+
+@_jit
+def time_window_feasible(
+    j, n, is_reversed, state, starts, ends, lengths, start_times, latest_starts, path, times, slack, availability_time, max_velocity, max_acceleration
+):
+    """Checks the time windows of inserting task j at n in the given orientation (see Agent.isTimeWindowFeasible)"""
+    first, last = (ends[j], starts[j]) if is_reversed else (starts[j], ends[j])
+    if n == 0:
+        departure = availability_time
+        previous_end = state
+    else:
+        departure = times[n - 1] + distance_to_cost(lengths[path[n - 1]], max_velocity, max_acceleration)
+        previous_end = ends[path[n - 1]]
+    start = max(departure + travel_cost(previous_end, first, max_velocity, max_acceleration), start_times[j])
+    if start > latest_starts[j]:
+        return False
+    if n == len(path):
+        return True
+    arrival = (
+        start + distance_to_cost(lengths[j], max_velocity, max_acceleration) + travel_cost(last, starts[path[n]], max_velocity, max_acceleration)
+    )
+    return arrival - times[n] <= slack[n]
+
+
+@_jit
+def best_insertions(
+    candidates, state, starts, ends, rewards, lengths, path, remaining_capacity, time_windows, allow_reversal, max_velocity, max_acceleration
+):
+    """Returns the greatest marginal reward, the insertion position and orientation of each candidate task (see CBBA.agent.getCij)
+
+    Insertions which increase the travel cost of the path by more than the remaining capacity are skipped, as well as the
+    insertions violating a time window when time_windows is given as (start_times, latest_starts, times, slack, availability_time).
+    Both are checked in the orientation which is bid on: the orientation minimising the travel cost, or the opposite one when
+    only it is feasible and allow_reversal is set. The travel times are computed with the kinematic profile of the agent,
+    given by max_velocity and max_acceleration.
+    """
+    S_p = path_reward(state, starts, ends, rewards, path, max_velocity, max_acceleration)
+    c = np.zeros(len(starts))
+    best_pos = np.zeros(len(starts), dtype=np.int64)
+    reverse = np.zeros(len(starts))
+    for j in candidates:
+        service_cost = distance_to_cost(lengths[j], max_velocity, max_acceleration)
+        for n in range(len(path) + 1):
+            entry_cost, exit_cost, should_be_reversed, removed_cost = oriented_insertion_costs(
+                j, n, state, starts, ends, path, allow_reversal, max_velocity, max_acceleration
+            )
+            for attempt in range(2 if allow_reversal else 1):
+                if attempt == 1:
+                    should_be_reversed = not should_be_reversed
+                    entry_cost, exit_cost = insertion_costs(j, n, state, starts, ends, path, should_be_reversed, max_velocity, max_acceleration)
+                if entry_cost + service_cost + exit_cost - removed_cost > remaining_capacity:
+                    continue
+                if time_windows is not None:
+                    start_times, latest_starts, times, slack, availability_time = time_windows
+                    if not time_window_feasible(
+                        j,
+                        n,
+                        should_be_reversed,
+                        state,
+                        starts,
+                        ends,
+                        lengths,
+                        start_times,
+                        latest_starts,
+                        path,
+                        times,
+                        slack,
+                        availability_time,
+                        max_velocity,
+                        max_acceleration,
+                    ):
+                        continue
+                S_pj = path_reward_with_new_task(j, n, state, starts, ends, rewards, path, entry_cost, exit_cost, max_velocity, max_acceleration)
+                c_ijn = S_pj - S_p
+                if c[j] < c_ijn:
+                    c[j] = c_ijn
+                    best_pos[j] = n
+                    reverse[j] = should_be_reversed
+                break
+    return c, best_pos, reverse
+
+
+@_jit
+def total_travel_cost(state, starts, ends, lengths, path, max_velocity, max_acceleration):
+    total_cost = 0.0
+    if len(path) > 0:
+        # Add the cost of travelling to the first task
+        total_cost = travel_cost(state, starts[path[0]], max_velocity, max_acceleration)
+        # The cost of travelling between tasks
+        for t_index in range(len(path) - 1):
+            total_cost += travel_cost(ends[path[t_index]], starts[path[t_index + 1]], max_velocity, max_acceleration)
+        # The cost of executing the task
+        for t_index in range(len(path)):
+            total_cost += distance_to_cost(lengths[path[t_index]], max_velocity, max_acceleration)
+        # Add the cost of returning home
+        total_cost += travel_cost(state, ends[path[-1]], max_velocity, max_acceleration)
+    return total_cost
+
+
+@_jit
+def _consensus_action(i, k, y_kj, z_kj, y_ij, z_ij, s_k, timestamps, epsilon):
+    # Returns the action of the CBBA update rules 1-17 for task j and the message of neighbour k: 0 leave, 1 update, 2 reset
+    if z_kj == k:
+        # Rule 1
+        if z_ij == i:
+            if y_kj > y_ij or (abs(y_kj - y_ij) < epsilon and k < i):
+                return 1
+            return 0
+        # Rule 2
+        if z_ij == k:
+            return 1
+        # Rule 3
+        if z_ij != -1:
+            m = z_ij
+            if (s_k[m] > timestamps[m]) or (y_kj > y_ij) or (abs(y_kj - y_ij) < epsilon and k < i):
+                return 1
+            return 0
+        # Rule 4
+        return 1
+    if z_kj == i:
+        # Rule 5
+        if z_ij == i:
+            return 0
+        # Rule 6
+        if z_ij == k:
+            return 2
+        # Rule 7
+        if z_ij != -1:
+            return 2 if s_k[z_ij] > timestamps[z_ij] else 0
+        # Rule 8
+        return 0
+    if z_kj != -1:
+        m = z_kj
+        # Rule 9
+        if z_ij == i:
+            if (s_k[m] >= timestamps[m]) and ((y_kj > y_ij) or (abs(y_kj - y_ij) < epsilon and m < i)):
+                return 1
+            return 0
+        # Rule 10
+        if z_ij == k:
+            return 1 if s_k[m] > timestamps[m] else 2
+        # Rule 11
+        if z_ij == m:
+            return 1 if s_k[m] > timestamps[m] else 0
+        # Rule 12
+        if z_ij != -1:
+            n = z_ij
+            if (
+                (s_k[m] > timestamps[m])
+                and (s_k[n] > timestamps[n])
+                or (s_k[m] > timestamps[m])
+                and (y_kj > y_ij)
+                or (s_k[m] > timestamps[m])
+                and (abs(y_kj - y_ij) < epsilon and m < n)
+                or (s_k[n] > timestamps[n])
+                and (timestamps[m] > s_k[m])
+            ):
+                return 1
+            return 0
+        # Rule 13
+        return 1 if s_k[m] > timestamps[m] else 0
+    # Rule 14
+    if z_ij == i:
+        return 0
+    # Rule 15
+    if z_ij == k:
+        return 1
+    # Rule 16
+    if z_ij != -1:
+        return 1 if s_k[z_ij] > timestamps[z_ij] else 0
+    # Rule 17
+    return 0
+
+
+@_jit
+def consensus_update(
+    i, winning_bids, winning_agents, timestamps, time_step, neighbours, bids, agents, neighbour_timestamps, bundle, removal_list, epsilon
+):
+    """Applies the CBBA consensus rules of agent i (see CBBA.agent.update_task) in place, returns the number of bundle tasks kept
+
+    The messages of the neighbours are given as rows of bids, agents and neighbour_timestamps. A task which is outbid or reset
+    cuts the bundle at its position, the tasks after it are reset and the task is counted in the removal list.
+    """
+    # Update the timestamps
+    for a in range(len(timestamps)):
+        if a == i or (neighbours == a).any():
+            timestamps[a] = time_step
+        elif len(neighbours) > 0:
+            timestamps[a] = neighbour_timestamps[:, a].max()
+
+    bundle_length = len(bundle)
+    for j in range(len(winning_bids)):
+        for r in range(len(neighbours)):
+            action = _consensus_action(
+                i, neighbours[r], bids[r, j], agents[r, j], winning_bids[j], winning_agents[j], neighbour_timestamps[r], timestamps, epsilon
+            )
+            if action == 0:
+                continue
+            if action == 1:
+                winning_bids[j] = bids[r, j]
+                winning_agents[j] = agents[r, j]
+            else:
+                winning_bids[j] = 0
+                winning_agents[j] = -1
+            # Cut the bundle at the updated task
+            for index in range(bundle_length):
+                if bundle[index] == j:
+                    for idx in bundle[index + 1 : bundle_length]:
+                        winning_bids[idx] = 0
+                        winning_agents[idx] = -1
+                    removal_list[j] += 1
+                    bundle_length = index
+                    break
+    return bundle_length
@@ -0,0 +1,139 @@
+"""Local search improvement of the agent paths, applied after the consensus phase
+
+A path is represented by the order of its tasks and the orientation of each task. The travel costs between the agent state and
+the endpoints of the tasks are computed once into a table, after which the cost change of every 2-opt and or-opt move is
+evaluated in a single vectorized step. Reversing a single task (an orientation flip) is the 2-opt move of length one.
+The moves never change the tasks in the path, thus the allocation found by the consensus is kept.
+"""
+import itertools
+import timeit
+
+import numpy as np
+
+from trajallocpy import Agent
+
+EPSILON = 1e-9
+# The longest segment of consecutive tasks moved by or-opt
+MAX_SEGMENT_LENGTH = 3
+
+
+def endpoint_cost_table(state, path_tasks, environment, profile=Agent.DEFAULT_PROFILE):
+    """Returns the travel costs between the agent state (index 0), the starts (1..n) and the ends (n+1..2n) of the tasks
+
+    The distances are looked up once and converted into travel costs with the kinematic profile of the agent in one step.
+    """
+    points = [state] + [task.start for task in path_tasks] + [task.end for task in path_tasks]
+    distances = np.zeros((len(points), len(points)))
+    for a, b in itertools.combinations(range(len(points)), 2):
+        distances[a, b] = distances[b, a] = Agent.getDistance(points[a], points[b], environment)
+    return profile.costs(distances)
+
+
+def _route_points(order, flipped):
+    # The table indices of the point each position of the route is entered from and exited at
+    n = len(order)
+    entries = np.where(flipped[order], order + 1 + n, order + 1)
+    exits = np.where(flipped[order], order + 1, order + 1 + n)
+    return entries, exits
+
+
+def route_cost(table, order, flipped):
+    """Returns the travel cost between the tasks of the route, including leaving and returning to the agent state"""
+    entries, exits = _route_points(order, flipped)
+    return table[np.concatenate(([0], exits)), np.concatenate((entries, [0]))].sum()
+
+
+def _improving_moves(table, order, flipped):
+    # Returns the improving moves as (delta, kind, i, k, reverse), leg q goes from the exit of position q - 1 to the entry of position q
+    n = len(order)
+    entries, exits = _route_points(order, flipped)
+    leg_from = np.concatenate(([0], exits))
+    leg_to = np.concatenate((entries, [0]))
+    legs = table[leg_from, leg_to]
+    moves = []
+
+    # 2-opt: reverse the positions i..k, which only changes the legs entering i and leaving k
+    i, k = np.triu_indices(n)
+    delta = table[leg_from[i], exits[k]] + table[entries[i], leg_to[k + 1]] - legs[i] - legs[k + 1]
+    for index in np.flatnonzero(delta < -EPSILON):
+        moves.append((delta[index], "2-opt", i[index], k[index], False))
+
+    # or-opt: move the segment i..i+length-1 into the leg g, in either direction
+    g = np.arange(n + 1)
+    for length in range(1, min(MAX_SEGMENT_LENGTH, n - 1) + 1):
+        i = np.arange(n - length + 1)
+        segment_entry = entries[i][:, None]
+        segment_exit = exits[i + length - 1][:, None]
+        removal = table[leg_from[i], leg_to[i + length]] - legs[i] - legs[i + length]
+        forward = table[leg_from[g], segment_entry] + table[segment_exit, leg_to[g]] - legs[g]
+        backward = table[leg_from[g], segment_exit] + table[segment_entry, leg_to[g]] - legs[g]
+        # The legs next to the segment are the ones being removed
+        valid = (g < i[:, None]) | (g > i[:, None] + length)
+        for reverse, insertion in ((False, forward), (True, backward)):
+            delta = np.where(valid, removal[:, None] + insertion, np.inf)
+            for a, b in zip(*np.nonzero(delta < -EPSILON)):
+                moves.append((delta[a, b], "or-opt", i[a], (length, g[b]), reverse))
+    moves.sort(key=lambda move: move[0])
+    return moves
+
+
+def _apply_move(order, flipped, kind, i, k, reverse):
+    order = order.copy()
+    flipped = flipped.copy()
+    if kind == "2-opt":
+        segment = order[i : k + 1][::-1]
+        order[i : k + 1] = segment
+        flipped[segment] = ~flipped[segment]
+    else:
+        length, gap = k
+        segment = order[i : i + length]
+        remaining = np.delete(order, np.arange(i, i + length))
+        if reverse:
+            segment = segment[::-1]
+            flipped[segment] = ~flipped[segment]
+        order = np.insert(remaining, gap if gap < i else gap - length, segment)
+    return order, flipped
+
+
+def schedule_feasible(table, service_costs, start_times, latest_starts, availability_time, order, flipped):
+    """Checks whether every task of the route starts within its time window (see Agent.getScheduleTimes)"""
+    entries, exits = _route_points(order, flipped)
+    time = availability_time
+    previous = 0
+    for task, entry, exit in zip(order, entries, exits):
+        time = max(time + table[previous, entry], start_times[task])
+        if time > latest_starts[task]:
+            return False
+        time += service_costs[task]
+        previous = exit
+    return True
+
+
+def improve_route(table, time_budget=None, is_feasible=None):
+    """Applies the best improving move until none is left or the time budget (seconds) is spent
+
+    Parameters
+    ----------
+    table
+        The endpoint cost table of the route, see endpoint_cost_table
+    is_feasible
+        Optional function of (order, flipped), moves resulting in an infeasible route are skipped
+
+    Returns
+    -------
+    tuple
+        The order of the tasks and whether each task (indexed by its original position) is reversed
+    """
+    n = (len(table) - 1) // 2
+    order = np.arange(n)
+    flipped = np.zeros(n, dtype=bool)
+    start_time = timeit.default_timer()
+    while time_budget is None or timeit.default_timer() - start_time < time_budget:
+        for _, *move in _improving_moves(table, order, flipped):
+            new_order, new_flipped = _apply_move(order, flipped, *move)
+            if is_feasible is None or is_feasible(new_order, new_flipped):
+                order, flipped = new_order, new_flipped
+                break
+        else:
+            break
+    return order, flipped
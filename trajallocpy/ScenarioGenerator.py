@@ -0,0 +1,169 @@
+"""Synthetic coverage problems for scaling tests and benchmarks, generated offline
+
+The scenarios have a square boundary, random or clustered polygonal obstacles and tasks along a sweep (lawnmower) pattern over
+the free space, like the scenarios generated from map data by TaskGenerator and DemaScenarios/task_generator.py, but without
+network access or optional dependencies. The generation is seeded and vectorized, the geometry of a million tasks is generated
+in less than a second.
+"""
+import json
+
+import numpy as np
+import shapely
+
+from trajallocpy import CoverageProblem, Utility
+
+# Number of vertices of a generated obstacle
+OBSTACLE_VERTICES = 8
+
+_TASKS_PLACEHOLDER = "__tasks__"
+
+
+def _obstacle_centers(rng: np.random.Generator, n_obstacles, size, layout, n_clusters):
+    if layout == "random":
+        return rng.uniform(0, size, (n_obstacles, 2))
+    if layout == "clustered":
+        cluster_centers = rng.uniform(0.2 * size, 0.8 * size, (n_clusters, 2))
+        centers = cluster_centers[rng.integers(n_clusters, size=n_obstacles)] + rng.normal(0, 0.08 * size, (n_obstacles, 2))
+        return np.clip(centers, 0, size)
+    raise ValueError(f"Error: unknown obstacle layout {layout}")
+
+
+def _obstacles(rng: np.random.Generator, n_obstacles, size, coverage, layout, n_clusters):
+    # Returns the obstacles as disjoint polygons without holes inside the boundary
+    if n_obstacles == 0 or coverage <= 0:
+        return np.empty(0, dtype=object)
+    centers = _obstacle_centers(rng, n_obstacles, size, layout, n_clusters)
+    # Star shaped polygons, the radius is chosen such that the obstacles cover roughly the given fraction of the boundary
+    radius = np.sqrt(coverage * size**2 / (n_obstacles * np.pi)) * rng.uniform(0.5, 1.5, (n_obstacles, 1))
+    angles = np.sort(rng.uniform(0, 2 * np.pi, (n_obstacles, OBSTACLE_VERTICES)), axis=1)
+    radii = radius * rng.uniform(0.6, 1.0, (n_obstacles, OBSTACLE_VERTICES))
+    coords = centers[:, None, :] + radii[..., None] * np.stack([np.cos(angles), np.sin(angles)], axis=-1)
+    polygons = shapely.make_valid(shapely.polygons(coords))
+    # Overlapping obstacles are merged, the obstacles must be disjoint and keep a margin to the boundary
+    margin = 0.01 * size
+    merged = shapely.intersection(shapely.union_all(polygons), shapely.box(margin, margin, size - margin, size - margin))
+    parts = shapely.get_parts(merged)
+    parts = parts[shapely.get_type_id(parts) == shapely.GeometryType.POLYGON]
+    return shapely.polygons(shapely.get_exterior_ring(parts))
+
+
+def _sweep_segments(size, spacing, obstacles):
+    # Returns the start and end points of the free parts of the sweep lines, every other line is swept in the opposite direction
+    n_lines = max(1, int(round(size / spacing)))
+    ys = (np.arange(n_lines) + 0.5) * size / n_lines
+    lines = shapely.linestrings(np.stack([np.zeros(n_lines), ys, np.full(n_lines, size), ys], axis=1).reshape(n_lines, 2, 2))
+    if len(obstacles) > 0:
+        lines = shapely.difference(lines, shapely.union_all(obstacles))
+    segments, line_index = shapely.get_parts(lines, return_index=True)
+    # The lines only touching an obstacle leave points
+    is_segment = (shapely.get_type_id(segments) == shapely.GeometryType.LINESTRING) & (shapely.length(segments) > 0)
+    segments, line_index = segments[is_segment], line_index[is_segment]
+    starts = shapely.get_coordinates(shapely.get_point(segments, 0))
+    ends = shapely.get_coordinates(shapely.get_point(segments, -1))
+    backwards = line_index % 2 == 1
+    starts[backwards], ends[backwards] = ends[backwards], starts[backwards]
+    return starts, ends
+
+
+def _split_segments(starts, ends, n_tasks):
+    # Splits the segments into exactly n_tasks pieces, the pieces are divided by the length of the segments (largest remainder)
+    lengths = np.linalg.norm(ends - starts, axis=1)
+    quotas = lengths / lengths.sum() * n_tasks
+    pieces = np.floor(quotas).astype(np.int64)
+    pieces[np.argsort(pieces - quotas, kind="stable")[: n_tasks - pieces.sum()]] += 1
+    segment = np.repeat(np.arange(len(starts)), pieces)
+    # Index of each piece within its segment
+    index = np.arange(n_tasks) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    direction = (ends - starts)[segment] / pieces[segment, None]
+    piece_starts = starts[segment] + direction * index[:, None]
+    return piece_starts, piece_starts + direction
+
+
+def generate_arrays(
+    n_tasks,
+    density=1e-3,
+    n_obstacles=10,
+    obstacle_coverage=0.1,
+    obstacle_layout="random",
+    n_clusters=3,
+    task_aspect=4.0,
+    seed=None,
+):
+    """Generates the geometry of a synthetic coverage problem
+
+    Parameters
+    ----------
+    n_tasks
+        The number of tasks
+    density
+        The number of tasks per unit area of the boundary, which is a square of side sqrt(n_tasks / density)
+    n_obstacles
+        The number of generated obstacles, overlapping obstacles are merged
+    obstacle_coverage
+        The approximate fraction of the boundary covered by the obstacles
+    obstacle_layout
+        "random" places the obstacles uniformly, "clustered" places them around n_clusters random centers
+    task_aspect
+        The ratio of the task length to the distance between the sweep lines, before the sweep lines are cut by the obstacles
+    seed
+        Seed of the random number generator, the same seed gives the same scenario
+
+    Returns
+    -------
+    dict
+        The boundary, obstacles and tasks as (coords, offsets) of ragged arrays (see shapely.to_ragged_array), the tasks
+        are lines from their start to their end point
+    """
+    if n_tasks < 1 or density <= 0:
+        raise ValueError("Error: the number of tasks and the density must be positive")
+    rng = np.random.default_rng(seed)
+    size = np.sqrt(n_tasks / density)
+    obstacles = _obstacles(rng, n_obstacles, size, obstacle_coverage, obstacle_layout, n_clusters)
+    starts, ends = _sweep_segments(size, np.sqrt(1 / (density * task_aspect)), obstacles)
+    if len(starts) == 0:
+        raise ValueError("Error: the obstacles cover all the sweep lines, reduce the obstacle coverage")
+    piece_starts, piece_ends = _split_segments(starts, ends, n_tasks)
+
+    _, boundary_coords, boundary_offsets = shapely.to_ragged_array([shapely.box(0, 0, size, size)])
+    if len(obstacles) > 0:
+        _, obstacle_coords, obstacle_offsets = shapely.to_ragged_array(obstacles)
+    else:
+        obstacle_coords, obstacle_offsets = np.empty((0, 2)), (np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64))
+    task_coords = np.stack([piece_starts, piece_ends], axis=1).reshape(-1, 2)
+    return {
+        "boundary": (boundary_coords, boundary_offsets),
+        "obstacles": (obstacle_coords, obstacle_offsets),
+        "tasks": (task_coords, (np.arange(0, len(task_coords) + 1, 2),)),
+    }
+
+
+def generate_coverage_problem(n_tasks, **kwargs) -> CoverageProblem.CoverageProblem:
+    """Generates a synthetic coverage problem (see generate_arrays for the parameters), it is identical to the problem loaded
+    from the scenario exported with export_geojson"""
+    arrays = generate_arrays(n_tasks, **kwargs)
+    return Utility.coverageProblemFromArrays(Utility.normalizeCoverageArrays(arrays["boundary"], arrays["tasks"], arrays["obstacles"]))
+
+
+def _polygon_coordinates(coords, offsets):
+    ring_offsets, polygon_offsets = offsets
+    rings = [coords[start:end].tolist() for start, end in zip(ring_offsets[:-1], ring_offsets[1:])]
+    return [rings[start:end] for start, end in zip(polygon_offsets[:-1], polygon_offsets[1:])]
+
+
+def export_geojson(arrays, file_name):
+    """Writes the generated scenario as a GeoJSON file with the features "boundary", "obstacles" and "tasks", which can be
+    loaded with Utility.loadCoverageProblem"""
+    task_coords, _ = arrays["tasks"]
+    features = [
+        {"type": "Feature", "id": "boundary", "properties": {}, "geometry": {"type": "Polygon", "coordinates": _polygon_coordinates(*arrays["boundary"])[0]}},
+        {"type": "Feature", "id": "obstacles", "properties": {}, "geometry": {"type": "MultiPolygon", "coordinates": _polygon_coordinates(*arrays["obstacles"])}},
+        {"type": "Feature", "id": "tasks", "properties": {}, "geometry": {"type": "MultiLineString", "coordinates": _TASKS_PLACEHOLDER}},
+    ]
+    # The scenarios are in a local metric frame
+    crs = {"type": "name", "properties": {"name": "urn:ogc:def:crs:EPSG::2197"}}
+    # The task coordinates are formatted in one step instead of by the json module, all the tasks are lines of two points
+    n_tasks = len(task_coords) // 2
+    task_json = "[" + ",".join(["[[%r,%r],[%r,%r]]"] * n_tasks) % tuple(task_coords.ravel().tolist()) + "]"
+    document = json.dumps({"type": "FeatureCollection", "crs": crs, "features": features})
+    with open(file_name, "w") as f:
+        f.write(document.replace(json.dumps(_TASKS_PLACEHOLDER), task_json, 1))
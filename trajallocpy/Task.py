@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import copy
+import math
 from dataclasses import dataclass
 
 import shapely
@@ -33,18 +35,37 @@ class TrajectoryTask:
     duration: float = 0  # task default duration (sec)
     length: float = 0
     task_type: int = 1
+    reversed: bool = False  # The trajectory is traversed from its last to its first point
 
     def __post_init__(self):
-        self.start = self.trajectory.coords[0]
-        self.end = self.trajectory.coords[-1]
-        self.length = self.trajectory.length  # unitless length
+        # The start, end and length can be given directly when the tasks are created in bulk
+        if self.start is None:
+            self.start = self.trajectory.coords[-1 if self.reversed else 0]
+        if self.end is None:
+            self.end = self.trajectory.coords[0 if self.reversed else -1]
+        if not self.length:
+            self.length = self.trajectory.length  # unitless length
         # TODO init the task cost/length/time
 
     def reverse(self):
-        self.trajectory = shapely.LineString(self.trajectory.coords[::-1])
-        # re initialize the start and end
-        self.end = self.trajectory.coords[0]
-        self.start = self.trajectory.coords[-1]
+        # Only the orientation is changed, the trajectory geometry is kept as given
+        self.reversed = not self.reversed
+        self.start, self.end = self.end, self.start
+
+    def reversed_copy(self):
+        """Returns a reversed copy sharing the trajectory geometry, used for reversing a task shared between agents"""
+        task = copy.copy(self)
+        task.reverse()
+        return task
+
+    @property
+    def coords(self):
+        """The points of the trajectory in the direction it is traversed, the reversed sequence is only built when needed"""
+        return self.trajectory.coords[::-1] if self.reversed else self.trajectory.coords
+
+    def getLatestStartTime(self):
+        # An end time of 0 means the task does not expire
+        return self.end_time if self.end_time > 0 else math.inf
 
     def getDuration(self, velocity, acceleration):
         # Velocity ramp
@@ -0,0 +1,283 @@
+"""Transports for exchanging batches of BidInformation between agents running in separate processes or on separate nodes
+
+A transport broadcasts a batch of bids to all the other agents and returns the batches received from them. The SocketTransport
+exchanges length prefixed messages over Unix or TCP sockets with non-blocking I/O, such that an agent never waits for a slow
+or not yet started peer: the messages to a peer are queued until it accepts the connection.
+
+On the wire a batch is an array of fixed width records (BID_DTYPE, 24 bytes per bid). A batch is encoded by copying the records
+into the message once and decoded as an array viewing the received payload, without creating an object per bid.
+"""
+import collections
+import errno
+import os
+import select
+import selectors
+import socket
+import struct
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from trajallocpy.Agent import BidInformation
+
+# Message header holding the length of the payload and the id of the sender
+_HEADER = struct.Struct("!Ii")
+
+# Fixed width little endian record of a bid, the fields are in the order of BidInformation
+BID_DTYPE = np.dtype([("y", "<f8"), ("z", "<i2"), ("t", "<f8"), ("j", "<i4"), ("k", "<i2")])
+
+
+def to_bid_array(bids) -> np.ndarray:
+    """Returns the bids (a list of BidInformation or a bid array) as an array of BID_DTYPE records"""
+    if isinstance(bids, np.ndarray):
+        return bids.astype(BID_DTYPE, copy=False)
+    return np.array([(bid.y, bid.z, bid.t, bid.j, bid.k) for bid in bids], dtype=BID_DTYPE)
+
+
+def from_bid_array(bids: np.ndarray) -> List[BidInformation]:
+    return [BidInformation(*bid) for bid in bids.tolist()]
+
+
+def encode_bids(bids) -> bytes:
+    return to_bid_array(bids).tobytes()
+
+
+def decode_bids(payload) -> np.ndarray:
+    """Returns a read-only bid array viewing the payload, without copying it"""
+    return np.frombuffer(payload, dtype=BID_DTYPE)
+
+
+def local_addresses(n_agents, directory):
+    """Returns a Unix socket address in the directory for each agent id"""
+    return {agent_id: os.path.join(directory, f"agent_{agent_id}.sock") for agent_id in range(n_agents)}
+
+
+class Transport:
+    """Interface of the transports used by the asynchronous agents (see ACBBA.agent.run)"""
+
+    def __init__(self, id, peer_ids):
+        self.id = id
+        self.peer_ids = set(peer_ids)
+        # The agents a message has been received from
+        self.heard = set()
+
+    @property
+    def heard_all(self):
+        """Whether a message has been received from every other agent"""
+        return self.heard >= self.peer_ids
+
+    def send(self, bids, destinations=None):
+        """Sends the bids (a list of BidInformation or a bid array) to the destinations, all the other agents by default, without
+        blocking. An empty batch announces the agent"""
+        raise NotImplementedError()
+
+    def receive(self, timeout=0.0) -> np.ndarray:
+        """Returns the bid array received since the last call, waits at most timeout seconds for the first message"""
+        raise NotImplementedError()
+
+    @property
+    def pending(self):
+        """Whether some of the sent bids have not yet been delivered to all the other agents"""
+        return False
+
+    def close(self):
+        pass
+
+
+class _Peer:
+    def __init__(self, address):
+        self.address = address
+        self.socket = None
+        self.connected = False
+        # The messages not yet delivered and the number of bytes sent of the first one
+        self.pending = collections.deque()
+        self.offset = 0
+        # The time the connection was started while it is in progress
+        self.connect_started = None
+
+
+class SocketTransport(Transport):
+    """Transport over Unix (the address is a path) or TCP (the address is a (host, port) tuple) stream sockets
+
+    Parameters
+    ----------
+    id
+        The id of the agent, it listens on addresses[id]
+    addresses
+        The address of every agent by id
+    connect_timeout
+        The time (sec) for a peer to accept a connection before it is retried, the connecting, sending and receiving never blocks
+    """
+
+    def __init__(self, id, addresses: Dict[int, object], connect_timeout=1.0):
+        super().__init__(id, [peer_id for peer_id in addresses if peer_id != id])
+        self.connect_timeout = connect_timeout
+        self.peers = {peer_id: _Peer(address) for peer_id, address in addresses.items() if peer_id != id}
+        self.selector = selectors.DefaultSelector()
+        # The incoming data of each accepted connection which is not yet a complete message
+        self.buffers = {}
+        # Number of messages and bytes sent (counted per destination) and received, for measuring the throughput
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+        address = addresses[id]
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)
+        self.server = socket.socket(self.__family(address), socket.SOCK_STREAM)
+        if self.server.family != socket.AF_UNIX:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(address)
+        self.server.listen()
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ)
+
+    @staticmethod
+    def __family(address):
+        return socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+
+    def __connect(self, peer: _Peer):
+        # Starts connecting without blocking, a TCP connection in progress is completed by __finish_connect
+        sock = socket.socket(self.__family(peer.address), socket.SOCK_STREAM)
+        if sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setblocking(False)
+        error = sock.connect_ex(peer.address)
+        peer.socket = sock
+        if error == 0:
+            peer.connected = True
+        elif error == errno.EINPROGRESS:
+            # The socket becomes writable when the connection is completed, which wakes up receive
+            peer.connect_started = time.monotonic()
+            self.selector.register(sock, selectors.EVENT_WRITE, peer)
+        else:
+            # Refused, a missing Unix socket or (EAGAIN) a full backlog of a Unix socket
+            self.__connect_failed(peer)
+
+    def __finish_connect(self, peer: _Peer) -> bool:
+        # Returns whether the connection in progress is completed
+        _, writable, _ = select.select([], [peer.socket], [], 0)
+        if len(writable) == 0:
+            if time.monotonic() - peer.connect_started > self.connect_timeout:
+                self.selector.unregister(peer.socket)
+                self.__connect_failed(peer)
+            return False
+        self.selector.unregister(peer.socket)
+        if peer.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+            self.__connect_failed(peer)
+            return False
+        peer.connect_started = None
+        peer.connected = True
+        return True
+
+    def __connect_failed(self, peer: _Peer):
+        peer.socket.close()
+        peer.socket = None
+        peer.connect_started = None
+        if peer.connected:
+            # The peer has stopped, its messages are dropped
+            peer.pending.clear()
+            peer.offset = 0
+        # Otherwise the peer is not listening yet, retried on the next flush
+
+    def __flush(self, peer: _Peer):
+        if len(peer.pending) > 0 and peer.socket is None:
+            self.__connect(peer)
+        if peer.connect_started is not None and not self.__finish_connect(peer):
+            return
+        while len(peer.pending) > 0 and peer.socket is not None:
+            message = peer.pending[0]
+            try:
+                peer.offset += peer.socket.send(memoryview(message)[peer.offset :])
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as error:
+                if error.errno not in (errno.EPIPE, errno.ECONNRESET):
+                    raise
+                # The peer dropped the connection along with the partial message, which is resent after reconnecting
+                peer.socket.close()
+                peer.socket = None
+                peer.offset = 0
+                return
+            if peer.offset < len(message):
+                return
+            peer.pending.popleft()
+            peer.offset = 0
+
+    def send(self, bids, destinations=None):
+        bids = to_bid_array(bids)
+        # The records are copied once, directly into the message
+        message = bytearray(_HEADER.size + bids.nbytes)
+        _HEADER.pack_into(message, 0, bids.nbytes, self.id)
+        message[_HEADER.size :] = bids.data.cast("B")
+        peers = list(self.peers.values()) if destinations is None else [self.peers[peer_id] for peer_id in destinations]
+        for peer in peers:
+            peer.pending.append(message)
+            self.__flush(peer)
+        self.messages_sent += len(peers)
+        self.bytes_sent += len(message) * len(peers)
+
+    def __read(self, sock) -> List[np.ndarray]:
+        # Returns the bid arrays of the messages completed by the received data
+        buffer = self.buffers[sock]
+        try:
+            data = sock.recv(1 << 16)
+        except (BlockingIOError, InterruptedError):
+            return []
+        if len(data) == 0:
+            self.selector.unregister(sock)
+            sock.close()
+            del self.buffers[sock]
+            return []
+        buffer += data
+        self.bytes_received += len(data)
+        batches = []
+        while len(buffer) >= _HEADER.size:
+            length, sender = _HEADER.unpack_from(buffer)
+            if len(buffer) < _HEADER.size + length:
+                break
+            # The bids are decoded from a view of the receive buffer and only the bid array is copied, the view is released
+            # before the buffer is shrunk, which is reused for the next messages
+            with memoryview(buffer) as view:
+                batches.append(decode_bids(view[_HEADER.size : _HEADER.size + length]).copy())
+            del buffer[: _HEADER.size + length]
+            self.heard.add(sender)
+            self.messages_received += 1
+        return batches
+
+    def receive(self, timeout=0.0) -> np.ndarray:
+        for peer in self.peers.values():
+            self.__flush(peer)
+        batches = []
+        for key, _ in self.selector.select(timeout):
+            if isinstance(key.data, _Peer):
+                # A connection in progress has completed
+                self.__flush(key.data)
+            elif key.fileobj is self.server:
+                connection, _ = self.server.accept()
+                connection.setblocking(False)
+                self.selector.register(connection, selectors.EVENT_READ)
+                self.buffers[connection] = bytearray()
+            else:
+                batches.extend(self.__read(key.fileobj))
+        if len(batches) == 1:
+            return batches[0]
+        return np.concatenate(batches) if len(batches) > 0 else np.empty(0, dtype=BID_DTYPE)
+
+    @property
+    def pending(self):
+        return any(len(peer.pending) > 0 for peer in self.peers.values())
+
+    def close(self):
+        for peer in self.peers.values():
+            if peer.socket is not None:
+                peer.socket.close()
+        for sock in list(self.buffers):
+            sock.close()
+        self.selector.close()
+        address = self.server.getsockname()
+        self.server.close()
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)
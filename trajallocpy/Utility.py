@@ -1,14 +1,19 @@
+import itertools
+import json
+import multiprocessing
 import os
+import queue
 import time
 
 import matplotlib.pyplot as plt
 import networkx as nx
 import numpy as np
-from matplotlib.animation import FuncAnimation
+import shapely
+from matplotlib.animation import FFMpegWriter, FuncAnimation
 from matplotlib.lines import Line2D
 from matplotlib.patches import Polygon as PolygonPatch
 
-from trajallocpy import CBBA, Agent
+from trajallocpy import CBBA, Agent, CoverageProblem, Task
 
 
 def timing(f):
@@ -137,6 +142,131 @@ class Plotter:
             )
 
 
+def _live_plot_worker(frames: multiprocessing.Queue, search_area, restricted_areas, states, colors, fps, animation_file, frame_directory, show):
+    # Draws the route snapshots of LivePlotter, the routes and title are blitted over the static background. The frames are
+    # written as they are drawn, such that they are never held in memory
+    if not show:
+        plt.switch_backend("agg")
+    fig, ax = plt.subplots()
+    ax.add_patch(PolygonPatch(search_area, fill=False, edgecolor=(0, 0, 0, 0.5)))
+    for area in restricted_areas:
+        ax.add_patch(PolygonPatch(area, facecolor=(0, 0, 0, 0.2)))
+    ax.scatter(states[:, 0], states[:, 1], color="black")
+    ax.autoscale_view()
+    lines = [ax.plot([], [], linestyle="solid", color=color, linewidth=1.5, animated=True)[0] for color in colors]
+    title = ax.set_title("", animated=True)
+    if show:
+        plt.show(block=False)
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(fig.bbox)
+    writer = None
+    if animation_file is not None:
+        writer = FFMpegWriter(fps=fps)
+        writer.setup(fig, animation_file)
+    if frame_directory is not None:
+        os.makedirs(frame_directory, exist_ok=True)
+
+    n_frames = 0
+    stopped = False
+    while not stopped:
+        frame = frames.get()
+        if frame is None:
+            break
+        # Only draw the newest snapshot when the solver is ahead of the plotting, the last snapshot is drawn before stopping
+        while True:
+            try:
+                newer = frames.get_nowait()
+            except queue.Empty:
+                break
+            if newer is None:
+                stopped = True
+                break
+            frame = newer
+        text, routes = frame
+        fig.canvas.restore_region(background)
+        for line, route in zip(lines, routes):
+            line.set_data(route[:, 0], route[:, 1])
+            ax.draw_artist(line)
+        title.set_text(text)
+        fig.draw_artist(title)
+        fig.canvas.blit(fig.bbox)
+        fig.canvas.flush_events()
+        if writer is not None:
+            writer.grab_frame()
+        if frame_directory is not None:
+            fig.savefig(os.path.join(frame_directory, f"frame_{n_frames:05d}.png"))
+        n_frames += 1
+
+    if writer is not None:
+        writer.finish()
+    if show:
+        plt.show()
+
+
+class LivePlotter:
+    """Plots the routes of the agents in a separate process while solving, such that the plotting never blocks the solver
+
+    Used as the callback of Runner.solve, the routes are sent at most max_fps times per second and the task trajectories
+    are connected directly instead of by shortest paths. The frames are written as they are drawn: to animation_file
+    (e.g. an MP4 or GIF) through ffmpeg, and to frame_directory as one PNG per frame.
+    """
+
+    def __init__(
+        self, coverage_problem: CoverageProblem.CoverageProblem, robot_list, max_fps=10, animation_file=None, frame_directory=None, show=True
+    ):
+        if animation_file is not None and not FFMpegWriter.isAvailable():
+            raise ValueError("Error: writing an animation file requires ffmpeg, use frame_directory for writing the frames as PNG files")
+        self.robot_list = list(robot_list)
+        self.min_interval = 1 / max_fps
+        self.last_frame = -np.inf
+        self.pending = None
+        self.frames = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=_live_plot_worker,
+            args=(
+                self.frames,
+                shapely.get_coordinates(coverage_problem.getSearchArea().exterior),
+                [shapely.get_coordinates(area.exterior) for area in coverage_problem.getRestrictedAreas().geoms],
+                np.array([robot.state for robot in self.robot_list]),
+                [robot.color for robot in self.robot_list],
+                max_fps,
+                animation_file,
+                frame_directory,
+                show,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+
+    def __send(self, text):
+        routes = []
+        for robot in self.robot_list:
+            route = [robot.state, *Agent.getTrajectory(robot.getPathTasks()), robot.state]
+            routes.append(np.array(route, dtype=float)[:, :2])
+        self.frames.put((text, routes))
+        self.last_frame = time.monotonic()
+        self.pending = None
+
+    def update(self, round_info):
+        """Sends the current routes, unless a frame has been sent within the last 1 / max_fps seconds"""
+        text = f"Iteration {round_info.iteration + 1}"
+        if time.monotonic() - self.last_frame >= self.min_interval:
+            self.__send(text)
+        else:
+            self.pending = text
+
+    def close(self, wait=True, text=None):
+        """Sends the final routes, titled text when given, and stops the plotting. Waits for the frames to be written (and the
+        window to be closed)"""
+        if text is not None:
+            self.pending = text
+        if self.pending is not None:
+            self.__send(self.pending)
+        self.frames.put(None)
+        if wait:
+            self.process.join()
+
+
 def loadDataset(directory, route_data_name, holes_name, outer_poly_name):
     csv_files = []
     for filename in os.listdir(directory):
@@ -149,6 +279,142 @@ def loadDataset(directory, route_data_name, holes_name, outer_poly_name):
     return csv_files
 
 
+# Version of the binary sidecar format written by loadCoverageProblem
+SIDECAR_VERSION = 1
+
+
+def _coordinate_array(points):
+    coords = np.array(points, dtype=np.float64)
+    return coords[:, :2] if len(coords) > 0 else np.empty((0, 2))
+
+
+def _ragged_lines(geometry):
+    # Returns the coordinates and offsets of the lines in a (Multi)LineString
+    lines = geometry["coordinates"] if geometry["type"] == "MultiLineString" else [geometry["coordinates"]]
+    coords = _coordinate_array(list(itertools.chain.from_iterable(lines)))
+    offsets = np.concatenate([[0], np.cumsum([len(line) for line in lines])])
+    return coords, (offsets,)
+
+
+def _ragged_polygons(geometry):
+    # Returns the coordinates, ring offsets and polygon offsets of the polygons in a (Multi)Polygon
+    polygons = geometry["coordinates"] if geometry["type"] == "MultiPolygon" else [geometry["coordinates"]]
+    rings = list(itertools.chain.from_iterable(polygons))
+    coords = _coordinate_array(list(itertools.chain.from_iterable(rings)))
+    ring_offsets = np.concatenate([[0], np.cumsum([len(ring) for ring in rings])])
+    polygon_offsets = np.concatenate([[0], np.cumsum([len(polygon) for polygon in polygons])])
+    return coords, (ring_offsets, polygon_offsets)
+
+
+def _parseCoverageGeoJSON(file_name):
+    with open(file_name) as json_file:
+        geojson_file = json.load(json_file)
+    if "crs" not in geojson_file:
+        print("Warning! No CRS is given and can cause odd behaviours!")
+    features = {feature["id"]: feature["geometry"] for feature in geojson_file["features"] if feature["geometry"]}
+    return normalizeCoverageArrays(
+        _ragged_polygons(features["boundary"]),
+        _ragged_lines(features.get("tasks", {"type": "MultiLineString", "coordinates": []})),
+        _ragged_polygons(features.get("obstacles", {"type": "MultiPolygon", "coordinates": []})),
+    )
+
+
+def normalizeCoverageArrays(boundary, tasks, obstacles) -> dict:
+    """Returns the arrays of a coverage problem, which are stored in the sidecar file of loadCoverageProblem
+
+    The geometries are normalized like in loadCoverageProblem: they are translated such that the boundary starts in (0, 0),
+    the boundary is buffered by 1 and the obstacles by -1.
+
+    Parameters
+    ----------
+    boundary, obstacles
+        The polygons as (coords, (ring_offsets, polygon_offsets)), see shapely.to_ragged_array
+    tasks
+        The task lines as (coords, (offsets,))
+
+    Returns
+    -------
+    dict
+        The coordinates and offsets of the boundary, obstacles and tasks, see coverageProblemFromArrays
+    """
+    (boundary_coords, boundary_offsets), (task_coords, task_offsets), (obstacle_coords, obstacle_offsets) = boundary, tasks, obstacles
+    boundary_coords, task_coords, obstacle_coords = (np.array(coords, dtype=np.float64) for coords in (boundary_coords, task_coords, obstacle_coords))
+
+    # Normalize the geoms, such that the boundary starts in (0, 0)
+    origin = boundary_coords.min(axis=0)
+    boundary_coords -= origin
+    task_coords -= origin
+    obstacle_coords -= origin
+
+    boundary = shapely.from_ragged_array(shapely.GeometryType.POLYGON, boundary_coords, boundary_offsets)[0].buffer(1)
+    obstacles = shapely.from_ragged_array(shapely.GeometryType.POLYGON, obstacle_coords, obstacle_offsets)
+    obstacles = shapely.get_parts(shapely.buffer(obstacles, -1))
+    obstacles = obstacles[~shapely.is_empty(obstacles)]
+
+    arrays = {"task_coords": task_coords, "task_offsets": task_offsets[0]}
+    for name, geometries in (("boundary", [boundary]), ("obstacles", obstacles)):
+        if len(geometries) == 0:
+            coords, ring_offsets, polygon_offsets = np.empty((0, 2)), np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+        else:
+            _, coords, (ring_offsets, polygon_offsets) = shapely.to_ragged_array(geometries)
+        arrays.update({f"{name}_coords": coords, f"{name}_ring_offsets": ring_offsets, f"{name}_polygon_offsets": polygon_offsets})
+    return arrays
+
+
+def loadCoverageProblem(file_name, use_sidecar=False) -> CoverageProblem.CoverageProblem:
+    """Loads a coverage problem from a GeoJSON file with the features "boundary", "obstacles" and "tasks"
+
+    The coordinates are parsed directly into NumPy arrays and the geometries are created with the vectorized shapely functions.
+    The geometries are translated such that the boundary starts in (0, 0), the boundary is buffered by 1 and the obstacles by -1.
+
+    Parameters
+    ----------
+    file_name
+        Path to the GeoJSON file
+    use_sidecar
+        Whether to store the parsed arrays in a binary file next to the GeoJSON file ("<file_name>.npz"), which is used
+        instead of parsing the GeoJSON as long as the GeoJSON file is unchanged
+    """
+    source = os.stat(file_name)
+    sidecar_name = file_name + ".npz"
+    arrays = None
+    if use_sidecar and os.path.isfile(sidecar_name):
+        with np.load(sidecar_name) as data:
+            if int(data["version"]) == SIDECAR_VERSION and data["source"].tolist() == [source.st_size, source.st_mtime_ns]:
+                arrays = {key: data[key] for key in data.files}
+    if arrays is None:
+        arrays = _parseCoverageGeoJSON(file_name)
+        if use_sidecar:
+            np.savez(sidecar_name, version=SIDECAR_VERSION, source=np.array([source.st_size, source.st_mtime_ns]), **arrays)
+    return coverageProblemFromArrays(arrays)
+
+
+def coverageProblemFromArrays(arrays) -> CoverageProblem.CoverageProblem:
+    """Creates the coverage problem from the arrays returned by normalizeCoverageArrays, the geometries and tasks are
+    created in bulk with the vectorized shapely functions"""
+    boundary, obstacles = (
+        shapely.from_ragged_array(
+            shapely.GeometryType.POLYGON, arrays[f"{name}_coords"], (arrays[f"{name}_ring_offsets"], arrays[f"{name}_polygon_offsets"])
+        )
+        for name in ("boundary", "obstacles")
+    )
+
+    task_coords, task_offsets = arrays["task_coords"], arrays["task_offsets"]
+    lines = shapely.from_ragged_array(shapely.GeometryType.LINESTRING, task_coords, (task_offsets,))
+    starts = map(tuple, task_coords[task_offsets[:-1]].tolist())
+    ends = map(tuple, task_coords[task_offsets[1:] - 1].tolist())
+    lengths = shapely.length(lines).tolist()
+    task_list = [
+        Task.TrajectoryTask(id, line, start=start, end=end, length=length) for id, (line, start, end, length) in enumerate(zip(lines, starts, ends, lengths))
+    ]
+
+    return CoverageProblem.CoverageProblem(
+        restricted_areas=shapely.MultiPolygon(obstacles.tolist()),
+        search_area=boundary[0],
+        tasks=task_list,
+    )
+
+
 def getAllCoverageFiles(dataset, directory="CoverageTasks/"):
     result = []
     for filename in os.listdir(directory + dataset):
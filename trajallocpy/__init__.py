@@ -1 +1 @@
-from trajallocpy import ACBBA, CBBA, Agent, CoverageProblem, Experiment, Task
+from trajallocpy import ACBBA, CBBA, Agent, CoverageProblem, Experiment, ScenarioGenerator, Task, Transport